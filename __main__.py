@@ -1,8 +1,12 @@
 import logging
 import multiprocessing
+import signal
+import threading
 from reactivex.scheduler import ThreadPoolScheduler
 
 from src.config import *
+from src.exceptions import WatermarkFieldException
+from src.metrics import MetricsExporter, getMetrics, logSummary
 from src.mongo_service import MongoService
 from src.web_scrap import WebScrap
 from src.web_scrap_processor import WebScrapProcessor
@@ -11,16 +15,14 @@ from src.web_scrap_processor import WebScrapProcessor
 def main():
     #Setup logger
     logging.basicConfig(level=logging.INFO, format=LOGGER_FORMAT)
-    logging.info('Starting web scrapping')
+    logging.info('Starting web scrapping (%s mode)', RUN_MODE)
 
     # Create scheduler
     processesToMake = multiprocessing.cpu_count()
+    # Submitted articles complete through futures, so threads are not held while articles are processed
     threadsToMake = THREADS_PER_CORE * multiprocessing.cpu_count()
     logging.info('Starting Main Threadpool with %s threads', str(threadsToMake))
-    logging.info('Starting Processpool with %s processes each with %s threads', str(processesToMake),
-                 str(THREADS_PER_CORE))
     scheduler = ThreadPoolScheduler(threadsToMake)
-    processScheduler = WebScrapProcessor(processesToMake)
 
     # Instantiate Database services
     try:
@@ -29,16 +31,54 @@ def main():
         logging.error('Failed to Initialize Databases', exc_info=e)
         return
 
-    webScrap = WebScrap(logging.getLogger('WebScrap'), mongoService, scheduler, processScheduler)
+    if RUN_MODE == "compress":
+        # One-off migration of web scraps stored as strings, no article is scraped so no worker process is started
+        mongoService.compressStoredWebScraps()
+        mongoService.close()
+        logging.info('Done')
+        return
+
+    logging.info('Starting Processpool with %s processes each with %s concurrent articles (%s fetch mode)',
+                 str(processesToMake), str(WORKER_CONCURRENCY), FETCH_MODE)
+    if ADAPTIVE_CONCURRENCY:
+        logging.info('Concurrent articles adjusted between %s and %s every %s s', CONCURRENCY_MIN, CONCURRENCY_MAX,
+                     CONCURRENCY_INTERVAL)
+    processScheduler = WebScrapProcessor(processesToMake)
+    metricsExporter = MetricsExporter(logging.getLogger('Metrics'))
+
+    if ENSURE_INDEXES:
+        try:
+            mongoService.ensureIndexes()
+            mongoService.checkQueryPlans()
+        except Exception as e:
+            logging.error('Failed to verify database indexes', exc_info=e)
+
+    webScrap = WebScrap(logging.getLogger('WebScrap'), mongoService, scheduler, processScheduler,
+                        reprocess=RUN_MODE == "reprocess")
 
     logging.info('Startup Completed')
     # Start Web Scraper 
-    webScrap.run()
+    if RUN_MODE == "daemon":
+        # Runs until stopped, articles being processed are completed before shutdown
+        stopEvent = threading.Event()
+        for signalNumber in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signalNumber, lambda signum, frame: stopEvent.set())
+        try:
+            webScrap.runDaemon(stopEvent)
+        except WatermarkFieldException as e:
+            logging.error('Failed to start daemon mode: %s', e)
+    else:
+        webScrap.run()
 
     logging.info('Shutting down web scraper')
 
     # Cleanup
     processScheduler.dispose()
+    # Workers have written all their updates, so the remaining duplicates can be copied
+    webScrap.copyDuplicates(final=True)
+    mongoService.close()
+    logSummary(logging.getLogger('Metrics'), getMetrics().snapshot())
+    metricsExporter.close()
 
     logging.info('Done')
 
@@ -0,0 +1,111 @@
+"""
+Compares the decoding of pages by requests (Response.text, which detects the encoding of pages without a charset
+from their whole body) with src.charset.decodeHtml, and parsing pages from their text with parsing them from their
+bytes. Pages of a corpus are enlarged to the size of real article pages, and served in three variants:
+declared (a <meta> charset), undeclared utf-8 and undeclared windows-1252 (no charset anywhere).
+
+python -m benchmarks.charset_benchmark --corpus tests/fixtures/extraction --scale 30 --repeat 20
+"""
+import argparse
+import glob
+import logging
+import os
+import re
+import time
+
+from requests.models import Response
+
+from src.charset import decodeHtml
+from src.config import LOGGER_FORMAT
+from src.extractors import createExtractor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+META_PATTERN = re.compile(r"<meta[^>]+charset[^>]*>|<\?xml[^>]*\?>", re.IGNORECASE)
+# Accented text added to pages so undeclared pages are not plain ascii
+ACCENTED = "<p>Résumé des données sécurisées, façade réseau et clé privée déjà révoquée.</p>\n"
+
+
+def loadPages(directory, scale):
+    """
+    :return: list of (name, text) of the pages, with their body repeated {scale} times
+    """
+    pages = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.html"))):
+        with open(path, encoding="utf-8") as file:
+            html = file.read()
+        head, separator, body = html.partition("<body")
+        if separator:
+            body = separator + body
+            openTag, closeBracket, content = body.partition(">")
+            content, closeTag, tail = content.rpartition("</body>")
+            html = head + openTag + closeBracket + (ACCENTED + content) * scale + closeTag + tail
+        pages.append((os.path.basename(path), html))
+    if not pages:
+        raise ValueError("No html pages in corpus {}".format(directory))
+    return pages
+
+
+def variants(pages):
+    """
+    :return: dict of variant name to list of (name, bytes) of the pages
+    """
+    declared = [(name, ('<meta charset="utf-8">' + META_PATTERN.sub("", html)).encode()) for name, html in pages]
+    return {
+        "declared": declared,
+        "utf-8": [(name, META_PATTERN.sub("", html).encode()) for name, html in pages],
+        "cp1252": [(name, META_PATTERN.sub("", html).encode("cp1252", errors="replace")) for name, html in pages],
+    }
+
+
+def requestsText(body):
+    # A response without content type header, as requests builds it from the wire
+    response = Response()
+    response._content = body
+    response.status_code = 200
+    return response.text
+
+
+def timePerPage(fn, bodies, repeat):
+    start = time.perf_counter()
+    for i in range(repeat):
+        for body in bodies:
+            fn(body)
+    return 1000 * (time.perf_counter() - start) / (repeat * len(bodies))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", default=os.path.join(ROOT, "tests", "fixtures", "extraction"),
+                        help="directory of html pages")
+    parser.add_argument("--scale", type=int, default=30, help="times the body of each page is repeated")
+    parser.add_argument("--repeat", type=int, default=20, help="times each page is decoded and parsed for timing")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format=LOGGER_FORMAT)
+    logger = logging.getLogger("CharsetBenchmark")
+    extractor = createExtractor("lxml")
+    pages = loadPages(args.corpus, args.scale)
+    logger.info("%s pages of %.0f KB on average", len(pages),
+                sum(len(html.encode()) for name, html in pages) / len(pages) / 1024)
+
+    for variant, encoded in variants(pages).items():
+        bodies = [body for name, body in encoded]
+        decoded = [decodeHtml(body) for body in bodies]
+        mismatches = sum(1 for body, (text, encoding, source) in zip(bodies, decoded) if text != requestsText(body))
+        sources = sorted({source for text, encoding, source in decoded})
+
+        requestsMs = timePerPage(requestsText, bodies, args.repeat)
+        decodeMs = timePerPage(decodeHtml, bodies, args.repeat)
+        texts = [text for text, encoding, source in decoded]
+        textExtractMs = timePerPage(extractor.extract, texts, args.repeat)
+        pairs = [(body, encoding) for body, (text, encoding, source) in zip(bodies, decoded)]
+        bytesExtractMs = timePerPage(lambda pair: extractor.extract(pair[0], encoding=pair[1]), pairs, args.repeat)
+
+        logger.info("%-8s decode: requests %7.3f ms | fast %7.3f ms (%s, %s pages decoded differently) | "
+                    "extract: from text %6.3f ms | from bytes %6.3f ms",
+                    variant, requestsMs, decodeMs, ", ".join(sources), mismatches, textExtractMs, bytesExtractMs)
+
+
+if __name__ == "__main__":
+    main()
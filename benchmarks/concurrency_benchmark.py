@@ -0,0 +1,94 @@
+"""
+Compares fixed and adaptive concurrency of the worker processes end to end. The e2e benchmark is run once per fixed
+level (ADAPTIVE_CONCURRENCY=false with THREADS_PER_CORE set to the level) and once per adaptive start level, against
+the same hosts and articles. Reports the throughput of each run, the best fixed level, and the limits the adaptive
+runs changed to and settled on, so the adaptive throughput can be compared with the best hand tuned level.
+
+python -m benchmarks.concurrency_benchmark --articles 1500 --hosts 8 --latency 0.2 --levels 1,2,4,8,16,32,64
+python -m benchmarks.concurrency_benchmark --error-rate 0.1 --adaptive-starts 3,64
+"""
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+
+from src.config import LOGGER_FORMAT
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def runE2e(args, env, output):
+    """
+    Runs the e2e benchmark with the service environment {env}
+    :return: results of the run (or null if it failed)
+    """
+    command = [sys.executable, "-m", "benchmarks.e2e_benchmark", "--articles", str(args.articles),
+               "--hosts", str(args.hosts), "--latency", str(args.latency), "--error-rate", str(args.error_rate),
+               "--timeout", str(args.timeout), "--output", output]
+    for key, value in env.items():
+        command += ["--env", "{}={}".format(key, value)]
+    completed = subprocess.run(command, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    if completed.returncode != 0 or not os.path.exists(output):
+        sys.stderr.write(completed.stderr[-5000:])
+        return None
+    with open(output) as file:
+        return json.load(file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--articles", type=int, default=1500, help="number of articles per run")
+    parser.add_argument("--hosts", type=int, default=8, help="number of article hosts")
+    parser.add_argument("--latency", type=float, default=0.2, help="response latency of hosts in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests failing with a 503")
+    parser.add_argument("--levels", default="1,2,4,8,16,32,64", help="fixed concurrency levels per worker")
+    parser.add_argument("--adaptive-starts", default="3", help="initial limits of the adaptive runs")
+    parser.add_argument("--interval", type=float, default=1.0, help="CONCURRENCY_INTERVAL of the adaptive runs")
+    parser.add_argument("--timeout", type=float, default=600, help="seconds before a run is stopped")
+    parser.add_argument("--output", help="results file (default: not saved)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format=LOGGER_FORMAT)
+    logger = logging.getLogger("ConcurrencyBenchmark")
+    levels = [int(level) for level in args.levels.split(",")]
+    starts = [int(start) for start in args.adaptive_starts.split(",")]
+    # Hosts are not the bottleneck, so the limit of the workers sets the concurrency
+    baseEnv = {"HOST_MAX_CONCURRENCY": str(max(levels + starts)), "CONCURRENCY_MAX": str(max(levels + starts))}
+
+    runs = []
+    with tempfile.TemporaryDirectory() as resultsDir:
+        for mode, level in [("fixed", level) for level in levels] + [("adaptive", start) for start in starts]:
+            env = dict(baseEnv, THREADS_PER_CORE=str(level), ADAPTIVE_CONCURRENCY=str(mode == "adaptive").lower(),
+                       CONCURRENCY_INTERVAL=str(args.interval))
+            results = runE2e(args, env, os.path.join(resultsDir, "{}-{}.json".format(mode, level)))
+            if results is None:
+                logger.error("%s concurrency %s failed", mode, level)
+                continue
+            run = {"mode": mode, "level": level, "articlesPerSecond": results["articlesPerSecond"],
+                   "p95": results["latency"]["p95"], "concurrency": results["concurrency"]}
+            runs.append(run)
+            logger.info("%-8s %3s: %7.1f articles/sec | p95 %.3f s | %s limit changes, final limits %s", mode,
+                        level, run["articlesPerSecond"], run["p95"], run["concurrency"]["changes"],
+                        run["concurrency"]["finalLimits"] or "-")
+
+    fixed = [run for run in runs if run["mode"] == "fixed"]
+    if fixed:
+        best = max(fixed, key=lambda run: run["articlesPerSecond"])
+        logger.info("best fixed level %s: %.1f articles/sec", best["level"], best["articlesPerSecond"])
+        for run in runs:
+            if run["mode"] == "adaptive":
+                logger.info("adaptive from %s: %.1f articles/sec, %.0f%% of the best fixed level", run["level"],
+                            run["articlesPerSecond"], 100 * run["articlesPerSecond"] / best["articlesPerSecond"])
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as file:
+            json.dump({"config": vars(args), "runs": runs}, file, indent=2, sort_keys=True)
+        logger.info("Results saved to %s", args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,452 @@
+"""
+Runs the service end to end (the real __main__.main) against local stand-ins and reports its throughput.
+Articles are served from a recorded html corpus by local http servers with configurable latency, error rate and
+slow hosts, and are read from and written to an in-memory mongo stand-in, so no network or database is needed.
+
+Reports articles/sec, p50/p95/p99 latency per article, peak RSS per process and the time spent fetching,
+extracting and writing. Results are saved as JSON and can be compared with the results of another commit.
+
+python -m benchmarks.e2e_benchmark --articles 2000 --hosts 8 --latency 0.05 --slow-hosts 1 --error-rate 0.02
+python -m benchmarks.e2e_benchmark --nodes 3 (3 services sharing the collection by claiming articles)
+python -m benchmarks.e2e_benchmark --daemon 20 (daemon mode, reports the delay until 20 articles inserted while it
+runs are scraped)
+python -m benchmarks.e2e_benchmark --compare benchmarks/results/e2e-<commit>.json
+"""
+import argparse
+import glob
+import importlib.util
+import json
+import logging
+import multiprocessing
+import os
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+from pymongo import MongoClient
+
+from benchmarks.local_server import LocalArticleServer
+from benchmarks.mongo_standin import MongoStandIn
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LOGGER_FORMAT = "%(asctime)s %(levelname)s P%(process)d [%(name)s]: %(message)s"
+DB_NAME = "benchmark"
+COLLECTION = "articleContent"
+# Metrics compared between runs, with True when higher is better
+COMPARED_METRICS = {
+    "articlesPerSecond": True,
+    "latency.p50": False,
+    "latency.p95": False,
+    "latency.p99": False,
+    "stages.fetch.mean": False,
+    "stages.extract.mean": False,
+    "stages.write.mean": False,
+    "peakRssMb.total": False,
+}
+# Log lines of the changes of the concurrency limit of a worker process
+CONCURRENCY_LINE = re.compile(r" P(\d+) \[Concurrency\]: Concurrency (\d+) -> (\d+)")
+
+
+class StageTimer:
+    """
+    Thread safe count and total time of the calls of a stage
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, elapsed):
+        with self._lock:
+            self.count += 1
+            self.total += elapsed
+
+    def toDict(self):
+        return {"count": self.count, "total": self.total}
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def peakRssMb():
+    # ru_maxrss is in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def loadCorpus(directory):
+    pages = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.html"))):
+        with open(path, "rb") as file:
+            pages.append(file.read())
+    if not pages:
+        raise ValueError("No html pages in corpus {}".format(directory))
+    return pages
+
+
+def runMongoStandIn(latency, ready, stop):
+    standIn = MongoStandIn(latency=latency).start()
+    ready.put(standIn.address)
+    stop.wait()
+    standIn.stop()
+
+
+def seedArticles(client, servers, count):
+    collection = client[DB_NAME][COLLECTION]
+    collection.drop()
+    articles = [{"_id": uuid.uuid4(), "link": "{}/article/{}.html".format(servers[i % len(servers)].url, i),
+                 "inserted_at": datetime.now(timezone.utc)} for i in range(count)]
+    for start in range(0, count, 1000):
+        collection.insert_many(articles[start:start + 1000])
+
+
+# Child process: runs the service with timing wrappers
+
+def instrument(statsDir):
+    """
+    Wraps the functions of each stage of the service with timers. Worker processes are forked after this, so they
+    inherit the wrappers and save their own stats when they exit.
+    """
+    import src.web_scrap
+    from src.bulk_writer import BulkArticleWriter
+    from src.web_scrap_processor import WebScrapProcessor
+
+    timers = {name: StageTimer() for name in ("fetch", "extract", "write")}
+    latencies = []
+
+    def timed(timer, fn):
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                timer.record(time.perf_counter() - start)
+        return wrapper
+
+    def timedAsync(timer, fn):
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                timer.record(time.perf_counter() - start)
+        return wrapper
+
+    src.web_scrap.fetchPage = timed(timers["fetch"], src.web_scrap.fetchPage)
+    src.web_scrap.fetchPageAsync = timedAsync(timers["fetch"], src.web_scrap.fetchPageAsync)
+    src.web_scrap.extract_full_text_from_html = timed(timers["extract"], src.web_scrap.extract_full_text_from_html)
+    BulkArticleWriter._write = timed(timers["write"], BulkArticleWriter._write)
+
+    submitArticle = WebScrapProcessor.submitArticle
+
+    def timedSubmit(self, articleInfo):
+        start = time.perf_counter()
+        future = submitArticle(self, articleInfo)
+        future.add_done_callback(lambda f: latencies.append(time.perf_counter() - start))
+        return future
+
+    WebScrapProcessor.submitArticle = timedSubmit
+
+    processRun = WebScrapProcessor._processRun
+
+    def statsProcessRun(self, *args):
+        try:
+            processRun(self, *args)
+        finally:
+            saveStats(statsDir, "worker", timers, [])
+
+    WebScrapProcessor._processRun = statsProcessRun
+    return timers, latencies
+
+
+def saveStats(statsDir, role, timers, latencies):
+    path = os.path.join(statsDir, "{}-{}.json".format(role, os.getpid()))
+    with open(path, "w") as file:
+        json.dump({"role": role, "pid": os.getpid(), "peakRssMb": peakRssMb(), "latencies": latencies,
+                   "stages": {name: timer.toDict() for name, timer in timers.items()}}, file)
+
+
+def runService(statsDir, logFile):
+    """
+    Runs __main__.main in this process with the environment set by the parent
+    """
+    sys.path.insert(0, ROOT)
+    logging.basicConfig(level=logging.INFO, format=LOGGER_FORMAT, filename=logFile)
+    timers, latencies = instrument(statsDir)
+
+    spec = importlib.util.spec_from_file_location("service_main", os.path.join(ROOT, "__main__.py"))
+    serviceMain = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(serviceMain)
+
+    start = time.perf_counter()
+    serviceMain.main()
+    elapsed = time.perf_counter() - start
+    saveStats(statsDir, "main", timers, list(latencies))
+    with open(os.path.join(statsDir, "elapsed.json"), "w") as file:
+        json.dump({"elapsed": elapsed}, file)
+
+
+# Parent process: sets up the stand-ins and reports
+
+def aggregate(statsDir):
+    processes = []
+    for path in glob.glob(os.path.join(statsDir, "**", "*-*.json"), recursive=True):
+        with open(path) as file:
+            processes.append(json.load(file))
+    latencies = [latency for stats in processes for latency in stats["latencies"]]
+    stages = {}
+    for name in ("fetch", "extract", "write"):
+        count = sum(stats["stages"][name]["count"] for stats in processes)
+        total = sum(stats["stages"][name]["total"] for stats in processes)
+        stages[name] = {"count": count, "total": total, "mean": total / count if count else 0.0}
+    workers = [stats["peakRssMb"] for stats in processes if stats["role"] == "worker"]
+    main = [stats["peakRssMb"] for stats in processes if stats["role"] == "main"]
+    elapsed = []
+    for path in glob.glob(os.path.join(statsDir, "**", "elapsed.json"), recursive=True):
+        with open(path) as file:
+            elapsed.append(json.load(file)["elapsed"])
+    return {
+        "elapsed": max(elapsed, default=None),
+        "latency": {"count": len(latencies), "mean": sum(latencies) / max(len(latencies), 1),
+                    "p50": percentile(latencies, 0.50), "p95": percentile(latencies, 0.95),
+                    "p99": percentile(latencies, 0.99)},
+        "stages": stages,
+        "peakRssMb": {"main": max(main, default=0.0), "mains": main, "workers": workers,
+                      "total": sum(main) + sum(workers)},
+    }
+
+
+def waitFor(condition, timeout, interval=0.05):
+    """
+    Polls {condition} until it returns true or {timeout} seconds pass
+    :return: if the condition was met
+    """
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if condition():
+            return True
+        time.sleep(interval)
+    return False
+
+
+def measureDaemon(logger, collection, servers, articles, inserts, timeout):
+    """
+    Waits for the seeded articles to be scraped by services running in daemon mode, then inserts articles one at a
+    time and measures the delay until each is scraped
+    :return: dict of the insert count, the delays of the scraped articles and the count of articles never scraped
+    """
+    if not waitFor(lambda: collection.count_documents({"web_scrap": {"$ne": None}}) >= articles, timeout):
+        logger.error("Seeded articles were not all scraped within %s s", timeout)
+    delays = []
+    for i in range(inserts):
+        articleId = uuid.uuid4()
+        inserted = time.perf_counter()
+        collection.insert_one({"_id": articleId, "inserted_at": datetime.now(timezone.utc),
+                               "link": "{}/article/new-{}.html".format(servers[i % len(servers)].url, i)})
+        if waitFor(lambda: collection.find_one({"_id": articleId, "web_scrap": {"$ne": None}}, {"_id": 1}), 60):
+            delays.append(time.perf_counter() - inserted)
+    return {"inserts": inserts, "missed": inserts - len(delays), "p50": percentile(delays, 0.50),
+            "max": max(delays, default=0.0)}
+
+
+def currentCommit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+def metricValue(results, path):
+    value = results
+    for key in path.split("."):
+        value = value.get(key) if isinstance(value, dict) else None
+    return value
+
+
+def compare(logger, results, previousFile):
+    with open(previousFile) as file:
+        previous = json.load(file)
+    logger.info("Compared with %s (commit %s)", previousFile, previous.get("commit"))
+    for path, higherIsBetter in COMPARED_METRICS.items():
+        old, new = metricValue(previous, path), metricValue(results, path)
+        if not old or new is None:
+            continue
+        change = 100 * (new - old) / old
+        better = change > 0 if higherIsBetter else change < 0
+        logger.info("%-20s %10.4f -> %10.4f (%+6.1f%%%s)", path, old, new, change,
+                    "" if abs(change) < 1 else ", better" if better else ", worse")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--articles", type=int, default=1000, help="number of articles to scrap")
+    parser.add_argument("--hosts", type=int, default=4, help="number of article hosts")
+    parser.add_argument("--latency", type=float, default=0.02, help="response latency of hosts in seconds")
+    parser.add_argument("--slow-hosts", type=int, default=0, help="number of hosts with --slow-latency")
+    parser.add_argument("--slow-latency", type=float, default=1.0, help="response latency of slow hosts in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests failing with a 503")
+    parser.add_argument("--corpus", default=os.path.join(ROOT, "tests", "fixtures", "extraction"),
+                        help="directory of html pages served by the hosts")
+    parser.add_argument("--nodes", type=int, default=1,
+                        help="number of services run at the same time, claiming articles from the same collection")
+    parser.add_argument("--daemon", type=int, default=0, metavar="INSERTS",
+                        help="run the services in daemon mode and insert INSERTS articles one at a time once the "
+                             "seeded articles are scraped, reporting the delay until each is scraped")
+    parser.add_argument("--mongo-latency", type=float, default=0.0, help="latency of each db command in seconds")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="environment variable of the service, can be repeated")
+    parser.add_argument("--timeout", type=float, default=600, help="seconds before the run is stopped")
+    parser.add_argument("--output", help="results file (default benchmarks/results/e2e-<commit>.json)")
+    parser.add_argument("--compare", help="results file of a previous run to compare with")
+    parser.add_argument("--child", nargs=2, metavar=("STATS_DIR", "LOG_FILE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        runService(*args.child)
+        return
+
+    logging.basicConfig(level=logging.INFO, format=LOGGER_FORMAT)
+    logger = logging.getLogger("E2EBenchmark")
+    commit = currentCommit()
+
+    pages = loadCorpus(args.corpus)
+    # Each host listens on its own loopback address so the service schedules them as different hosts
+    servers = [LocalArticleServer(pages, args.slow_latency if i < args.slow_hosts else args.latency,
+                                  host="127.0.0.{}".format(i + 1), errorRate=args.error_rate, seed=i).start()
+               for i in range(args.hosts)]
+
+    ready = multiprocessing.Queue()
+    stopMongo = multiprocessing.Event()
+    mongoProcess = multiprocessing.Process(target=runMongoStandIn, args=[args.mongo_latency, ready, stopMongo],
+                                           daemon=True)
+    mongoProcess.start()
+    mongoHost, mongoPort = ready.get(timeout=30)
+    client = MongoClient(mongoHost, mongoPort, uuidRepresentation="standard")
+    seedArticles(client, servers, args.articles)
+    logger.info("Serving %s pages from %s hosts (%s slow), %s articles seeded", len(pages), args.hosts,
+                args.slow_hosts, args.articles)
+
+    env = dict(os.environ, MONGO_HOST=mongoHost, MONGO_PORT=str(mongoPort), MONGO_DB_NAME=DB_NAME,
+               MONGO_COLLECTION=COLLECTION, WRITE_FLUSH_INTERVAL="0.5", STAGE_REPORT_INTERVAL="0",
+               PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get("PYTHONPATH")])))
+    if args.nodes > 1:
+        env["CLAIM_ARTICLES"] = "true"
+    if args.daemon:
+        env.update(RUN_MODE="daemon", POLL_INTERVAL="0.5")
+    serviceEnv = dict(item.split("=", 1) for item in args.env)
+    env.update(serviceEnv)
+
+    with tempfile.TemporaryDirectory() as statsDir:
+        nodes = []
+        for node in range(args.nodes):
+            nodeDir = os.path.join(statsDir, "node{}".format(node))
+            os.makedirs(nodeDir)
+            logFile = os.path.join(nodeDir, "service.log")
+            child = subprocess.Popen([sys.executable, "-m", "benchmarks.e2e_benchmark", "--child", nodeDir, logFile],
+                                     cwd=ROOT, env=dict(env, NODE_ID="node{}".format(node)))
+            nodes.append((child, logFile))
+
+        start = time.perf_counter()
+        daemon = None
+        if args.daemon:
+            daemon = measureDaemon(logger, client[DB_NAME][COLLECTION], servers, args.articles, args.daemon,
+                                   args.timeout)
+            for child, logFile in nodes:
+                child.terminate()
+        errorLines = 0
+        concurrencyChanges = 0
+        finalLimits = {}
+        for child, logFile in nodes:
+            try:
+                returnCode = child.wait(max(1.0, args.timeout - (time.perf_counter() - start)))
+            except subprocess.TimeoutExpired:
+                child.kill()
+                returnCode = None
+            if returnCode != 0:
+                logger.error("Service %s, see its log:", "timed out" if returnCode is None else "failed")
+                with open(logFile) as file:
+                    sys.stderr.write(file.read()[-5000:])
+            with open(logFile) as file:
+                for line in file:
+                    errorLines += " ERROR " in line
+                    change = CONCURRENCY_LINE.search(line)
+                    if change:
+                        concurrencyChanges += 1
+                        finalLimits[change.group(1)] = int(change.group(3))
+        wallTime = time.perf_counter() - start
+
+        results = aggregate(statsDir)
+        elapsed = results.pop("elapsed") or wallTime
+
+    collection = client[DB_NAME][COLLECTION]
+    completed = collection.count_documents({"clean_full_text": {"$ne": None}})
+    dbStats = client.admin.command("benchStats")
+    client.close()
+    stopMongo.set()
+    mongoProcess.join(10)
+    for server in servers:
+        server.stop()
+
+    results.update({
+        "commit": commit,
+        "config": {"articles": args.articles, "nodes": args.nodes, "hosts": args.hosts, "latency": args.latency,
+                   "slowHosts": args.slow_hosts, "slowLatency": args.slow_latency, "errorRate": args.error_rate,
+                   "mongoLatency": args.mongo_latency, "corpusPages": len(pages), "env": serviceEnv},
+        "elapsed": elapsed,
+        "articlesPerSecond": results["latency"]["count"] / elapsed if elapsed else 0.0,
+        "completedArticles": completed,
+        "http": {"requests": sum(server.requestCount for server in servers),
+                 "errors": sum(server.errorCount for server in servers),
+                 "duplicates": sum(server.duplicateCount for server in servers),
+                 "notModified": sum(server.notModifiedCount for server in servers)},
+        "db": {"commands": dbStats["commands"], "busyTime": dbStats["busyTime"]},
+        "serviceErrorLogs": errorLines,
+        "concurrency": {"changes": concurrencyChanges, "finalLimits": sorted(finalLimits.values())},
+    })
+    if daemon is not None:
+        results["daemon"] = daemon
+
+    stages = results["stages"]
+    logger.info("%s articles in %.2f s: %.1f articles/sec, %s with clean text", results["latency"]["count"],
+                elapsed, results["articlesPerSecond"], completed)
+    logger.info("latency per article p50 %.3f s | p95 %.3f s | p99 %.3f s", results["latency"]["p50"],
+                results["latency"]["p95"], results["latency"]["p99"])
+    for name in ("fetch", "extract", "write"):
+        logger.info("%-8s %6s calls | %8.2f s total | %7.2f ms mean", name, stages[name]["count"],
+                    stages[name]["total"], 1000 * stages[name]["mean"])
+    logger.info("peak RSS main %s MB | workers %s MB", ", ".join("%.0f" % rss for rss in results["peakRssMb"]["mains"]),
+                ", ".join("%.0f" % rss for rss in results["peakRssMb"]["workers"]))
+    logger.info("http requests %s (%s errors, %s duplicates, %s not modified) | db commands %s",
+                results["http"]["requests"], results["http"]["errors"], results["http"]["duplicates"],
+                results["http"]["notModified"], sum(results["db"]["commands"].values()))
+
+    if concurrencyChanges:
+        logger.info("concurrency changed %s times, final limits per worker %s", concurrencyChanges,
+                    results["concurrency"]["finalLimits"])
+
+    if daemon is not None:
+        logger.info("daemon: %s inserted articles scraped after p50 %.2f s | max %.2f s (%s missed)",
+                    daemon["inserts"], daemon["p50"], daemon["max"], daemon["missed"])
+
+    output = args.output or os.path.join(ROOT, "benchmarks", "results", "e2e-{}.json".format(commit))
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(results, file, indent=2, sort_keys=True)
+    logger.info("Results saved to %s", output)
+
+    if args.compare:
+        compare(logger, results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
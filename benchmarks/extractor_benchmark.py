@@ -0,0 +1,76 @@
+"""
+Compares the accuracy and speed of the extractor engines on a corpus of article pages.
+A corpus is a directory with html pages and a corpus.json listing, for each page, sentences of the article
+that must be extracted and boilerplate that must not be, and its url so site rules apply.
+The lxml engine is also measured without urls to show the gain of site rules.
+
+python -m benchmarks.extractor_benchmark --corpus tests/fixtures/extraction --repeat 200
+"""
+import argparse
+import json
+import logging
+import os
+import time
+
+from src.config import LOGGER_FORMAT
+from src.extractors import EXTRACTORS, createExtractor
+from src.site_rules import getSiteRules
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def loadCorpus(directory):
+    with open(os.path.join(directory, "corpus.json"), encoding="utf-8") as file:
+        corpus = json.load(file)
+    for entry in corpus:
+        with open(os.path.join(directory, entry["file"]), encoding="utf-8") as file:
+            entry["html"] = file.read()
+    if not corpus:
+        raise ValueError("No pages in corpus {}".format(directory))
+    return corpus
+
+
+def measure(extractor, corpus, repeat, useUrls=True):
+    """
+    :return: tuple of the share of expected sentences found, boilerplate phrases extracted and ms per page
+    """
+    urls = [entry.get("url") if useUrls else None for entry in corpus]
+    found = expected = leaked = 0
+    for entry, url in zip(corpus, urls):
+        text = extractor.extract(entry["html"], url)
+        normalized = " ".join(text.split())
+        found += sum(1 for sentence in entry["expected"] if sentence in normalized)
+        expected += len(entry["expected"])
+        leaked += sum(1 for phrase in entry["boilerplate"] if phrase in text)
+
+    start = time.perf_counter()
+    for i in range(repeat):
+        for entry, url in zip(corpus, urls):
+            extractor.extract(entry["html"], url)
+    msPerPage = 1000 * (time.perf_counter() - start) / (repeat * len(corpus))
+    return found / max(expected, 1), leaked, msPerPage
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", default=os.path.join(ROOT, "tests", "fixtures", "extraction"),
+                        help="directory of the corpus")
+    parser.add_argument("--repeat", type=int, default=200, help="times each page is extracted for timing")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format=LOGGER_FORMAT)
+    logger = logging.getLogger("ExtractorBenchmark")
+    corpus = loadCorpus(args.corpus)
+    boilerplate = sum(len(entry["boilerplate"]) for entry in corpus)
+
+    runs = [(name, name, True) for name in EXTRACTORS] + [("lxml, no rules", "lxml", False)]
+    for label, name, useUrls in runs:
+        recall, leaked, msPerPage = measure(createExtractor(name), corpus, args.repeat, useUrls)
+        logger.info("%-15s recall %5.1f%% | boilerplate %s/%s | %.2f ms per page (%.0f pages/sec)",
+                    label, 100 * recall, leaked, boilerplate, msPerPage, 1000 / msPerPage)
+    rules = getSiteRules()
+    logger.info("site rule hits: %s, misses: %s", sum(rules.hits.values()), sum(rules.misses.values()))
+
+
+if __name__ == "__main__":
+    main()
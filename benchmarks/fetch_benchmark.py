@@ -0,0 +1,139 @@
+"""
+Compares articles/sec of a single worker process in thread fetch mode and async fetch mode.
+Articles are served by a local HTTP server with a fixed latency and db writes are discarded.
+
+python -m benchmarks.fetch_benchmark --articles 2000 --latency 0.2
+"""
+import argparse
+import logging
+import threading
+import time
+import uuid
+
+from reactivex import Subject
+from reactivex.scheduler import ThreadPoolScheduler
+
+from benchmarks.local_server import LocalArticleServer
+from src.config import LOGGER_FORMAT, THREADS_PER_CORE, ASYNC_CONCURRENCY, EXTRACT_THREADS, EXTRACT_QUEUE_SIZE
+from src.mongo_service import ArticleInfo
+from src.web_scrap import AsyncFetchEngine
+from src.pipeline_stage import ConcurrencyLimit, PipelineStage
+from src.web_scrap_processor import _runWebscrap, _callScrapAsync
+
+
+class NullMongoService:
+    """
+    Mongo service that discards all writes
+    """
+
+    def insertWebScrapArticle(self, id, web_scrap):
+        pass
+
+    def insertCleanFullText(self, article_id, clean_text):
+        pass
+
+    def insertFetchStatus(self, id, fetchStatus, contentType):
+        pass
+
+    def insertValidators(self, id, validators):
+        pass
+
+    def insertFetchFailure(self, id, attempts, error, status, nextAttempt):
+        pass
+
+    def clearFetchFailure(self, id):
+        pass
+
+    def insertFetchTime(self, id, fetchedAt=None):
+        pass
+
+    def setDuplicates(self, id, duplicateIds):
+        pass
+
+    def clearDuplicates(self, id):
+        pass
+
+
+class CountDown:
+    """
+    Stands in for the result channel of the processor and signals when all articles are complete
+    """
+
+    def __init__(self, count):
+        self.count = count
+        self._lock = threading.Lock()
+        self.done = threading.Event()
+
+    def put(self, taskResult):
+        with self._lock:
+            self.count -= 1
+            if self.count == 0:
+                self.done.set()
+
+
+def runThreadMode(articles, logger, concurrency):
+    scheduler = ThreadPoolScheduler(concurrency)
+    maxAllowedData = ConcurrencyLimit(concurrency)
+    countDown = CountDown(len(articles))
+    source = Subject()
+    extractStage = PipelineStage("extract", EXTRACT_THREADS, EXTRACT_QUEUE_SIZE)
+    _runWebscrap(source, logger, NullMongoService(), scheduler, countDown, maxAllowedData, extractStage)
+    # The pipeline subscribes to the source on the scheduler
+    while not source.observers:
+        time.sleep(0.01)
+
+    start = time.perf_counter()
+    for article in articles:
+        maxAllowedData.acquire()
+        maxAllowedData.started()
+        source.on_next((article, 0))
+    countDown.done.wait()
+    elapsed = time.perf_counter() - start
+    source.on_completed()
+    scheduler.executor.shutdown()
+    extractStage.shutdown()
+    return elapsed
+
+
+def runAsyncMode(articles, logger, concurrency):
+    engine = AsyncFetchEngine(logger, NullMongoService(), concurrency)
+    maxAllowedData = ConcurrencyLimit(concurrency)
+    countDown = CountDown(len(articles))
+
+    start = time.perf_counter()
+    for article in articles:
+        maxAllowedData.acquire()
+        maxAllowedData.started()
+        _callScrapAsync((article, 0), engine, countDown, maxAllowedData)
+    countDown.done.wait()
+    elapsed = time.perf_counter() - start
+    engine.close()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--articles", type=int, default=1000, help="number of articles to fetch per mode")
+    parser.add_argument("--latency", type=float, default=0.2, help="server response latency in seconds")
+    parser.add_argument("--threads", type=int, default=THREADS_PER_CORE, help="concurrency of thread mode")
+    parser.add_argument("--async-concurrency", type=int, default=ASYNC_CONCURRENCY, help="concurrency of async mode")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format=LOGGER_FORMAT)
+    logger = logging.getLogger("FetchBenchmark")
+    server = LocalArticleServer(latency=args.latency).start()
+    articles = [ArticleInfo(uuid.uuid4(), "{}/article/{}".format(server.url, i)) for i in range(args.articles)]
+
+    threadTime = runThreadMode(articles, logger, args.threads)
+    logger.info("thread mode: %s articles in %.2f s (%.1f articles/sec, %s threads)",
+                len(articles), threadTime, len(articles) / threadTime, args.threads)
+    asyncTime = runAsyncMode(articles, logger, args.async_concurrency)
+    logger.info("async mode:  %s articles in %.2f s (%.1f articles/sec, %s concurrent)",
+                len(articles), asyncTime, len(articles) / asyncTime, args.async_concurrency)
+    logger.info("async speedup: %.1fx", threadTime / asyncTime)
+
+    server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Benchmark for the article query indexes.
+Seeds a collection on the local mongo instance (MONGO_HOST / MONGO_PORT) and times the "needs scraping"
+and summary queries with and without the indexes created by MongoService.ensureIndexes.
+
+python -m benchmarks.index_benchmark --articles 200000 --pending 0.01
+"""
+import argparse
+import logging
+import time
+import uuid
+
+from pymongo import MongoClient
+
+from src.config import MONGO_HOST, MONGO_PORT, MONGO_USERNAME, MONGO_PASSWORD, LOGGER_FORMAT
+from src.mongo_service import ARTICLE_INDEXES, nonWebScrapFind, summaryQuery
+
+
+def seed(collection, articles, pending, htmlSize):
+    """
+    Inserts articles where a {pending} fraction still requires web scraping
+    """
+    collection.drop()
+    html = "<p>" + "x" * htmlSize + "</p>"
+    pendingEvery = max(1, round(1 / pending)) if pending > 0 else articles + 1
+    batch = []
+    for i in range(articles):
+        document = {"_id": uuid.uuid4(), "link": "https://example.com/article/{}".format(i)}
+        if i % pendingEvery != 0:
+            document["web_scrap"] = html
+            document["clean_full_text"] = "x" * (htmlSize // 2)
+            document["summary"] = "summary"
+        batch.append(document)
+        if len(batch) == 1000:
+            collection.insert_many(batch)
+            batch = []
+    if batch:
+        collection.insert_many(batch)
+
+
+def planStages(plan):
+    """
+    :return: stages of the winning plan from the root, input stages of a stage in brackets
+    """
+    inputs = [plan["inputStage"]] if "inputStage" in plan else plan.get("inputStages", [])
+    stage = plan.get("stage", "?")
+    if len(inputs) == 1:
+        return stage + " > " + planStages(inputs[0])
+    return stage + ("(" + ", ".join(planStages(child) for child in inputs) + ")" if inputs else "")
+
+
+def timeQuery(collection, query, sort, repeat):
+    """
+    :return: best time in seconds to read all ids matching the query, the number of matches and the winning plan
+    """
+    best = None
+    count = 0
+    for i in range(repeat):
+        start = time.perf_counter()
+        count = sum(1 for _ in collection.find(query, {"_id": 1}, sort=sort))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    plan = collection.find(query, {"_id": 1}, sort=sort).explain()["queryPlanner"]["winningPlan"]
+    return best, count, planStages(plan)
+
+
+def run(collection, repeat):
+    # Articles to scrap are read with the find of MongoService.getNonWebScrapArticles
+    find = nonWebScrapFind()
+    queries = {"needs scraping": (find["filter"], find["sort"]), "without summary": (summaryQuery(), None)}
+    results = {}
+    for name, (query, sort) in queries.items():
+        results[name] = timeQuery(collection, query, sort, repeat)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--articles", type=int, default=100000, help="number of seeded articles")
+    parser.add_argument("--pending", type=float, default=0.01, help="fraction of articles that require scraping")
+    parser.add_argument("--html-size", type=int, default=20000, help="size in bytes of the seeded web_scrap field")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per query, the best time is reported")
+    parser.add_argument("--db", default="crh_benchmark", help="database used for the seeded collection")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format=LOGGER_FORMAT)
+    client = MongoClient("mongodb://{}:{}/".format(MONGO_HOST, MONGO_PORT),
+                         username=MONGO_USERNAME,
+                         password=MONGO_PASSWORD,
+                         uuidRepresentation='standard')
+    collection = client[args.db]["indexBenchmark"]
+
+    logging.info("Seeding %s articles (%s%% pending)", args.articles, 100 * args.pending)
+    seed(collection, args.articles, args.pending, args.html_size)
+
+    withoutIndexes = run(collection, args.repeat)
+    collection.create_indexes(ARTICLE_INDEXES)
+    withIndexes = run(collection, args.repeat)
+
+    for name in withoutIndexes:
+        before, count, _ = withoutIndexes[name]
+        after, _, plan = withIndexes[name]
+        logging.info("%-16s %6s matches  no index %8.1f ms  indexed %8.1f ms  speedup %.1fx  plan %s",
+                     name, count, 1000 * before, 1000 * after, before / after if after else float("inf"), plan)
+
+    collection.drop()
+
+
+if __name__ == "__main__":
+    main()
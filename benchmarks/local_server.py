@@ -0,0 +1,112 @@
+"""
+Local HTTP server serving article pages for benchmarks
+"""
+import random
+import threading
+import time
+import zlib
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+DEFAULT_PAGE = ("<html><head><title>Benchmark article</title></head><body>"
+                "<nav><a href='/'>Home</a></nav><article><h1>Benchmark article</h1>"
+                + "<p>Benchmark article paragraph with enough text to be considered content by the extractor.</p>" * 40
+                + "</article><footer>Footer</footer></body></html>")
+
+
+class LocalArticleServer:
+    """
+    Serves one of {pages} for any path after waiting {latency} seconds, always the same page for a path.
+    Pages are sent with an ETag and requests revalidating it are answered with 304 Not Modified.
+    A {errorRate} fraction of requests fails with {errorStatus}. Servers on different loopback addresses
+    (127.0.0.1, 127.0.0.2, ...) are seen as different hosts by the service.
+    """
+
+    def __init__(self, pages=None, latency=0.0, host="127.0.0.1", port=0, errorRate=0.0, errorStatus=503, seed=0):
+        self.pages = [page.encode() if isinstance(page, str) else page for page in (pages or [DEFAULT_PAGE])]
+        self.latency = latency
+        self.errorRate = errorRate
+        self.errorStatus = errorStatus
+        self.requestCount = 0
+        self.errorCount = 0
+        self.notModifiedCount = 0
+        # Requests for a path that was already requested
+        self.duplicateCount = 0
+        self._paths = set()
+        self.serveTime = 0.0
+        self._random = random.Random(seed)
+        self._countLock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handlerClass())
+        self._server.daemon_threads = True
+        self._server.request_queue_size = 1024
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return "http://{}:{}".format(host, port)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _nextPage(self, path):
+        """
+        :return: tuple of the page of the path and its ETag (or (null, null) if the request should fail)
+        """
+        with self._countLock:
+            self.requestCount += 1
+            if path in self._paths:
+                self.duplicateCount += 1
+            self._paths.add(path)
+            if self.errorRate and self._random.random() < self.errorRate:
+                self.errorCount += 1
+                return None, None
+        index = zlib.crc32(path.encode()) % len(self.pages)
+        return self.pages[index], '"page-{}"'.format(index)
+
+    def _recordNotModified(self):
+        with self._countLock:
+            self.notModifiedCount += 1
+
+    def _recordServeTime(self, elapsed):
+        with self._countLock:
+            self.serveTime += elapsed
+
+    def _handlerClass(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                start = time.perf_counter()
+                if server.latency:
+                    time.sleep(server.latency)
+                page, etag = server._nextPage(self.path)
+                if page is None:
+                    self.send_response(server.errorStatus)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                elif self.headers.get("If-None-Match") == etag:
+                    server._recordNotModified()
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                else:
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/html; charset=utf-8")
+                    self.send_header("Content-Length", str(len(page)))
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    self.wfile.write(page)
+                server._recordServeTime(time.perf_counter() - start)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,556 @@
+"""
+In-memory stand-in for a mongo server, for benchmarks that run the service without a database.
+Speaks enough of the mongo wire protocol for pymongo to connect and run the commands used by the service:
+find/getMore, insert, update, findAndModify, delete, simple aggregations, index management and explain.
+"""
+import itertools
+import socketserver
+import struct
+import threading
+import time
+from datetime import datetime
+
+import bson
+from bson import ObjectId
+from bson.int64 import Int64
+
+OP_REPLY = 1
+OP_QUERY = 2004
+OP_MSG = 2013
+MORE_TO_COME = 1 << 1
+CHECKSUM_PRESENT = 1
+DEFAULT_BATCH_SIZE = 101
+
+# Marks fields that are not in a document
+MISSING = object()
+
+
+def getPath(document, path):
+    value = document
+    for key in path.split("."):
+        if not isinstance(value, dict) or key not in value:
+            return MISSING
+        value = value[key]
+    return value
+
+
+def setPath(document, path, value):
+    keys = path.split(".")
+    for key in keys[:-1]:
+        document = document.setdefault(key, {})
+    document[keys[-1]] = value
+
+
+def unsetPath(document, path):
+    keys = path.split(".")
+    for key in keys[:-1]:
+        document = document.get(key)
+        if not isinstance(document, dict):
+            return
+    document.pop(keys[-1], None)
+
+
+def _equals(value, expected):
+    if expected is None:
+        return value is MISSING or value is None
+    if isinstance(value, list) and not isinstance(expected, list):
+        return expected in value
+    return value is not MISSING and value == expected
+
+
+# BSON types matched by $type
+TYPES = {
+    "string": lambda value: isinstance(value, str),
+    "binData": lambda value: isinstance(value, bytes),
+}
+
+
+def _type(value, expected):
+    if expected not in TYPES:
+        raise ValueError("Unsupported $type {}".format(expected))
+    return value is not MISSING and TYPES[expected](value)
+
+
+def _compare(value, expected, compare):
+    if value is MISSING or value is None or expected is None:
+        return False
+    try:
+        return compare(value, expected)
+    except TypeError:
+        return False
+
+
+OPERATORS = {
+    "$eq": _equals,
+    "$ne": lambda value, expected: not _equals(value, expected),
+    "$in": lambda value, expected: any(_equals(value, item) for item in expected),
+    "$nin": lambda value, expected: not any(_equals(value, item) for item in expected),
+    "$exists": lambda value, expected: (value is not MISSING) == bool(expected),
+    "$type": _type,
+    "$lt": lambda value, expected: _compare(value, expected, lambda a, b: a < b),
+    "$lte": lambda value, expected: _compare(value, expected, lambda a, b: a <= b),
+    "$gt": lambda value, expected: _compare(value, expected, lambda a, b: a > b),
+    "$gte": lambda value, expected: _compare(value, expected, lambda a, b: a >= b),
+}
+
+
+def matchValue(value, condition):
+    if isinstance(condition, dict) and condition and all(key.startswith("$") for key in condition):
+        for operator, expected in condition.items():
+            if operator == "$not":
+                if matchValue(value, expected):
+                    return False
+            elif operator not in OPERATORS:
+                raise ValueError("Unsupported query operator {}".format(operator))
+            elif not OPERATORS[operator](value, expected):
+                return False
+        return True
+    return _equals(value, condition)
+
+
+def matches(document, query):
+    """
+    Checks if a document matches a query of equality, comparison, $in, $exists, $type, $or, $and and $nor conditions
+    """
+    for key, condition in query.items():
+        if key == "$or":
+            if not any(matches(document, subQuery) for subQuery in condition):
+                return False
+        elif key == "$and":
+            if not all(matches(document, subQuery) for subQuery in condition):
+                return False
+        elif key == "$nor":
+            if any(matches(document, subQuery) for subQuery in condition):
+                return False
+        elif not matchValue(getPath(document, key), condition):
+            return False
+    return True
+
+
+def _typeName(value):
+    if value is MISSING:
+        return "missing"
+    if value is None:
+        return "null"
+    return next((name for name, check in TYPES.items() if check(value)), "object")
+
+
+def evaluate(document, expression):
+    """
+    Evaluates a projection expression of field paths, literals, $type and $in
+    """
+    if isinstance(expression, str) and expression.startswith("$"):
+        return getPath(document, expression[1:])
+    if isinstance(expression, dict) and len(expression) == 1 and next(iter(expression)).startswith("$"):
+        operator, argument = next(iter(expression.items()))
+        if operator == "$type":
+            return _typeName(evaluate(document, argument))
+        if operator == "$in":
+            value, values = (evaluate(document, item) for item in argument)
+            return value in values
+        raise ValueError("Unsupported expression operator {}".format(operator))
+    return expression
+
+
+def project(document, projection):
+    if not projection:
+        return dict(document)
+    include = [key for key, value in projection.items() if value and key != "_id"]
+    if include:
+        result = {}
+        for key in include:
+            value = evaluate(document, projection[key]) if isinstance(projection[key], dict) else MISSING
+            if value is not MISSING:
+                result[key] = value
+            elif key in document:
+                result[key] = document[key]
+        if projection.get("_id", 1) and "_id" in document:
+            result["_id"] = document["_id"]
+        return result
+    return {key: value for key, value in document.items() if projection.get(key, 1)}
+
+
+def _groupValue(document, expression):
+    if isinstance(expression, str) and expression.startswith("$"):
+        value = getPath(document, expression[1:])
+        return None if value is MISSING else value
+    return expression
+
+
+def group(documents, spec):
+    """
+    Groups documents by an expression with $sum, $min, $max and $first accumulators
+    """
+    groups = {}
+    for document in documents:
+        key = _groupValue(document, spec["_id"])
+        result = groups.setdefault(repr(key), {"_id": key})
+        for field, accumulator in spec.items():
+            if field == "_id":
+                continue
+            operator, expression = next(iter(accumulator.items()))
+            value = _groupValue(document, expression)
+            if operator == "$sum":
+                result[field] = result.get(field, 0) + (value if isinstance(value, (int, float)) else 0)
+            elif operator == "$first":
+                result.setdefault(field, value)
+            elif operator in ("$min", "$max") and value is not None:
+                current = result.get(field)
+                pick = min if operator == "$min" else max
+                result[field] = value if current is None else pick(current, value)
+            elif operator not in ("$min", "$max"):
+                raise ValueError("Unsupported accumulator {}".format(operator))
+    return list(groups.values())
+
+
+def applyUpdate(document, update, inserting=False):
+    """
+    Applies $set, $unset, $inc, $min, $max and $setOnInsert update operators, or replaces the document
+    """
+    if not any(key.startswith("$") for key in update):
+        documentId = document.get("_id")
+        document.clear()
+        document.update(update)
+        document["_id"] = documentId
+        return
+    for path, value in update.get("$set", {}).items():
+        setPath(document, path, value)
+    for path in update.get("$unset", {}):
+        unsetPath(document, path)
+    for path, value in update.get("$inc", {}).items():
+        current = getPath(document, path)
+        setPath(document, path, (0 if current is MISSING else current) + value)
+    for operator, pick in (("$min", min), ("$max", max)):
+        for path, value in update.get(operator, {}).items():
+            current = getPath(document, path)
+            setPath(document, path, value if current is MISSING or current is None else pick(current, value))
+    if inserting:
+        for path, value in update.get("$setOnInsert", {}).items():
+            setPath(document, path, value)
+
+
+def _sortKey(document, path):
+    value = getPath(document, path)
+    # Missing and null values sort first like in mongo
+    return (0, 0) if value is MISSING or value is None else (1, value)
+
+
+def sortDocuments(documents, sort):
+    for path, direction in reversed(list((sort or {}).items())):
+        documents.sort(key=lambda document: _sortKey(document, path), reverse=direction < 0)
+    return documents
+
+
+class MongoStandIn:
+    """
+    In-memory mongo server on {host}:{port}. Each command waits {latency} seconds to simulate a remote server.
+    Counts commands by name so benchmarks can report the load on the database.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0):
+        self.latency = latency
+        self.collections = {}
+        self.indexes = {}
+        self.commandCounts = {}
+        self.busyTime = 0.0
+        self._cursors = {}
+        self._cursorIds = itertools.count(1)
+        self._lock = threading.Lock()
+        self._server = socketserver.ThreadingTCPServer((host, port), self._handlerClass())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def address(self):
+        return self._server.server_address[:2]
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def serveForever(self):
+        self._server.serve_forever()
+
+    def collection(self, namespace):
+        return self.collections.setdefault(namespace, {})
+
+    def runCommand(self, command):
+        name = next(iter(command))
+        if self.latency:
+            time.sleep(self.latency)
+        start = time.perf_counter()
+        with self._lock:
+            self.commandCounts[name] = self.commandCounts.get(name, 0) + 1
+            handler = getattr(self, "_cmd_" + name.lower(), None)
+            try:
+                if handler is None:
+                    return {"ok": 0.0, "errmsg": "no such command: '{}'".format(name), "code": 59}
+                reply = handler(command, command.get("$db", "admin"))
+                reply.setdefault("ok", 1.0)
+                return reply
+            except Exception as e:
+                return {"ok": 0.0, "errmsg": "{}: {}".format(type(e).__name__, e), "code": 2}
+            finally:
+                self.busyTime += time.perf_counter() - start
+
+    # Commands
+
+    def _cmd_hello(self, command, db):
+        return {"ismaster": True, "isWritablePrimary": True, "helloOk": True, "maxBsonObjectSize": 16 * 1024 * 1024,
+                "maxMessageSizeBytes": 48000000, "maxWriteBatchSize": 100000, "localTime": datetime.utcnow(),
+                "minWireVersion": 0, "maxWireVersion": 17, "readOnly": False}
+
+    _cmd_ismaster = _cmd_hello
+
+    def _cmd_ping(self, command, db):
+        return {}
+
+    def _cmd_buildinfo(self, command, db):
+        return {"version": "7.0.0", "versionArray": [7, 0, 0, 0]}
+
+    def _cmd_endsessions(self, command, db):
+        return {}
+
+    def _cmd_benchstats(self, command, db):
+        return {"commands": dict(self.commandCounts), "busyTime": self.busyTime}
+
+    def _cmd_insert(self, command, db):
+        collection = self.collection("{}.{}".format(db, command["insert"]))
+        for document in command.get("documents", []):
+            document.setdefault("_id", ObjectId())
+            collection[self._key(document["_id"])] = document
+        return {"n": len(command.get("documents", []))}
+
+    def _cmd_update(self, command, db):
+        collection = self.collection("{}.{}".format(db, command["update"]))
+        matched = modified = 0
+        upserted = []
+        for index, statement in enumerate(command.get("updates", [])):
+            documents = self._find(collection, statement["q"], single=not statement.get("multi"))
+            for document in documents:
+                before = dict(document)
+                applyUpdate(document, statement["u"])
+                matched += 1
+                modified += document != before
+            if not documents and statement.get("upsert"):
+                document = self._upsert(collection, statement["q"], statement["u"])
+                upserted.append({"index": index, "_id": document["_id"]})
+        reply = {"n": matched + len(upserted), "nModified": modified}
+        if upserted:
+            reply["upserted"] = upserted
+        return reply
+
+    def _cmd_findandmodify(self, command, db):
+        collection = self.collection("{}.{}".format(db, command["findAndModify"]))
+        documents = sortDocuments(self._find(collection, command.get("query", {})), command.get("sort"))
+        document = documents[0] if documents else None
+        if document is not None:
+            before = dict(document)
+            if command.get("remove"):
+                del collection[self._key(document["_id"])]
+            else:
+                applyUpdate(document, command["update"])
+            value = document if command.get("new") else before
+            return {"lastErrorObject": {"n": 1, "updatedExisting": True},
+                    "value": project(value, command.get("fields"))}
+        if command.get("upsert"):
+            document = self._upsert(collection, command.get("query", {}), command["update"])
+            return {"lastErrorObject": {"n": 1, "updatedExisting": False, "upserted": document["_id"]},
+                    "value": project(document, command.get("fields")) if command.get("new") else None}
+        return {"lastErrorObject": {"n": 0, "updatedExisting": False}, "value": None}
+
+    def _cmd_delete(self, command, db):
+        collection = self.collection("{}.{}".format(db, command["delete"]))
+        removed = 0
+        for statement in command.get("deletes", []):
+            for document in self._find(collection, statement["q"], single=statement.get("limit") == 1):
+                del collection[self._key(document["_id"])]
+                removed += 1
+        return {"n": removed}
+
+    def _cmd_find(self, command, db):
+        namespace = "{}.{}".format(db, command["find"])
+        documents = sortDocuments(self._find(self.collection(namespace), command.get("filter", {})),
+                                  command.get("sort"))
+        documents = documents[command.get("skip", 0):]
+        if command.get("limit"):
+            documents = documents[:abs(command["limit"])]
+        documents = [project(document, command.get("projection")) for document in documents]
+        return self._cursorReply(namespace, documents, command.get("batchSize", DEFAULT_BATCH_SIZE), "firstBatch")
+
+    def _cmd_getmore(self, command, db):
+        cursorId = int(command["getMore"])
+        namespace, documents = self._cursors.pop(cursorId, (None, []))
+        if namespace is None:
+            return {"ok": 0.0, "errmsg": "cursor id {} not found".format(cursorId), "code": 43}
+        return self._cursorReply(namespace, documents, command.get("batchSize", DEFAULT_BATCH_SIZE), "nextBatch",
+                                 cursorId)
+
+    def _cmd_killcursors(self, command, db):
+        for cursorId in command.get("cursors", []):
+            self._cursors.pop(int(cursorId), None)
+        return {"cursorsKilled": command.get("cursors", [])}
+
+    def _cmd_aggregate(self, command, db):
+        namespace = "{}.{}".format(db, command["aggregate"])
+        documents = list(self.collection(namespace).values())
+        for stage in command.get("pipeline", []):
+            name, spec = next(iter(stage.items()))
+            if name == "$match":
+                documents = [document for document in documents if matches(document, spec)]
+            elif name == "$sort":
+                documents = sortDocuments(documents, spec)
+            elif name == "$skip":
+                documents = documents[spec:]
+            elif name == "$limit":
+                documents = documents[:spec]
+            elif name == "$project":
+                documents = [project(document, spec) for document in documents]
+            elif name == "$group":
+                documents = group(documents, spec)
+            else:
+                raise ValueError("Unsupported aggregation stage {}".format(name))
+        batchSize = command.get("cursor", {}).get("batchSize", DEFAULT_BATCH_SIZE)
+        return self._cursorReply(namespace, documents, batchSize, "firstBatch")
+
+    def _cmd_count(self, command, db):
+        collection = self.collection("{}.{}".format(db, command["count"]))
+        return {"n": len(self._find(collection, command.get("query") or {}))}
+
+    def _cmd_createindexes(self, command, db):
+        indexes = self.indexes.setdefault("{}.{}".format(db, command["createIndexes"]), {})
+        for index in command.get("indexes", []):
+            indexes[index["name"]] = index
+        return {"numIndexesAfter": len(indexes) + 1}
+
+    def _cmd_listindexes(self, command, db):
+        namespace = "{}.{}".format(db, command["listIndexes"])
+        indexes = [{"v": 2, "key": {"_id": 1}, "name": "_id_"}]
+        indexes += [dict(index, v=2) for index in self.indexes.get(namespace, {}).values()]
+        return self._cursorReply(namespace, indexes, len(indexes) + 1, "firstBatch")
+
+    def _cmd_dropindexes(self, command, db):
+        self.indexes.get("{}.{}".format(db, command["dropIndexes"]), {}).pop(command.get("index"), None)
+        return {}
+
+    def _cmd_drop(self, command, db):
+        namespace = "{}.{}".format(db, command["drop"])
+        self.collections.pop(namespace, None)
+        self.indexes.pop(namespace, None)
+        return {}
+
+    def _cmd_explain(self, command, db):
+        explained = command["explain"]
+        namespace = "{}.{}".format(db, next(iter(explained.values())))
+        # Queries are reported as index scans once the collection has secondary indexes
+        stage = "IXSCAN" if self.indexes.get(namespace) else "COLLSCAN"
+        plan = {"stage": "FETCH", "inputStage": {"stage": stage}} if stage == "IXSCAN" else {"stage": stage}
+        return {"queryPlanner": {"namespace": namespace, "winningPlan": plan}}
+
+    # Helpers
+
+    @staticmethod
+    def _key(documentId):
+        # Binary ids compare by value and subtype, so they are keyed by their bytes
+        return bytes(documentId) if isinstance(documentId, bytes) else documentId
+
+    def _find(self, collection, query, single=False):
+        if set(query) == {"_id"} and not isinstance(query["_id"], dict):
+            document = collection.get(self._key(query["_id"]))
+            return [document] if document is not None else []
+        found = []
+        for document in collection.values():
+            if matches(document, query):
+                found.append(document)
+                if single:
+                    break
+        return found
+
+    def _upsert(self, collection, query, update):
+        document = {key: value for key, value in query.items()
+                    if not key.startswith("$") and not isinstance(value, dict)}
+        applyUpdate(document, update, inserting=True)
+        document.setdefault("_id", ObjectId())
+        collection[self._key(document["_id"])] = document
+        return document
+
+    def _cursorReply(self, namespace, documents, batchSize, batchName, cursorId=None):
+        batchSize = batchSize or DEFAULT_BATCH_SIZE
+        batch, remaining = documents[:batchSize], documents[batchSize:]
+        if remaining:
+            cursorId = cursorId or next(self._cursorIds)
+            self._cursors[cursorId] = (namespace, remaining)
+        else:
+            cursorId = 0
+        return {"cursor": {"id": Int64(cursorId), "ns": namespace, batchName: batch}}
+
+    # Wire protocol
+
+    def _handlerClass(self):
+        server = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                while True:
+                    header = _receive(self.request, 16)
+                    if header is None:
+                        return
+                    length, requestId, responseTo, opCode = struct.unpack("<iiii", header)
+                    body = _receive(self.request, length - 16)
+                    if body is None:
+                        return
+                    reply = server._handleMessage(requestId, opCode, body)
+                    if reply is not None:
+                        self.request.sendall(reply)
+
+        return Handler
+
+    def _handleMessage(self, requestId, opCode, body):
+        if opCode == OP_QUERY:
+            flags, = struct.unpack_from("<i", body)
+            nameEnd = body.index(b"\0", 4)
+            query = bson.decode(body[nameEnd + 9:nameEnd + 9 + struct.unpack_from("<i", body, nameEnd + 9)[0]])
+            reply = bson.encode(self.runCommand(query.get("$query", query)))
+            payload = struct.pack("<iqii", 8, 0, 0, 1) + reply
+            return struct.pack("<iiii", 16 + len(payload), requestId, requestId, OP_REPLY) + payload
+
+        if opCode != OP_MSG:
+            return None
+        flags, = struct.unpack_from("<I", body)
+        end = len(body) - 4 if flags & CHECKSUM_PRESENT else len(body)
+        position = 4
+        command = None
+        sequences = {}
+        while position < end:
+            kind = body[position]
+            position += 1
+            size, = struct.unpack_from("<i", body, position)
+            if kind == 0:
+                command = bson.decode(body[position:position + size])
+            else:
+                identifierEnd = body.index(b"\0", position + 4)
+                identifier = body[position + 4:identifierEnd].decode()
+                sequences[identifier] = bson.decode_all(body[identifierEnd + 1:position + size])
+            position += size
+        command.update(sequences)
+
+        reply = self.runCommand(command)
+        if flags & MORE_TO_COME:
+            return None
+        payload = struct.pack("<I", 0) + b"\0" + bson.encode(reply)
+        return struct.pack("<iiii", 16 + len(payload), requestId, requestId, OP_MSG) + payload
+
+
+def _receive(connection, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = connection.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return bytes(data)
@@ -0,0 +1,141 @@
+"""
+Measures tasks/sec through the web scrap processor with a no-op scraper, so only the cost of handing articles
+to the worker processes and their results back is measured. Compares the batched result channel with the
+previous handshake, where each article carried a Manager lock the submitting thread waited on.
+
+python -m benchmarks.processor_benchmark --tasks 20000 --workers 4 --in-flight 256
+"""
+import argparse
+import itertools
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from multiprocess import Manager, Process
+
+from src.config import LOGGER_FORMAT, TASK_BATCH_SIZE
+from src.mongo_service import ArticleInfo
+from src.scrap_result import ScrapResult
+from src.task_channel import BatchSender, receiveBatches, decodeTask, encodeResult
+from src.web_scrap_processor import WebScrapProcessor
+
+
+class NoOpProcessor(WebScrapProcessor):
+    """
+    Processor whose workers report every article as scraped without doing anything
+    """
+
+    def _processRun(self, taskQueue, resultQueue, startEvent, metricsQueue=None):
+        resultSender = BatchSender(resultQueue, self.batchSize)
+        startEvent.set()
+        for data in receiveBatches(taskQueue):
+            articleInfo, taskId, submittedAt = decodeTask(data)
+            resultSender.put(encodeResult(taskId, ScrapResult(200)))
+        resultSender.close()
+
+
+class LockHandshakeProcessor:
+    """
+    The previous processor: a Manager queue of tasks, one Manager lock per article that the submitting
+    thread waits on and results returned through a Manager dict
+    """
+
+    def __init__(self, max_workers):
+        self._manager = Manager()
+        self._taskQueue = self._manager.Queue()
+        self._results = self._manager.dict()
+        self._taskIds = itertools.count()
+        self._processes = [Process(target=self._processRun, args=[self._taskQueue, self._results], daemon=True)
+                           for i in range(max_workers)]
+        for p in self._processes:
+            p.start()
+
+    def submitArticle(self, articleInfo):
+        taskId = next(self._taskIds)
+        completeLock = self._manager.Lock()
+        completeLock.acquire()
+        self._taskQueue.put([articleInfo, completeLock, taskId])
+        completeLock.acquire()
+        return self._results.pop(taskId, None)
+
+    def dispose(self):
+        for p in self._processes:
+            self._taskQueue.put(None)
+        for p in self._processes:
+            p.join(10)
+        self._manager.shutdown()
+
+    @staticmethod
+    def _processRun(queue, results):
+        while True:
+            request = queue.get()
+            if request is None:
+                return
+            results[request[2]] = ScrapResult(200)
+            request[1].release()
+
+
+def runResultChannel(articles, workers, inFlight, batchSize):
+    processor = NoOpProcessor(workers, batchSize)
+    slots = threading.Semaphore(inFlight)
+    done = threading.Event()
+    remaining = [len(articles)]
+    lock = threading.Lock()
+
+    def onDone(future):
+        slots.release()
+        with lock:
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                done.set()
+
+    start = time.perf_counter()
+    for article in articles:
+        slots.acquire()
+        processor.submitArticle(article).add_done_callback(onDone)
+    done.wait()
+    elapsed = time.perf_counter() - start
+    processor.dispose()
+    return elapsed
+
+
+def runLockHandshake(articles, workers, inFlight):
+    processor = LockHandshakeProcessor(workers)
+    # Every in-flight article holds a submitting thread
+    with ThreadPoolExecutor(inFlight) as executor:
+        start = time.perf_counter()
+        list(executor.map(processor.submitArticle, articles))
+        elapsed = time.perf_counter() - start
+    processor.dispose()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tasks", type=int, default=20000, help="number of no-op articles to submit")
+    parser.add_argument("--workers", type=int, default=4, help="number of worker processes")
+    parser.add_argument("--in-flight", type=int, default=256, help="maximum submitted articles not yet complete")
+    parser.add_argument("--batch-size", type=int, default=TASK_BATCH_SIZE, help="maximum items per message")
+    parser.add_argument("--skip-handshake", action="store_true", help="only measure the result channel")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format=LOGGER_FORMAT)
+    logger = logging.getLogger("ProcessorBenchmark")
+    articles = [ArticleInfo(uuid.uuid4(), "https://example.com/article/{}".format(i)) for i in range(args.tasks)]
+
+    channelTime = runResultChannel(articles, args.workers, args.in_flight, args.batch_size)
+    logger.info("result channel: %s tasks in %.2f s (%.0f tasks/sec)", len(articles), channelTime,
+                len(articles) / channelTime)
+    if args.skip_handshake:
+        return
+
+    handshakeTime = runLockHandshake(articles, args.workers, args.in_flight)
+    logger.info("lock handshake: %s tasks in %.2f s (%.0f tasks/sec)", len(articles), handshakeTime,
+                len(articles) / handshakeTime)
+    logger.info("result channel speedup: %.1fx", handshakeTime / channelTime)
+
+
+if __name__ == "__main__":
+    main()
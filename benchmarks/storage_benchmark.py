@@ -0,0 +1,96 @@
+"""
+Reports the size of stored web scraps and the cost of compressing them for each zlib level. Pages of a corpus are
+stored as strings ("none") or compressed binaries, and the size of their BSON documents and the time to encode and
+decode them is measured.
+The pages of the extraction corpus are about 2 KB, far smaller than real article pages, so each page is enlarged to
+--size KB with related links, paragraphs and scripts made of random words of the corpus and random ids. The content
+does not repeat, as repeating the body (--scale) is compressed far better than real pages.
+
+python -m benchmarks.storage_benchmark --corpus tests/fixtures/extraction --size 48 --repeat 20
+"""
+import argparse
+import logging
+import os
+import random
+import re
+import time
+
+from bson import BSON
+
+from benchmarks.charset_benchmark import loadPages
+from src.config import LOGGER_FORMAT
+from src.stored_html import encodeWebScrap, decodeWebScrap
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LEVELS = (1, 3, 6, 9)
+WORD_PATTERN = re.compile(r"[A-Za-z]{3,}")
+
+
+def enlargePage(html, size, words, rng):
+    """
+    Adds related links, paragraphs and scripts before the end of the body of a page until it reaches {size} bytes
+    :param words: words the added text is made of
+    :param rng: random generator, seeded so runs store the same pages
+    """
+    blocks = []
+    length = len(html.encode())
+    while length < size:
+        sentence = " ".join(rng.choice(words) for i in range(rng.randint(8, 30))).capitalize() + "."
+        kind = rng.random()
+        if kind < 0.5:
+            block = '<li class="related"><a href="/{}/{:08x}">{}</a></li>\n'.format(
+                rng.choice(words).lower(), rng.getrandbits(32), sentence)
+        elif kind < 0.9:
+            block = "<p>{}</p>\n".format(sentence)
+        else:
+            block = '<script>window.dataLayer.push({{"id": "{:032x}", "slot": "{}"}});</script>\n'.format(
+                rng.getrandbits(128), rng.choice(words))
+        blocks.append(block)
+        length += len(block.encode())
+    head, separator, tail = html.rpartition("</body>")
+    return head + "".join(blocks) + separator + tail if separator else html + "".join(blocks)
+
+
+def timePerMb(fn, values, repeat, size):
+    start = time.perf_counter()
+    for i in range(repeat):
+        for value in values:
+            fn(value)
+    return 1000 * (time.perf_counter() - start) / repeat / (size / 2 ** 20)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", default=os.path.join(ROOT, "tests", "fixtures", "extraction"),
+                        help="directory of html pages")
+    parser.add_argument("--size", type=int, default=48, help="KB each page is enlarged to (0 keeps pages as they are)")
+    parser.add_argument("--scale", type=int, default=1, help="times the body of each page is repeated")
+    parser.add_argument("--repeat", type=int, default=20, help="times each page is encoded and decoded for timing")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format=LOGGER_FORMAT)
+    logger = logging.getLogger("StorageBenchmark")
+    pages = [html for name, html in loadPages(args.corpus, args.scale)]
+    if args.size:
+        words = sorted(set(WORD_PATTERN.findall(" ".join(re.sub(r"<[^>]*>", " ", html) for html in pages))))
+        rng = random.Random(0)
+        pages = [enlargePage(html, args.size * 1024, words, rng) for html in pages]
+    size = sum(len(html.encode()) for html in pages)
+    logger.info("%s pages of %.0f KB on average", len(pages), size / len(pages) / 1024)
+
+    plainBson = sum(len(BSON.encode({"web_scrap": html})) for html in pages)
+    for compression, level in [("none", 0)] + [("zlib", level) for level in LEVELS]:
+        stored = [encodeWebScrap(html, compression, level) for html in pages]
+        if any(decodeWebScrap(value) != html for value, html in zip(stored, pages)):
+            raise AssertionError("Pages changed when stored with {} level {}".format(compression, level))
+        storedBson = sum(len(BSON.encode({"web_scrap": value})) for value in stored)
+
+        encodeMs = timePerMb(lambda html: encodeWebScrap(html, compression, level), pages, args.repeat, size)
+        decodeMs = timePerMb(decodeWebScrap, stored, args.repeat, size)
+        logger.info("%-4s level %s: %6.1f KB stored per page (ratio %5.2f) | encode %7.2f ms/MB | decode %6.2f ms/MB",
+                    compression, level, storedBson / len(pages) / 1024, plainBson / storedBson, encodeMs, decodeMs)
+
+
+if __name__ == "__main__":
+    main()
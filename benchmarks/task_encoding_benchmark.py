@@ -0,0 +1,97 @@
+"""
+Reports the per task serialization cost of the processor queue and the memory of queued articles.
+Compares the previous encoding (a dict based article info pickled with dill and recurse enabled, together with
+its task id) against pickling the slotted ArticleInfo and the compact task wire format.
+
+python -m benchmarks.task_encoding_benchmark --tasks 100000
+"""
+import argparse
+import gc
+import logging
+import pickle
+import time
+import tracemalloc
+import uuid
+
+import dill
+
+from src.config import LOGGER_FORMAT
+from src.mongo_service import ArticleInfo
+from src.task_channel import encodeTask, decodeTask
+
+
+class DictArticleInfo:
+    """
+    The previous article info that stored its fields in a __dict__
+    """
+
+    def __init__(self, articleId, articleUrl, storedHtml=None):
+        self.articleId = articleId
+        self.articleUrl = articleUrl
+        self.storedHtml = storedHtml
+
+
+def timePerTask(encode, decode, tasks):
+    start = time.perf_counter()
+    encoded = [encode(task) for task in tasks]
+    encodeTime = time.perf_counter() - start
+    start = time.perf_counter()
+    for data in encoded:
+        decode(data)
+    decodeTime = time.perf_counter() - start
+    size = sum(len(data) for data in encoded) / len(encoded)
+    return 1e6 * encodeTime / len(tasks), 1e6 * decodeTime / len(tasks), size
+
+
+def bytesPerArticle(create, count):
+    gc.collect()
+    tracemalloc.start()
+    articles = [create(i) for i in range(count)]
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del articles
+    return current / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tasks", type=int, default=100000, help="number of tasks to encode and articles to queue")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format=LOGGER_FORMAT)
+    logger = logging.getLogger("TaskEncodingBenchmark")
+    dill.settings['recurse'] = True
+
+    ids = [uuid.uuid4() for i in range(args.tasks)]
+    urls = ["https://thehackernews.com/2024/05/article-{}.html".format(i) for i in range(args.tasks)]
+
+    previousTasks = [[DictArticleInfo(ids[i], urls[i]), i] for i in range(args.tasks)]
+    slottedTasks = [(ArticleInfo(ids[i], urls[i]), i) for i in range(args.tasks)]
+    encodings = [
+        ("dill, dict article info", previousTasks, dill.dumps, dill.loads),
+        ("pickle, slotted article info", slottedTasks,
+         lambda task: pickle.dumps(task, pickle.HIGHEST_PROTOCOL), pickle.loads),
+        ("compact wire format", slottedTasks, lambda task: encodeTask(*task), decodeTask),
+    ]
+    for name, tasks, encode, decode in encodings:
+        encodeTime, decodeTime, size = timePerTask(encode, decode, tasks)
+        logger.info("%-30s encode %6.2f us | decode %6.2f us | %6.1f bytes per task",
+                    name, encodeTime, decodeTime, size)
+
+    del previousTasks, slottedTasks
+    # Ids are decoded for each article as they are read from the db while urls are shared,
+    # so article infos are measured without their urls and encoded tasks with their copy of the url
+    rawIds = [articleId.bytes for articleId in ids]
+    memory = [
+        ("dict article info", lambda i: DictArticleInfo(uuid.UUID(bytes=rawIds[i]), urls[i])),
+        ("slotted article info", lambda i: ArticleInfo(uuid.UUID(bytes=rawIds[i]), urls[i])),
+        ("encoded task", lambda i: encodeTask(ArticleInfo(uuid.UUID(bytes=rawIds[i]), urls[i]), i)),
+    ]
+    for name, create in memory:
+        perArticle = bytesPerArticle(create, args.tasks)
+        logger.info("%-30s %6.1f bytes per article | %7.1f MB per 1M queued articles",
+                    name, perArticle, perArticle * 1e6 / 2 ** 20)
+
+
+if __name__ == "__main__":
+    main()
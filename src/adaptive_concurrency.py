@@ -0,0 +1,126 @@
+import time
+from logging import Logger
+
+from src.circuit_breaker import isHostFailure
+from src.config import CONCURRENCY_MIN, CONCURRENCY_MAX, CONCURRENCY_INTERVAL, CONCURRENCY_LATENCY_FACTOR, \
+    CONCURRENCY_MAX_ERROR_RATE, CONCURRENCY_MAX_CPU
+from src.domain_scheduler import isThrottled
+from src.pipeline_stage import ConcurrencyLimit
+
+# Limits are multiplied by this factor when a window shows congestion
+DECREASE_FACTOR = 0.75
+# Limits grow by this many slots per window once out of slow start
+INCREASE_STEP = 1
+# Windows end once they have this many results (or as many as the limit if lower), so slow windows are not judged on
+# a few articles
+WINDOW_RESULTS = 20
+
+
+class AdaptiveConcurrencyLimit(ConcurrencyLimit):
+    """
+    Concurrency limit of a worker adjusted by AIMD from the results of its articles. Every {interval} seconds the
+    results of the window are checked: the limit is decreased by {DECREASE_FACTOR} when the share of host failures
+    exceeds {maxErrorRate}, when the mean fetch latency exceeds {latencyFactor} times its lowest window mean or when
+    the cpu use of the process exceeds {maxCpu}. Otherwise the limit is increased while the window used all its slots:
+    doubled until the first decrease (slow start), then by {INCREASE_STEP}. Limits stay within {minLimit} and
+    {maxLimit}, and each change is logged with the measures of its window.
+    """
+
+    def __init__(self, limit, logger: Logger, minLimit=CONCURRENCY_MIN, maxLimit=CONCURRENCY_MAX,
+                 interval=CONCURRENCY_INTERVAL, latencyFactor=CONCURRENCY_LATENCY_FACTOR,
+                 maxErrorRate=CONCURRENCY_MAX_ERROR_RATE, maxCpu=CONCURRENCY_MAX_CPU, clock=time.monotonic,
+                 cpuClock=time.process_time):
+        """
+        :param limit: initial limit
+        :param clock: wall clock in seconds
+        :param cpuClock: cpu time of the process in seconds
+        """
+        super().__init__(max(minLimit, min(maxLimit, limit)))
+        self.logger = logger
+        self.minLimit = minLimit
+        self.maxLimit = maxLimit
+        self.interval = interval
+        self.latencyFactor = latencyFactor
+        self.maxErrorRate = maxErrorRate
+        self.maxCpu = maxCpu
+        self.clock = clock
+        self.cpuClock = cpuClock
+        self.slowStart = True
+        self.baselineLatency = None
+        self.decisions = 0
+        self._startWindow(clock())
+
+    def started(self):
+        with self._condition:
+            self.inUse += 1
+            self._peakInUse = max(self._peakInUse, self.inUse)
+
+    def release(self, result=None):
+        decision = None
+        with self._condition:
+            if result is not None:
+                self._results += 1
+                # Pages skipped by their content type fail without a status, but their host answered
+                if (isHostFailure(result) or isThrottled(result)) and result.fetchStatus is None:
+                    self._failures += 1
+                elif result.error is None and result.elapsed:
+                    self._latencySum += result.elapsed
+                    self._latencyCount += 1
+            now = self.clock()
+            if now - self._windowStart >= self.interval and self._results >= min(self.limit, WINDOW_RESULTS):
+                decision = self._adjust(now)
+            super().release()
+        if decision is not None:
+            self.logger.info(*decision)
+
+    def _startWindow(self, now):
+        self._windowStart = now
+        self._windowCpu = self.cpuClock()
+        self._results = 0
+        self._failures = 0
+        self._latencySum = 0.0
+        self._latencyCount = 0
+        self._peakInUse = self.inUse
+
+    def _adjust(self, now):
+        """
+        Adjusts the limit from the results of the window ending {now}. Called with the condition held.
+        :return: arguments of the log message of the change (or null if the limit is unchanged)
+        """
+        elapsed = now - self._windowStart
+        throughput = self._results / elapsed
+        errorRate = self._failures / self._results
+        cpu = (self.cpuClock() - self._windowCpu) / elapsed
+        latency = self._latencySum / self._latencyCount if self._latencyCount else None
+        if latency is not None and (self.baselineLatency is None or latency < self.baselineLatency):
+            self.baselineLatency = latency
+
+        limit = self.limit
+        if errorRate > self.maxErrorRate:
+            reason = "error rate {:.0%}".format(errorRate)
+        elif latency is not None and latency > self.latencyFactor * self.baselineLatency:
+            reason = "latency {:.0f} ms over {:.0f} ms".format(1000 * latency, 1000 * self.baselineLatency)
+            # Latency stays high while the hosts are slow, so only react once per increase
+            self.baselineLatency = latency / self.latencyFactor
+        elif cpu > self.maxCpu:
+            reason = "cpu {:.0%}".format(cpu)
+        else:
+            reason = None
+
+        if reason is not None:
+            self.slowStart = False
+            newLimit = max(self.minLimit, int(limit * DECREASE_FACTOR))
+        elif self._peakInUse >= limit:
+            reason = "slow start" if self.slowStart else "all slots used"
+            newLimit = min(self.maxLimit, limit * 2 if self.slowStart else limit + INCREASE_STEP)
+        else:
+            newLimit = limit
+        self._startWindow(now)
+        if newLimit == limit:
+            return None
+
+        self.decisions += 1
+        self.setLimit(newLimit)
+        return ("Concurrency %s -> %s (%s): %.1f articles/s, latency %s, errors %.0f%%, cpu %.0f%%", limit, newLimit,
+                reason, throughput, "{:.0f} ms".format(1000 * latency) if latency is not None else "-",
+                100 * errorRate, 100 * cpu)
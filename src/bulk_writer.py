@@ -0,0 +1,171 @@
+import threading
+import time
+from logging import Logger
+
+from pymongo import UpdateOne, UpdateMany
+from pymongo.errors import BulkWriteError
+
+from src.config import WRITE_BATCH_SIZE, WRITE_FLUSH_INTERVAL
+from src.metrics import getMetrics, STAGE_SECONDS, DB_WRITE, ARTICLES_WRITTEN
+
+
+class BulkArticleWriter:
+    """
+    Buffers article updates and writes them to mongo in unordered bulk batches.
+    Updates for the same article are merged into a single update so each article costs one write.
+    A batch is flushed when it reaches {WRITE_BATCH_SIZE} articles or when the oldest pending update
+    is older than {WRITE_FLUSH_INTERVAL} seconds. Batches are written by a background thread so callers never wait on mongo.
+    Updates of an article with duplicates are written to the article and its duplicates with a single update.
+    """
+
+    def __init__(self, collection, logger: Logger, batchSize=WRITE_BATCH_SIZE, flushInterval=WRITE_FLUSH_INTERVAL):
+        self.collection = collection
+        self.logger = logger
+        self.batchSize = batchSize
+        self.flushInterval = flushInterval
+
+        self._pendingLock = threading.Lock()
+        self._pending = {}
+        self._pendingSince = None
+        # Ids of the duplicates of articles, see setDuplicates
+        self._duplicates = {}
+        # Only one batch is written at a time so batches are applied in order
+        self._flushLock = threading.Lock()
+
+        self._closed = threading.Event()
+        self._flushRequested = threading.Event()
+        self._timerThread = None
+
+        # Statistics
+        self.batchCount = 0
+        self.writeCount = 0
+        self.errorCount = 0
+        self.totalLatency = 0.0
+
+    def set(self, articleId, fields: dict, upsert=False):
+        """
+        Adds fields to set on an article. Fields for an article already pending are merged.
+        :param articleId: id of the article to update
+        :param fields: fields to $set on the article
+        :param upsert: whether the update should insert the article if it does not exist
+        """
+        with self._pendingLock:
+            entry = self._pending.get(articleId)
+            if entry is None:
+                self._pending[articleId] = [dict(fields), upsert, self._duplicates.get(articleId)]
+            else:
+                entry[0].update(fields)
+                entry[1] = entry[1] or upsert
+                entry[2] = self._duplicates.get(articleId, entry[2])
+
+            if self._pendingSince is None:
+                self._pendingSince = time.monotonic()
+            shouldFlush = len(self._pending) >= self.batchSize
+
+        self._startTimer()
+        if shouldFlush:
+            self._flushRequested.set()
+
+    def setDuplicates(self, articleId, duplicateIds):
+        """
+        Writes the updates of an article to its duplicates as well until they are cleared
+        :param duplicateIds: ids of the articles that share the updates of the article
+        """
+        with self._pendingLock:
+            self._duplicates[articleId] = list(duplicateIds)
+            entry = self._pending.get(articleId)
+            if entry is not None:
+                entry[2] = self._duplicates[articleId]
+
+    def clearDuplicates(self, articleId):
+        """
+        Stops writing the updates of an article to its duplicates, pending updates are still written to them
+        """
+        with self._pendingLock:
+            self._duplicates.pop(articleId, None)
+
+    def flush(self):
+        """
+        Writes all pending updates to mongo as one unordered bulk write
+        """
+        with self._flushLock:
+            with self._pendingLock:
+                pending = self._pending
+                self._pending = {}
+                self._pendingSince = None
+
+            if not pending:
+                return
+
+            requests = [UpdateMany({"_id": {"$in": [articleId] + duplicateIds}}, {"$set": fields}) if duplicateIds else
+                        UpdateOne({"_id": articleId}, {"$set": fields}, upsert=upsert)
+                        for articleId, (fields, upsert, duplicateIds) in pending.items()]
+            self._write(requests, len(pending) + sum(len(entry[2]) for entry in pending.values() if entry[2]))
+
+    def close(self):
+        """
+        Flushes pending updates and stops the flush timer
+        """
+        self._closed.set()
+        self._flushRequested.set()
+        if self._timerThread is not None:
+            self._timerThread.join()
+        self.flush()
+        if self.batchCount > 0:
+            self.logger.info("Bulk writer wrote %s articles in %s batches (%s errors, avg batch latency %.1f ms)",
+                             self.writeCount, self.batchCount, self.errorCount,
+                             1000 * self.totalLatency / self.batchCount)
+
+    def _write(self, requests, articleCount=None):
+        """
+        :param articleCount: articles updated by the requests (default is one per request)
+        """
+        if articleCount is None:
+            articleCount = len(requests)
+        start = time.perf_counter()
+        errors = 0
+        written = articleCount
+        try:
+            self.collection.bulk_write(requests, ordered=False)
+        except BulkWriteError as e:
+            errors = len(e.details.get("writeErrors", []))
+            written = max(0, articleCount - errors)
+            self.logger.error("Bulk write completed with %s errors", errors, exc_info=e)
+        except Exception as e:
+            errors = len(requests)
+            written = 0
+            self.logger.error("Bulk write failed for %s articles", articleCount, exc_info=e)
+        latency = time.perf_counter() - start
+
+        self.batchCount += 1
+        self.writeCount += written
+        self.errorCount += errors
+        self.totalLatency += latency
+        metrics = getMetrics()
+        metrics.observe(STAGE_SECONDS, latency, DB_WRITE)
+        metrics.increment(ARTICLES_WRITTEN, written)
+        self.logger.debug("Wrote batch of %s articles in %.1f ms (%s errors)", articleCount, 1000 * latency, errors)
+
+    def _startTimer(self):
+        if self._timerThread is not None or self._closed.is_set():
+            return
+        with self._pendingLock:
+            if self._timerThread is not None:
+                return
+            self._timerThread = threading.Thread(target=self._timerRun, daemon=True)
+        self._timerThread.start()
+
+    def _timerRun(self):
+        # Flushes full batches and batches that have waited longer than the flush interval
+        while not self._closed.is_set():
+            requested = self._flushRequested.wait(self.flushInterval / 2)
+            self._flushRequested.clear()
+            with self._pendingLock:
+                pendingSince = self._pendingSince
+            if self._closed.is_set():
+                break
+            if requested or (pendingSince is not None and time.monotonic() - pendingSince >= self.flushInterval):
+                try:
+                    self.flush()
+                except Exception as e:
+                    self.logger.error("Timed flush failed", exc_info=e)
@@ -0,0 +1,102 @@
+import codecs
+import re
+
+from requests.compat import chardet
+
+# Byte order marks, checked before anything else as they cannot be mistaken
+BOMS = ((codecs.BOM_UTF8, "utf-8"), (codecs.BOM_UTF16_LE, "utf-16-le"), (codecs.BOM_UTF16_BE, "utf-16-be"))
+# Bytes at the start of a page searched for a <meta> charset or xml encoding declaration
+DECLARATION_BYTES = 4096
+# Bytes of a page given to the statistical detector when the page declares no encoding and is not utf-8
+SNIFF_BYTES = 4096
+# Encoding of pages that declare none and whose encoding cannot be detected, the default of browsers
+DEFAULT_ENCODING = "cp1252"
+
+CHARSET_PATTERN = re.compile(r"""charset\s*=\s*["']?\s*([a-zA-Z0-9_.:-]+)""", re.IGNORECASE)
+META_CHARSET_PATTERN = re.compile(rb"""<meta[^>]+charset\s*=\s*["']?\s*([a-zA-Z0-9_.:-]+)""", re.IGNORECASE)
+XML_ENCODING_PATTERN = re.compile(rb"""^\s*<\?xml[^>]+encoding\s*=\s*["']([a-zA-Z0-9_.:-]+)""", re.IGNORECASE)
+NON_ASCII_PATTERN = re.compile(rb"[\x80-\xff]")
+
+# Sources of the encoding of a page
+BOM = "bom"
+HEADER = "header"
+META = "meta"
+UTF8 = "utf-8"
+SNIFF = "sniff"
+
+
+def charsetFromContentType(contentType):
+    """
+    :param contentType: value of a content type header (or null)
+    :return: charset parameter of the header (or null if it has none)
+    """
+    match = CHARSET_PATTERN.search(contentType) if contentType else None
+    return match.group(1) if match else None
+
+
+def normalizeEncoding(label, declared=False):
+    """
+    Converts an encoding label to the name of its python codec.
+    Latin-1 and ascii labels are read as windows-1252 like browsers do, the pages labelled so use its characters.
+    :param declared: label was declared inside the page, where utf-16 labels can only mean utf-8 as the page was
+    readable as ascii
+    :return: codec name (or null if the label is unknown)
+    """
+    try:
+        name = codecs.lookup(label.strip()).name
+    except (LookupError, ValueError):
+        return None
+    if name in ("latin-1", "iso8859-1", "ascii"):
+        return DEFAULT_ENCODING
+    if declared and name.startswith("utf-16"):
+        return "utf-8"
+    return name
+
+
+def detectEncoding(body, headerCharset=None):
+    """
+    Finds the encoding of a page from cheap sources: a byte order mark, the charset of the content type header,
+    then a <meta> charset or xml declaration in the first {DECLARATION_BYTES} bytes.
+    :param headerCharset: charset of the content type header (or null if it has none)
+    :return: tuple of the codec name and the source of the encoding, or (null, null) if the page declares none
+    """
+    for bom, encoding in BOMS:
+        if body.startswith(bom):
+            return encoding, BOM
+    encoding = normalizeEncoding(headerCharset) if headerCharset else None
+    if encoding:
+        return encoding, HEADER
+    prefix = body[:DECLARATION_BYTES]
+    match = META_CHARSET_PATTERN.search(prefix) or XML_ENCODING_PATTERN.search(prefix)
+    encoding = normalizeEncoding(match.group(1).decode("ascii"), declared=True) if match else None
+    if encoding:
+        return encoding, META
+    return None, None
+
+
+def decodeHtml(body, headerCharset=None):
+    """
+    Decodes a page with the encoding found by detectEncoding. Pages that declare no encoding are decoded as utf-8
+    when they are valid utf-8, which is checked by decoding them. Only other pages are given to the statistical
+    detector, and only {SNIFF_BYTES} bytes from their first non-ascii byte: the head of pages is mostly ascii markup
+    that tells the detector nothing.
+    Undecodable bytes (such as a character cut off by truncation) are replaced.
+    :return: tuple of the text, codec name and source of the encoding
+    """
+    encoding, source = detectEncoding(body, headerCharset)
+    if encoding is not None:
+        if source == BOM:
+            body = body[len(codecs.BOM_UTF8 if encoding == "utf-8" else codecs.BOM_UTF16_LE):]
+        return body.decode(encoding, errors="replace"), encoding, source
+
+    try:
+        return body.decode("utf-8"), "utf-8", UTF8
+    except UnicodeDecodeError as e:
+        # A page cut off inside its last character is still utf-8
+        if e.reason == "unexpected end of data" and e.start >= len(body) - 3:
+            return body.decode("utf-8", errors="replace"), "utf-8", UTF8
+
+    start = NON_ASCII_PATTERN.search(body).start()
+    detected = chardet.detect(body[start:start + SNIFF_BYTES])["encoding"]
+    encoding = (normalizeEncoding(detected) if detected else None) or DEFAULT_ENCODING
+    return body.decode(encoding, errors="replace"), encoding, SNIFF
@@ -0,0 +1,97 @@
+import threading
+import time
+from logging import Logger
+
+from src.config import BREAKER_FAILURE_THRESHOLD, BREAKER_COOLDOWN
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+def isHostFailure(result):
+    """
+    Checks if a result indicates the host is unavailable: no response (connection errors and timeouts) or a 5xx status
+    """
+    if result is None or result.error is None:
+        return False
+    return result.status is None or result.status >= 500
+
+
+class BreakerState:
+    """
+    Circuit breaker state of a single host
+    """
+
+    def __init__(self):
+        self.state = CLOSED
+        self.failures = 0
+        self.openedAt = 0.0
+        self.skipped = 0
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker keyed by host. After {failureThreshold} consecutive failures a host is opened and its articles
+    are skipped for {cooldown} seconds. Then a single trial request is let through, which closes the host again
+    on success or reopens it on failure.
+    """
+
+    def __init__(self, logger: Logger, failureThreshold=BREAKER_FAILURE_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.logger = logger
+        self.failureThreshold = failureThreshold
+        self.cooldown = cooldown
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def allowRequest(self, host):
+        """
+        Checks if a request to a host may be made. Requests that are not allowed are counted as skipped.
+        """
+        with self._lock:
+            state = self._hosts.get(host)
+            if state is None or state.state == CLOSED:
+                return True
+
+            if state.state == OPEN and time.monotonic() - state.openedAt >= self.cooldown:
+                state.state = HALF_OPEN
+                self.logger.info("Circuit for %s is half-open, sending trial request", host)
+                return True
+
+            state.skipped += 1
+            return False
+
+    def recordResult(self, host, result):
+        """
+        Updates the circuit of a host with the result of a request
+        """
+        with self._lock:
+            state = self._hosts.get(host)
+            if state is None:
+                state = self._hosts[host] = BreakerState()
+
+            if not isHostFailure(result):
+                if state.state != CLOSED:
+                    self.logger.info("Circuit for %s closed", host)
+                state.state = CLOSED
+                state.failures = 0
+                return
+
+            state.failures += 1
+            if state.state == HALF_OPEN or (state.state == CLOSED and state.failures >= self.failureThreshold):
+                state.state = OPEN
+                state.openedAt = time.monotonic()
+                self.logger.warning("Circuit for %s opened after %s consecutive failures (last: %s), "
+                                    "skipping its articles for %ss", host, state.failures, result.error, self.cooldown)
+
+    def getState(self, host):
+        with self._lock:
+            state = self._hosts.get(host)
+            return CLOSED if state is None else state.state
+
+    def getSkipCounts(self):
+        """
+        :return: dict of host to number of skipped articles for hosts that had articles skipped
+        """
+        with self._lock:
+            return {host: state.skipped for host, state in self._hosts.items() if state.skipped > 0}
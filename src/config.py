@@ -1,4 +1,5 @@
 import os
+import socket
 
 # Db Variables
 MONGO_PORT = os.getenv('MONGO_PORT', "27017")
@@ -8,17 +9,137 @@ MONGO_PASSWORD = os.getenv('MONGO_PASSWORD')
 MONGO_DB_NAME = os.getenv('MONGO_DB_NAME')
 MONGO_COLLECTION = os.getenv('MONGO_COLLECTION', "articleContent")
 DB_MAX_RETRIES = int(os.getenv('DB_MAX_RETRIES', "3"))
+READ_BATCH_SIZE = int(os.getenv('READ_BATCH_SIZE', "500"))
+ENSURE_INDEXES = os.getenv('ENSURE_INDEXES', "true").lower() == "true"
+WRITE_BATCH_SIZE = int(os.getenv('WRITE_BATCH_SIZE', "100"))
+WRITE_FLUSH_INTERVAL = float(os.getenv('WRITE_FLUSH_INTERVAL', "5"))
+# Web scraps are stored compressed with zlib at WEB_SCRAP_COMPRESSION_LEVEL, "none" stores them as strings.
+# Both forms are read, the "compress" run mode compresses web scraps stored as strings
+WEB_SCRAP_COMPRESSION = os.getenv('WEB_SCRAP_COMPRESSION', "zlib")
+WEB_SCRAP_COMPRESSION_LEVEL = int(os.getenv('WEB_SCRAP_COMPRESSION_LEVEL', "6"))
+# Claiming lets several nodes share one collection: each node claims articles in batches of CLAIM_BATCH_SIZE with a
+# lease of LEASE_DURATION seconds, so articles are only processed by one node. Leases of stopped nodes expire.
+CLAIM_ARTICLES = os.getenv('CLAIM_ARTICLES', "false").lower() == "true"
+CLAIM_BATCH_SIZE = int(os.getenv('CLAIM_BATCH_SIZE', "100"))
+LEASE_DURATION = float(os.getenv('LEASE_DURATION', "1800"))
+NODE_ID = os.getenv('NODE_ID') or "{}-{}".format(socket.gethostname(), os.getpid())
+
+# Run mode. "scrap" fetches articles, "reprocess" extracts clean text from stored web scraps and only fetches
+# articles without one, "daemon" keeps running and scraps new articles as they are inserted, "compress" compresses
+# stored web scraps once and exits
+RUN_MODE = os.getenv('RUN_MODE', "scrap")
+# Daemon mode polls every POLL_INTERVAL seconds for articles inserted after the high-water mark, the highest
+# WATERMARK_FIELD value already processed. The mark is saved in STATE_COLLECTION so restarts continue from it. Every
+# FULL_SWEEP_INTERVAL seconds all articles that require web scraping are read, which retries failed articles.
+# WATERMARK_FIELD must be set to a field the article inserter writes that increases with insertion (an insertion date,
+# or _id when ids are ObjectIds). This service does not write it, and _id does not work with the random UUID ids of
+# articles, so daemon mode stops on startup when no article has the field or its values are UUIDs.
+POLL_INTERVAL = float(os.getenv('POLL_INTERVAL', "2"))
+FULL_SWEEP_INTERVAL = float(os.getenv('FULL_SWEEP_INTERVAL', "3600"))
+WATERMARK_FIELD = os.getenv('WATERMARK_FIELD', "inserted_at")
+STATE_COLLECTION = os.getenv('STATE_COLLECTION', "scraperState")
 
 # Threading Variables
 THREADS_PER_CORE = int(os.getenv('THREADS_PER_CORE', "3"))
+# Fetch mode for worker processes. "thread" blocks a thread per request, "async" fetches on an event loop
+FETCH_MODE = os.getenv('FETCH_MODE', "thread")
+ASYNC_CONCURRENCY = int(os.getenv('ASYNC_CONCURRENCY', "200"))
+# In-flight articles per worker process
+WORKER_CONCURRENCY = ASYNC_CONCURRENCY if FETCH_MODE == "async" else THREADS_PER_CORE
+# When ADAPTIVE_CONCURRENCY is set, the in-flight articles of each worker start at WORKER_CONCURRENCY and are adjusted
+# every CONCURRENCY_INTERVAL seconds between CONCURRENCY_MIN and CONCURRENCY_MAX. The limit is decreased when the fetch
+# latency exceeds CONCURRENCY_LATENCY_FACTOR times its lowest value, when the share of failed hosts exceeds
+# CONCURRENCY_MAX_ERROR_RATE or when the cpu use of the worker exceeds CONCURRENCY_MAX_CPU, and increased otherwise
+# while all its slots are used
+ADAPTIVE_CONCURRENCY = os.getenv('ADAPTIVE_CONCURRENCY', "true").lower() == "true"
+CONCURRENCY_MIN = int(os.getenv('CONCURRENCY_MIN', "1"))
+CONCURRENCY_MAX = int(os.getenv('CONCURRENCY_MAX', str(ASYNC_CONCURRENCY if FETCH_MODE == "async" else 64)))
+CONCURRENCY_INTERVAL = float(os.getenv('CONCURRENCY_INTERVAL', "2"))
+CONCURRENCY_LATENCY_FACTOR = float(os.getenv('CONCURRENCY_LATENCY_FACTOR', "2"))
+CONCURRENCY_MAX_ERROR_RATE = float(os.getenv('CONCURRENCY_MAX_ERROR_RATE', "0.2"))
+CONCURRENCY_MAX_CPU = float(os.getenv('CONCURRENCY_MAX_CPU', "0.9"))
+# Extraction runs on its own threads in each worker process. Fetched pages wait in a queue of EXTRACT_QUEUE_SIZE
+EXTRACT_THREADS = int(os.getenv('EXTRACT_THREADS', "1"))
+EXTRACT_QUEUE_SIZE = int(os.getenv('EXTRACT_QUEUE_SIZE', "16"))
+STAGE_REPORT_INTERVAL = float(os.getenv('STAGE_REPORT_INTERVAL', "30"))
+# Engine extracting article text from pages: "lxml" (default, falls back to readability) or "readability"
+EXTRACTOR_ENGINE = os.getenv('EXTRACTOR_ENGINE', "lxml")
+# JSON file of site extraction rules added to the built in rules: {"host": {"content": selector, "remove": selector}}
+SITE_RULES_FILE = os.getenv('SITE_RULES_FILE', "")
+MAX_PENDING_ARTICLES = int(os.getenv('MAX_PENDING_ARTICLES', "1000"))
+# Articles and results are sent between processes in batches of at most TASK_BATCH_SIZE
+TASK_BATCH_SIZE = int(os.getenv('TASK_BATCH_SIZE', "32"))
+
+# Per host politeness
+HOST_MAX_CONCURRENCY = int(os.getenv('HOST_MAX_CONCURRENCY', "8"))
+# Articles read for one host that are waiting or in process, so one slow host cannot take all MAX_PENDING_ARTICLES.
+# Further articles of the host are set aside: they wait in the queue of their host with one of MAX_SET_ASIDE_ARTICLES
+# slots, and reading pauses while all of them are taken
+HOST_MAX_PENDING = int(os.getenv('HOST_MAX_PENDING', "100"))
+MAX_SET_ASIDE_ARTICLES = int(os.getenv('MAX_SET_ASIDE_ARTICLES', "1000"))
+HOST_MIN_INTERVAL = float(os.getenv('HOST_MIN_INTERVAL', "0"))
+HOST_MAX_INTERVAL = float(os.getenv('HOST_MAX_INTERVAL', "30"))
+HOST_LATENCY_FACTOR = float(os.getenv('HOST_LATENCY_FACTOR', "3"))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv('BREAKER_FAILURE_THRESHOLD', "5"))
+BREAKER_COOLDOWN = float(os.getenv('BREAKER_COOLDOWN', "120"))
 
 # Retry mechanism
 PROGRAM_TIMEOUT = float(os.getenv('PROGRAM_TIMEOUT', "10800"))
 
+# Profiling of worker processes: "cprofile" profiles every call, "sample" samples stacks every
+# PROFILE_SAMPLE_INTERVAL seconds with low overhead. Profiles and a report of the PROFILE_TOP hottest functions
+# are written to a directory of the run under PROFILE_DIR
+PROFILE_MODE = os.getenv('PROFILE_MODE', "")
+PROFILE_DIR = os.getenv('PROFILE_DIR', "profiles")
+PROFILE_SAMPLE_INTERVAL = float(os.getenv('PROFILE_SAMPLE_INTERVAL', "0.01"))
+PROFILE_TOP = int(os.getenv('PROFILE_TOP', "30"))
+
 # Logging
 LOG_FREQUENCY = int(os.getenv('LOG_FREQUENCY', "25"))
+# Articles whose fetch failed are fetched again after RETRY_BASE_DELAY seconds, doubled after each failure up to
+# RETRY_MAX_DELAY, and are no longer fetched after WEB_SCRAP_RETRIES retries. Responses with a status in
+# PERMANENT_FAILURE_STATUSES are not retried
 WEB_SCRAP_RETRIES = int(os.getenv('WEB_SCRAP_RETRIES', "3"))
+RETRY_BASE_DELAY = float(os.getenv('RETRY_BASE_DELAY', "300"))
+RETRY_MAX_DELAY = float(os.getenv('RETRY_MAX_DELAY', "86400"))
+PERMANENT_FAILURE_STATUSES = frozenset(int(status) for status in
+                                       os.getenv('PERMANENT_FAILURE_STATUSES', "404,410").split(",")
+                                       if status.strip())
+# Metrics of all processes are exported as Prometheus text on METRICS_PORT (0 disables) and as a JSON snapshot written
+# to METRICS_SNAPSHOT_FILE every METRICS_INTERVAL seconds. Workers send their metrics every METRICS_INTERVAL seconds
+METRICS_PORT = int(os.getenv('METRICS_PORT', "0"))
+METRICS_SNAPSHOT_FILE = os.getenv('METRICS_SNAPSHOT_FILE', "")
+METRICS_INTERVAL = float(os.getenv('METRICS_INTERVAL', "10"))
 LOGGER_FORMAT = "%(asctime)s %(levelname)s P%(process)d [%(name)s]: %(message)s"
 
 # Request 
 REQUEST_TIMEOUT = int(os.getenv('REQUEST_TIMEOUT', "60"))
+REQUEST_CONNECT_TIMEOUT = float(os.getenv('REQUEST_CONNECT_TIMEOUT', str(REQUEST_TIMEOUT)))
+REQUEST_READ_TIMEOUT = float(os.getenv('REQUEST_READ_TIMEOUT', str(REQUEST_TIMEOUT)))
+# Pages are downloaded as a stream and cut off after MAX_DOWNLOAD_BYTES. Responses of content types not listed in
+# ALLOWED_CONTENT_TYPES are skipped from their headers, responses without a content type are downloaded
+MAX_DOWNLOAD_BYTES = int(os.getenv('MAX_DOWNLOAD_BYTES', str(5 * 2 ** 20)))
+ALLOWED_CONTENT_TYPES = frozenset(contentType.strip().lower() for contentType in
+                                  os.getenv('ALLOWED_CONTENT_TYPES', "text/html,application/xhtml+xml").split(",")
+                                  if contentType.strip())
+# Re-scraped articles are requested with the ETag and Last-Modified of their stored page, and are left as they are
+# when their page is not modified or its content hash is unchanged
+CONDITIONAL_REQUESTS = os.getenv('CONDITIONAL_REQUESTS', "true").lower() == "true"
+# Optional on-disk cache of responses shared by the worker processes, evicted least recently used past
+# RESPONSE_CACHE_MAX_BYTES. Entries younger than RESPONSE_CACHE_TTL seconds are used without a request, older entries
+# are revalidated. An empty RESPONSE_CACHE_DIR disables the cache
+RESPONSE_CACHE_DIR = os.getenv('RESPONSE_CACHE_DIR', "")
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv('RESPONSE_CACHE_MAX_BYTES', str(2 ** 30)))
+RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', "0"))
+# Articles whose links are the same once canonicalized are fetched once per run, and the result is written to all of
+# them. TRACKING_PARAMETERS are removed from links when they are canonicalized, a trailing * matches any parameter
+# starting with the prefix
+DEDUP_URLS = os.getenv('DEDUP_URLS', "true").lower() == "true"
+TRACKING_PARAMETERS = tuple(parameter.strip().lower() for parameter in
+                            os.getenv('TRACKING_PARAMETERS', "utm_*,fbclid,gclid").split(",")
+                            if parameter.strip())
+HTTP_POOL_CONNECTIONS = int(os.getenv('HTTP_POOL_CONNECTIONS', "50"))
+HTTP_POOL_MAXSIZE = int(os.getenv('HTTP_POOL_MAXSIZE', "10"))
+# Per host pool sizes in the format "host=size,host=size"
+HTTP_HOST_POOL_SIZES = os.getenv('HTTP_HOST_POOL_SIZES', "")
+DNS_CACHE_TTL = float(os.getenv('DNS_CACHE_TTL', "300"))
@@ -0,0 +1,232 @@
+import threading
+import time
+from collections import deque
+from logging import Logger
+from urllib.parse import urlsplit
+
+import reactivex as rx
+from reactivex.disposable import Disposable
+
+from src.circuit_breaker import CircuitBreaker
+from src.scrap_result import ScrapResult, CIRCUIT_OPEN
+from src.config import HOST_MAX_CONCURRENCY, HOST_MIN_INTERVAL, HOST_MAX_INTERVAL, HOST_LATENCY_FACTOR, \
+    HOST_MAX_PENDING
+
+# Smoothing factor of the per host latency average
+LATENCY_SMOOTHING = 0.2
+
+
+def hostOf(url):
+    """
+    :return: lower case host name of a url
+    """
+    try:
+        return (urlsplit(url).hostname or "").lower()
+    except ValueError:
+        return ""
+
+
+def isThrottled(result):
+    """
+    Checks if a result indicates that the host is overloaded or throttling requests
+    """
+    if result is None:
+        return False
+    if result.status is not None:
+        return result.status == 429 or result.status >= 500
+    return result.error is not None and "Timeout" in result.error
+
+
+def _outcome(future):
+    """
+    :return: tuple of result and error of a completed future
+    """
+    error = future.exception()
+    return (None, error) if error is not None else (future.result(), None)
+
+
+class HostState:
+    """
+    Scheduling state of a single host
+    """
+
+    def __init__(self, maxConcurrency, minInterval):
+        self.queue = deque()
+        self.inFlight = 0
+        self.limit = float(maxConcurrency)
+        self.interval = minInterval
+        self.nextStart = 0.0
+        self.latency = None
+        self.baselineLatency = None
+        self.timerPending = False
+
+
+class DomainScheduler:
+    """
+    Groups articles by host and limits the concurrency and request rate per host so one host cannot take over
+    the processor. Hosts that respond with 429/5xx, time out or become slower are slowed down automatically
+    and sped up again as they recover. Articles read for a host are counted until processed, so readers can set aside
+    articles of hosts with {maxPending} pending articles instead of waiting for them, see reservePending.
+    """
+
+    def __init__(self, submit, logger: Logger, scheduler, maxConcurrency=HOST_MAX_CONCURRENCY,
+                 minInterval=HOST_MIN_INTERVAL, maxInterval=HOST_MAX_INTERVAL, latencyFactor=HOST_LATENCY_FACTOR,
+                 circuitBreaker: CircuitBreaker = None, maxPending=HOST_MAX_PENDING):
+        """
+        :param submit: function that submits an article for processing and returns a Future of its ScrapResult
+        :param scheduler: scheduler that runs submit
+        :param circuitBreaker: articles of hosts with an open circuit are skipped without being submitted
+        :param maxPending: articles of one host that can be pending at the same time
+        """
+        self.submit = submit
+        self.logger = logger
+        self.scheduler = scheduler
+        self.circuitBreaker = circuitBreaker or CircuitBreaker(logger)
+        self.maxConcurrency = maxConcurrency
+        self.minInterval = minInterval
+        self.maxInterval = maxInterval
+        self.latencyFactor = latencyFactor
+        self.maxPending = maxPending
+        self._hosts = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def reservePending(self, article):
+        """
+        Counts an article as pending for its host until releasePending, unless its host has {maxPending} pending
+        articles
+        :return: if the article was counted
+        """
+        host = hostOf(article.articleUrl)
+        with self._lock:
+            pending = self._pending.get(host, 0)
+            if pending >= self.maxPending:
+                return False
+            self._pending[host] = pending + 1
+            return True
+
+    def releasePending(self, article):
+        """
+        Stops counting a processed article as pending for its host, see reservePending
+        """
+        host = hostOf(article.articleUrl)
+        with self._lock:
+            pending = self._pending.get(host, 0) - 1
+            if pending > 0:
+                self._pending[host] = pending
+            else:
+                self._pending.pop(host, None)
+
+    def schedule(self, article):
+        """
+        Queues an article for its host
+        :return: Observable that emits the ScrapResult of the article once processed
+        """
+        def subscribe(observer, scheduler=None):
+            host = hostOf(article.articleUrl)
+            with self._lock:
+                state = self._hosts.get(host)
+                if state is None:
+                    state = self._hosts[host] = HostState(self.maxConcurrency, self.minInterval)
+                state.queue.append((article, observer))
+            self._dispatch(host)
+            return Disposable()
+
+        return rx.create(subscribe)
+
+    def _dispatch(self, host):
+        """
+        Starts queued articles of a host while its concurrency and rate limits allow.
+        Articles of a host with an open circuit are skipped.
+        """
+        toStart = []
+        toSkip = []
+        delay = None
+        with self._lock:
+            state = self._hosts[host]
+            while state.queue and state.inFlight < int(state.limit):
+                now = time.monotonic()
+                if now < state.nextStart:
+                    if not state.timerPending:
+                        state.timerPending = True
+                        delay = state.nextStart - now
+                    break
+                if not self.circuitBreaker.allowRequest(host):
+                    toSkip.append(state.queue.popleft())
+                    continue
+                state.inFlight += 1
+                state.nextStart = now + state.interval
+                toStart.append(state.queue.popleft())
+
+        for article, observer in toSkip:
+            self.logger.debug("Skipped %s, circuit is open", article.articleUrl)
+            observer.on_next(ScrapResult(error=CIRCUIT_OPEN))
+            observer.on_completed()
+        for article, observer in toStart:
+            self.scheduler.schedule(lambda s, st, article=article, observer=observer: self._run(host, article, observer))
+        if delay is not None:
+            self.scheduler.schedule_relative(delay, lambda s, st: self._timerDispatch(host))
+
+    def _timerDispatch(self, host):
+        with self._lock:
+            self._hosts[host].timerPending = False
+        self._dispatch(host)
+
+    def _run(self, host, article, observer):
+        try:
+            future = self.submit(article)
+        except Exception as e:
+            self._complete(host, observer, None, e)
+            return
+        # No thread waits while the article is processed
+        future.add_done_callback(lambda f: self._complete(host, observer, *_outcome(f)))
+
+    def _complete(self, host, observer, result, error):
+        try:
+            self._feedback(host, result)
+        except Exception as e:
+            self.logger.error("Failed to update limits of %s", host, exc_info=e)
+        self._dispatch(host)
+
+        if error is not None:
+            observer.on_error(error)
+        else:
+            observer.on_next(result)
+            observer.on_completed()
+
+    def _feedback(self, host, result):
+        """
+        Adjusts the limits of a host from the result of one of its articles.
+        Throttled hosts halve their concurrency and double their request interval.
+        Healthy hosts increase their concurrency by one per window of requests and reduce their interval.
+        """
+        with self._lock:
+            state = self._hosts[host]
+            state.inFlight -= 1
+            self.circuitBreaker.recordResult(host, result)
+
+            if isThrottled(result):
+                self._slowDown(host, state, "status {}".format(result.status) if result.status else result.error)
+                return
+
+            if result is None or result.error is not None:
+                return
+
+            state.latency = result.elapsed if state.latency is None else \
+                LATENCY_SMOOTHING * result.elapsed + (1 - LATENCY_SMOOTHING) * state.latency
+            if state.baselineLatency is None or state.latency < state.baselineLatency:
+                state.baselineLatency = state.latency
+
+            if state.latency > self.latencyFactor * state.baselineLatency:
+                self._slowDown(host, state, "latency {:.2f}s".format(state.latency))
+                # Latency stays high while the host is slow, so only react once per increase
+                state.baselineLatency = state.latency / self.latencyFactor
+            else:
+                state.limit = min(self.maxConcurrency, state.limit + 1 / state.limit)
+                state.interval = state.interval / 2 if state.interval / 2 > self.minInterval + 0.01 else self.minInterval
+
+    def _slowDown(self, host, state, reason):
+        state.limit = max(1.0, state.limit / 2)
+        state.interval = min(self.maxInterval, max(state.interval * 2, 0.5))
+        self.logger.info("Slowing down %s (%s): concurrency %s, interval %.1fs",
+                         host, reason, int(state.limit), state.interval)
@@ -3,4 +3,23 @@ from typing import Optional
 
 class DisposedException(Exception):
     def __init__(self, msg: Optional[str] = None):
-        super().__init__(msg or "Attempted to use object that was already Disposed")
\ No newline at end of file
+        super().__init__(msg or "Attempted to use object that was already Disposed")
+
+class WebScrapException(Exception):
+    def __init__(self, url: str, status_code: Optional[int] = None, msg: Optional[str] = None):
+        super().__init__(msg or "Web scrapping failed (status " + str(status_code) + "):" + url)
+        self.url = url
+        self.status_code = status_code
+
+
+class SkippedContentException(WebScrapException):
+    def __init__(self, url: str, content_type: str):
+        super().__init__(url, 200, "Web scrapping skipped (content type " + content_type + "):" + url)
+        self.content_type = content_type
+
+
+class WatermarkFieldException(Exception):
+    def __init__(self, field: str, reason: str):
+        super().__init__("WATERMARK_FIELD " + field + " cannot find new articles (" + reason + "), set it to an "
+                         "article field that increases with insertion")
+        self.field = field
@@ -0,0 +1,239 @@
+import re
+import threading
+from abc import ABC, abstractmethod
+
+import lxml.html
+from lxml import etree
+from lxml.etree import ParserError
+from bs4 import BeautifulSoup
+from readability import Document
+
+from src.config import EXTRACTOR_ENGINE
+from src.site_rules import SiteRules, getSiteRules
+
+# Elements that never contain article text
+NOISE_XPATH = (".//script | .//style | .//noscript | .//template | .//iframe | .//svg | .//canvas | .//form"
+               " | .//button | .//select | .//textarea | .//nav | .//aside | .//footer"
+               " | .//header[not(ancestor::article) and not(ancestor::main)]")
+# Containers whose class or id marks them as page furniture
+BOILERPLATE_PATTERN = (r"(^|[\s_-])(comments?|sidebar|share|sharing|social|related|advert|ads?|promo|newsletter"
+                       r"|subscribe|cookie|banner|menu|breadcrumbs?|popup|modal|widget|sponsored)([\s_-]|$)")
+BOILERPLATE_XPATH = (".//*[not(self::html) and not(self::body)]"
+                     "[re:test(@class, $pattern, 'i') or re:test(@id, $pattern, 'i')]")
+REGEXP_NS = {"re": "http://exslt.org/regular-expressions"}
+# Elements whose text counts towards the score of their container
+PARAGRAPH_XPATH = ".//p | .//pre | .//blockquote"
+# Elements that start a new line of text
+BLOCK_TAGS = ("p", "div", "section", "article", "main", "br", "li", "ul", "ol", "pre", "blockquote", "table", "tr",
+              "h1", "h2", "h3", "h4", "h5", "h6", "figcaption", "dd", "dt")
+# Marks block boundaries while rendering text, a private use character that does not occur in article text
+BLOCK_BREAK = "\ue000"
+WHITESPACE = re.compile(r"\s+")
+# Pages with less scored paragraph text than this are handed to the fallback engine
+MIN_CONTENT_LENGTH = 140
+
+
+class Extractor(ABC):
+    """
+    Extracts the main text of an article from its html page
+    """
+    name = None
+
+    @abstractmethod
+    def extract(self, htmlContent, url=None, encoding=None):
+        """
+        :param htmlContent: html page of the article, as text or as bytes in {encoding}
+        :param url: url of the article, used to find the extraction rule of its site
+        :param encoding: codec name of the page when it is given as bytes
+        :return: text of the article with one block per line
+        """
+
+
+class ReadabilityExtractor(Extractor):
+    """
+    Finds the article with readability, then renders its html to text with BeautifulSoup
+    """
+    name = "readability"
+
+    def extract(self, htmlContent, url=None, encoding=None):
+        # Readability guesses the encoding of bytes from their content, so they are decoded with the known encoding
+        doc = Document(decodeContent(htmlContent, encoding))
+        html = doc.summary()  # returns main article html
+        soup = BeautifulSoup(html, "html.parser")
+        return soup.get_text(separator="\n", strip=True)
+
+
+class LxmlExtractor(Extractor):
+    """
+    Parses the page once with lxml, removes page furniture and renders the text of the article container.
+    The container is found by the rule of the site when it has one, otherwise it is the container with the most
+    paragraph text. Pages where no container is found are extracted by the fallback engine.
+    """
+    name = "lxml"
+
+    def __init__(self, fallback: Extractor = None, siteRules: SiteRules = None):
+        self.fallback = fallback or ReadabilityExtractor()
+        self.siteRules = siteRules or getSiteRules()
+        self._findNoise = etree.XPath(NOISE_XPATH)
+        self._findBoilerplate = etree.XPath(BOILERPLATE_XPATH, namespaces=REGEXP_NS)
+        self._findParagraphs = etree.XPath(PARAGRAPH_XPATH)
+        self._text = etree.XPath("string()")
+
+    def extract(self, htmlContent, url=None, encoding=None):
+        root = parseHtml(htmlContent, encoding)
+        if root is None:
+            return ""
+
+        if url is not None:
+            # Pages of sites with a rule only clean and render the containers selected by the rule
+            host, rule = self.siteRules.find(url)
+            text = "\n".join(self._render(container) for container in rule.findContent(root)) if rule else ""
+            if text:
+                self.siteRules.recordHit(host)
+                return text
+            self.siteRules.recordMiss(host)
+
+        self._removeBoilerplate(root)
+        container = self._findContainer(root)
+        if container is None:
+            return self.fallback.extract(decodeContent(htmlContent, encoding))
+        return renderText(container)
+
+    def _removeBoilerplate(self, element):
+        for child in self._findNoise(element) + self._findBoilerplate(element, pattern=BOILERPLATE_PATTERN):
+            _drop(child)
+
+    def _render(self, container):
+        self._removeBoilerplate(container)
+        return renderText(container)
+
+    def _findContainer(self, root):
+        """
+        Scores containers by the text of their paragraphs, like readability, with a single pass over the paragraphs
+        :return: container with the highest score (or null if the page has too little paragraph text)
+        """
+        scores = {}
+        total = 0
+        for paragraph in self._findParagraphs(root):
+            text = self._text(paragraph).strip()
+            if len(text) < 25:
+                continue
+            total += len(text)
+            score = 1 + text.count(",") + min(len(text) // 100, 3)
+            parent = paragraph.getparent()
+            if parent is None:
+                continue
+            scores[parent] = scores.get(parent, 0) + score
+            grandParent = parent.getparent()
+            if grandParent is not None:
+                scores[grandParent] = scores.get(grandParent, 0) + score / 2
+
+        if total < MIN_CONTENT_LENGTH or not scores:
+            return None
+
+        best = None
+        bestScore = 0
+        for element, score in scores.items():
+            textLength = len(self._text(element)) or 1
+            linkLength = sum(len(self._text(link)) for link in element.iter("a"))
+            # Containers made of links (menus, lists of related articles) lose their score
+            score *= 1 - min(1.0, linkLength / textLength)
+            if score > bestScore:
+                best, bestScore = element, score
+        return best
+
+
+def parseHtml(htmlContent, encoding=None):
+    """
+    Parses an html page with lxml. Pages given as bytes are parsed from their bytes in {encoding}, without decoding
+    them to text first.
+    :return: root element of the page (or null if the page is empty)
+    """
+    if not htmlContent or not htmlContent.strip():
+        return None
+    if isinstance(htmlContent, bytes):
+        try:
+            return lxml.html.document_fromstring(htmlContent, parser=_bytesParser(encoding or "utf-8"))
+        except LookupError:
+            # Encoding known to python but not to libxml2
+            htmlContent = decodeContent(htmlContent, encoding)
+        except ParserError:
+            return None
+    try:
+        return lxml.html.document_fromstring(htmlContent)
+    except ValueError:
+        # Unicode strings with an xml encoding declaration must be parsed as bytes
+        return lxml.html.document_fromstring(htmlContent.encode("utf-8"))
+    except ParserError:
+        return None
+
+
+def decodeContent(htmlContent, encoding):
+    """
+    :return: text of a page given as text or as bytes in {encoding}
+    """
+    if isinstance(htmlContent, bytes):
+        return htmlContent.decode(encoding or "utf-8", errors="replace")
+    return htmlContent
+
+
+def _bytesParser(encoding):
+    """
+    Gets the html parser of an encoding for the current thread, lxml parsers cannot be used by several threads at once
+    """
+    parsers = getattr(_local, "parsers", None)
+    if parsers is None:
+        parsers = _local.parsers = {}
+    parser = parsers.get(encoding)
+    if parser is None:
+        # libxml2 names encodings with hyphens where python codec names have underscores
+        parser = parsers[encoding] = lxml.html.HTMLParser(encoding=encoding.replace("_", "-"))
+    return parser
+
+
+def renderText(element):
+    """
+    Renders the text of an element with one block per line and without blank lines.
+    Whitespace inside a block is collapsed, so line breaks of the html source do not split lines.
+    """
+    for block in element.iter(BLOCK_TAGS):
+        block.tail = BLOCK_BREAK + block.tail if block.tail else BLOCK_BREAK
+        block.text = BLOCK_BREAK + block.text if block.text else BLOCK_BREAK
+    lines = (WHITESPACE.sub(" ", line).strip() for line in element.xpath("string()").split(BLOCK_BREAK))
+    return "\n".join(line for line in lines if line)
+
+
+def _drop(element):
+    # Keeps the tail text, which belongs to the parent
+    if element.getparent() is not None:
+        element.drop_tree()
+
+
+EXTRACTORS = {
+    LxmlExtractor.name: LxmlExtractor,
+    ReadabilityExtractor.name: ReadabilityExtractor,
+}
+
+
+_local = threading.local()
+
+
+def createExtractor(name=EXTRACTOR_ENGINE):
+    """
+    Creates the extractor of an engine
+    :param name: name of the engine, one of {EXTRACTORS}
+    """
+    if name not in EXTRACTORS:
+        raise ValueError("Unknown extractor engine '{}', expected one of {}".format(name, ", ".join(EXTRACTORS)))
+    return EXTRACTORS[name]()
+
+
+def getExtractor():
+    """
+    Gets the extractor of {EXTRACTOR_ENGINE} for the current thread, compiled xpath expressions are not shared
+    between threads
+    """
+    extractor = getattr(_local, "extractor", None)
+    if extractor is None:
+        extractor = _local.extractor = createExtractor()
+    return extractor
@@ -0,0 +1,229 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from src.config import RESPONSE_CACHE_DIR, RESPONSE_CACHE_MAX_BYTES, RESPONSE_CACHE_TTL
+
+# Outcomes of revalidating the stored page of an article
+NOT_MODIFIED = "not_modified"
+UNCHANGED = "unchanged"
+CHANGED = "changed"
+# Outcomes of looking up a response in the cache: used without a request, used after a 304 response, or not cached
+CACHE_HIT = "hit"
+CACHE_REVALIDATED = "revalidated"
+CACHE_MISS = "miss"
+
+# Suffix of entries being written, renamed into place once complete
+TEMP_SUFFIX = ".tmp"
+# Entries are evicted down to this fraction of the maximum size, so eviction does not run on every write
+EVICT_TARGET = 0.9
+
+
+def contentHash(body):
+    """
+    :param body: bytes of a page
+    :return: hex digest identifying the content of the page
+    """
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+class Validators:
+    """
+    Validators of a stored page: its ETag and Last-Modified headers, and the hash of its content
+    """
+    __slots__ = ("etag", "lastModified", "contentHash")
+
+    def __init__(self, etag=None, lastModified=None, contentHash=None):
+        self.etag = etag
+        self.lastModified = lastModified
+        self.contentHash = contentHash
+
+    @classmethod
+    def fromResponse(cls, headers, body):
+        """
+        :param headers: headers of the response of the page
+        :param body: bytes of the page
+        """
+        return cls(headers.get("ETag"), headers.get("Last-Modified"), contentHash(body))
+
+    @classmethod
+    def fromDocument(cls, document):
+        """
+        :return: validators stored in the document of an article (or null if there are none)
+        """
+        if not document:
+            return None
+        return cls(document.get("etag"), document.get("last_modified"), document.get("hash"))
+
+    def toDocument(self):
+        return {"etag": self.etag, "last_modified": self.lastModified, "hash": self.contentHash}
+
+    def conditionalHeaders(self):
+        """
+        :return: headers that make a request conditional on the page being modified (empty if there are no validators)
+        """
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.lastModified:
+            headers["If-Modified-Since"] = self.lastModified
+        return headers
+
+    def __eq__(self, other):
+        return (isinstance(other, Validators) and self.etag == other.etag
+                and self.lastModified == other.lastModified and self.contentHash == other.contentHash)
+
+    def __repr__(self):
+        return "Validators(etag={!r}, lastModified={!r}, contentHash={!r})".format(
+            self.etag, self.lastModified, self.contentHash)
+
+
+class CachedResponse:
+    """
+    Response of a page read from the response cache
+    """
+    __slots__ = ("body", "charset", "validators", "storedAt")
+
+    def __init__(self, body, charset, validators: Validators, storedAt):
+        self.body = body
+        self.charset = charset  # charset of the content type header (or null if it had none)
+        self.validators = validators
+        self.storedAt = storedAt  # epoch time the response was received
+
+    def isFresh(self, ttl, now=None):
+        """
+        :return: if the response can be used without revalidating it
+        """
+        return ttl > 0 and (now if now is not None else time.time()) - self.storedAt < ttl
+
+
+class ResponseCache:
+    """
+    On-disk cache of page responses, shared by the processes using the same directory.
+    Each entry is a file named by the hash of its url, holding a JSON header line followed by the body of the page.
+    Reading an entry touches its file, and the least recently used entries are evicted once the entries exceed
+    {maxBytes}. Each process adds the bytes it writes to the size found by its last scan of the directory, and scans it
+    again to evict entries when the sum passes {maxBytes}, so the writes of other processes in between can exceed it.
+    """
+
+    def __init__(self, directory, maxBytes=RESPONSE_CACHE_MAX_BYTES, ttl=RESPONSE_CACHE_TTL):
+        """
+        :param ttl: seconds a response is used without revalidating it, 0 always revalidates
+        """
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._size = sum(size for path, size, used in self._entries())
+
+    def _path(self, url):
+        return os.path.join(self.directory, hashlib.sha256(url.encode()).hexdigest())
+
+    def _entries(self):
+        """
+        :return: list of (path, size, last use) of the entries
+        """
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(TEMP_SUFFIX):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                # Evicted by another process
+                continue
+            entries.append((entry.path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def get(self, url):
+        """
+        :return: cached response of the url (or null if it is not cached)
+        """
+        path = self._path(url)
+        try:
+            with open(path, "rb") as file:
+                header = json.loads(file.readline())
+                body = file.read()
+            os.utime(path)
+        except (FileNotFoundError, ValueError):
+            return None
+        if header.get("url") != url:
+            return None
+        return CachedResponse(body, header.get("charset"),
+                              Validators(header.get("etag"), header.get("last_modified"), contentHash(body)),
+                              header.get("stored_at", 0))
+
+    def put(self, url, body, charset, validators: Validators):
+        """
+        Caches the response of a url, replacing its previous response
+        :param charset: charset of the content type header (or null if it has none)
+        """
+        header = json.dumps({"url": url, "charset": charset, "etag": validators.etag,
+                             "last_modified": validators.lastModified, "stored_at": time.time()}).encode()
+        path = self._path(url)
+        tempPath = "{}.{}.{}{}".format(path, os.getpid(), threading.get_ident(), TEMP_SUFFIX)
+        with open(tempPath, "wb") as file:
+            file.write(header + b"\n")
+            file.write(body)
+        try:
+            replaced = os.path.getsize(path)
+        except FileNotFoundError:
+            replaced = 0
+        os.replace(tempPath, path)
+        with self._lock:
+            self._size += len(header) + 1 + len(body) - replaced
+            evict = self._size > self.maxBytes
+        if evict:
+            self.evict()
+
+    def refresh(self, url, cached: CachedResponse):
+        """
+        Restarts the time to live of a cached response that was revalidated
+        """
+        if self.ttl > 0:
+            self.put(url, cached.body, cached.charset, cached.validators)
+
+    def evict(self):
+        """
+        Deletes the least recently used entries until they fit in {EVICT_TARGET} of {maxBytes}
+        :return: number of entries deleted
+        """
+        with self._lock:
+            entries = sorted(self._entries(), key=lambda entry: entry[2])
+            size = sum(entrySize for path, entrySize, used in entries)
+            deleted = 0
+            for path, entrySize, used in entries:
+                if size <= self.maxBytes * EVICT_TARGET:
+                    break
+                try:
+                    os.remove(path)
+                    deleted += 1
+                except FileNotFoundError:
+                    pass
+                size -= entrySize
+            self._size = size
+            return deleted
+
+
+_cache = None
+_cachePid = None
+_cacheLock = threading.Lock()
+
+
+def getResponseCache():
+    """
+    Gets the response cache of the current process
+    :return: the response cache (or null if {RESPONSE_CACHE_DIR} is not set)
+    """
+    global _cache, _cachePid
+    if not RESPONSE_CACHE_DIR:
+        return None
+    if _cache is None or _cachePid != os.getpid():
+        with _cacheLock:
+            if _cache is None or _cachePid != os.getpid():
+                _cache = ResponseCache(RESPONSE_CACHE_DIR)
+                _cachePid = os.getpid()
+    return _cache
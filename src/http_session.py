@@ -0,0 +1,179 @@
+import os
+import socket
+import threading
+import time
+from logging import Logger
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+
+from src.config import HTTP_POOL_CONNECTIONS, HTTP_POOL_MAXSIZE, HTTP_HOST_POOL_SIZES, DNS_CACHE_TTL
+
+
+class DnsCache:
+    """
+    Caches getaddrinfo results for {DNS_CACHE_TTL} seconds so repeated requests to a host skip DNS resolution
+    """
+
+    def __init__(self, ttl=DNS_CACHE_TTL, resolver=socket.getaddrinfo):
+        self.ttl = ttl
+        self.resolver = resolver
+        self._cache = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def getaddrinfo(self, host, port, family=0, type=0, proto=0, flags=0):
+        key = (host, port, family, type, proto, flags)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None and entry[0] > now:
+                self.hits += 1
+                return entry[1]
+
+        result = self.resolver(host, port, family, type, proto, flags)
+        with self._lock:
+            self.misses += 1
+            self._cache[key] = (now + self.ttl, result)
+        return result
+
+
+_dnsCache = None
+_session = None
+_sessionPid = None
+_sessionLock = threading.Lock()
+_asyncConnectionStats = {}
+_asyncConnectionStatsLock = threading.Lock()
+
+
+def installDnsCache(ttl=DNS_CACHE_TTL):
+    """
+    Routes name resolution of this process through a TTL bound cache. Used by requests and aiohttp.
+    Should only be called in worker processes.
+    :return: the installed cache
+    """
+    global _dnsCache
+    if _dnsCache is None and ttl > 0:
+        _dnsCache = DnsCache(ttl)
+        socket.getaddrinfo = _dnsCache.getaddrinfo
+    return _dnsCache
+
+
+def parseHostPoolSizes(value):
+    """
+    Parses per host pool sizes in the format "host=size,host=size"
+    :return: dict of host to pool size
+    """
+    sizes = {}
+    for entry in (value or "").split(","):
+        if "=" not in entry:
+            continue
+        host, size = entry.split("=", 1)
+        sizes[host.strip().lower()] = int(size)
+    return sizes
+
+
+def createSession():
+    """
+    Creates a session with pooled keep-alive connections.
+    Hosts listed in {HTTP_HOST_POOL_SIZES} get their own pool size, other hosts use {HTTP_POOL_MAXSIZE}.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_CONNECTIONS, pool_maxsize=HTTP_POOL_MAXSIZE)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    for host, size in parseHostPoolSizes(HTTP_HOST_POOL_SIZES).items():
+        hostAdapter = HTTPAdapter(pool_connections=1, pool_maxsize=size)
+        session.mount("http://{}/".format(host), hostAdapter)
+        session.mount("https://{}/".format(host), hostAdapter)
+    return session
+
+
+def getSession():
+    """
+    Gets the pooled session shared by all threads of the current process
+    """
+    global _session, _sessionPid
+    # A session inherited from a parent process shares its sockets, so each process creates its own
+    if _session is None or _sessionPid != os.getpid():
+        with _sessionLock:
+            if _session is None or _sessionPid != os.getpid():
+                _session = createSession()
+                _sessionPid = os.getpid()
+    return _session
+
+
+def createAsyncConnector(concurrency):
+    """
+    Creates the aiohttp connector used in async fetch mode.
+    aiohttp keeps idle connections for all hosts in one pool of {concurrency} connections,
+    so per host pool sizes only apply to the requests session.
+    """
+    return aiohttp.TCPConnector(limit=concurrency, ttl_dns_cache=DNS_CACHE_TTL)
+
+
+def createAsyncTraceConfig():
+    """
+    Creates an aiohttp trace config that counts new and reused connections per host
+    """
+    async def onRequestStart(session, context, params):
+        context.host = params.url.host
+
+    async def onConnectionCreate(session, context, params):
+        _recordAsyncConnection(context.host, "new_connections")
+
+    async def onConnectionReuse(session, context, params):
+        _recordAsyncConnection(context.host, "reused")
+
+    traceConfig = aiohttp.TraceConfig()
+    traceConfig.on_request_start.append(onRequestStart)
+    traceConfig.on_connection_create_end.append(onConnectionCreate)
+    traceConfig.on_connection_reuseconn.append(onConnectionReuse)
+    return traceConfig
+
+
+def _recordAsyncConnection(host, counter):
+    with _asyncConnectionStatsLock:
+        stats = _asyncConnectionStats.setdefault(host, {"requests": 0, "new_connections": 0, "reused": 0})
+        stats["requests"] += 1
+        stats[counter] += 1
+
+
+def getConnectionStats():
+    """
+    Gets connection reuse counters per host for the current process
+    :return: dict of host to requests, new connections and reused connections
+    """
+    stats = {}
+    if _session is not None and _sessionPid == os.getpid():
+        adapters = {id(adapter): adapter for adapter in _session.adapters.values()}
+        for adapter in adapters.values():
+            for key in adapter.poolmanager.pools.keys():
+                pool = adapter.poolmanager.pools.get(key)
+                if pool is None:
+                    continue
+                hostStats = stats.setdefault(pool.host, {"requests": 0, "new_connections": 0, "reused": 0})
+                hostStats["requests"] += pool.num_requests
+                hostStats["new_connections"] += pool.num_connections
+                hostStats["reused"] += max(0, pool.num_requests - pool.num_connections)
+
+    with _asyncConnectionStatsLock:
+        for host, asyncStats in _asyncConnectionStats.items():
+            hostStats = stats.setdefault(host, {"requests": 0, "new_connections": 0, "reused": 0})
+            for counter, value in asyncStats.items():
+                hostStats[counter] += value
+    return stats
+
+
+def logConnectionStats(logger: Logger):
+    """
+    Logs connection reuse counters per host and dns cache hits for the current process
+    """
+    for host, stats in sorted(getConnectionStats().items()):
+        logger.info("Connections to %s: %s requests, %s new connections, %s reused",
+                    host, stats["requests"], stats["new_connections"], stats["reused"])
+    if _dnsCache is not None:
+        logger.info("DNS cache: %s hits, %s misses", _dnsCache.hits, _dnsCache.misses)
+
@@ -0,0 +1,327 @@
+import bisect
+import json
+import os
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from logging import Logger
+
+from src.config import METRICS_INTERVAL, METRICS_PORT, METRICS_SNAPSHOT_FILE
+
+# Upper bounds in seconds of the latency histogram buckets, the last bucket counts everything above
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Stages of an article, labels of the stage latency histogram
+DB_READ = "db_read"
+QUEUE_WAIT = "queue_wait"
+FETCH = "fetch"
+EXTRACT = "extract"
+DB_WRITE = "db_write"
+STAGES = (DB_READ, QUEUE_WAIT, FETCH, EXTRACT, DB_WRITE)
+
+# Metric names
+STAGE_SECONDS = "stage_seconds"
+ARTICLES_READ = "articles_read_total"
+ARTICLES_COMPLETED = "articles_completed_total"
+ARTICLES_WRITTEN = "articles_written_total"
+HTTP_RESPONSES = "http_responses_total"
+DOWNLOADED_BYTES = "downloaded_bytes_total"
+LIMITED_DOWNLOADS = "limited_downloads_total"
+REVALIDATIONS = "revalidations_total"
+RESPONSE_CACHE = "response_cache_total"
+FETCH_FAILURES = "fetch_failures_total"
+DUPLICATE_ARTICLES = "duplicate_articles_total"
+EXTRACTIONS = "extractions_total"
+
+# Type, help and label name of each metric
+METRICS = {
+    STAGE_SECONDS: ("histogram", "Time spent by articles in each stage", "stage"),
+    ARTICLES_READ: ("counter", "Articles read from the db", None),
+    ARTICLES_COMPLETED: ("counter", "Articles that completed processing", None),
+    ARTICLES_WRITTEN: ("counter", "Article updates written to the db", None),
+    HTTP_RESPONSES: ("counter", "Article requests by status class (error when no response was received)", "class"),
+    DOWNLOADED_BYTES: ("counter", "Bytes of article pages downloaded", None),
+    LIMITED_DOWNLOADS: ("counter", "Pages skipped by content type or truncated at the maximum size", "outcome"),
+    REVALIDATIONS: ("counter", "Stored pages of articles scraped again that were not modified, unchanged or changed",
+                    "outcome"),
+    RESPONSE_CACHE: ("counter", "Requests served by the response cache, revalidated from it or missing from it",
+                     "outcome"),
+    FETCH_FAILURES: ("counter", "Failed fetches retried after a backoff, failed for good or out of retries", "outcome"),
+    DUPLICATE_ARTICLES: ("counter", "Articles with the url of another article, written with it or copied from it",
+                         "outcome"),
+    EXTRACTIONS: ("counter", "Pages extracted with article text or without any (no_text)", "outcome"),
+}
+PREFIX = "webscrap_"
+
+
+def statusClass(status):
+    """
+    :return: class of an http status ("2xx", "4xx", ...) or "error" when no response was received
+    """
+    return "{}xx".format(status // 100) if status else "error"
+
+
+class _Shard:
+    """
+    Metrics recorded by one thread. Only the owning thread writes to a shard, so recording takes no lock.
+    """
+    __slots__ = ("counters", "histograms")
+
+    def __init__(self):
+        self.counters = {}
+        # (name, label) to bucket counts followed by the sum and count of observations
+        self.histograms = {}
+
+
+class Metrics:
+    """
+    Counters and latency histograms of a process.
+    Each thread records into its own shard, shards are only merged when a snapshot is taken.
+    Snapshots of other processes (worker processes) are merged into the snapshots of this process.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = []
+        self._shardsLock = threading.Lock()
+        self._remote = {}
+
+    def increment(self, name, value=1, label=None):
+        counters = self._shard().counters
+        key = (name, label)
+        counters[key] = counters.get(key, 0) + value
+
+    def observe(self, name, seconds, label=None):
+        histograms = self._shard().histograms
+        key = (name, label)
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = [0] * (len(LATENCY_BUCKETS) + 3)
+        histogram[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        histogram[-2] += seconds
+        histogram[-1] += 1
+
+    def updateRemote(self, source, snapshot):
+        """
+        Sets the latest snapshot of another process. Snapshots are cumulative, so only the latest one is kept.
+        """
+        with self._shardsLock:
+            self._remote[source] = snapshot
+
+    def snapshot(self, includeRemote=True):
+        """
+        Merges the shards of all threads, and the snapshots of other processes when {includeRemote}
+        :return: dict of "counters" and "histograms", each a dict of metric name to a dict of label to value.
+        Histogram values are dicts of bucket counts, sum and count.
+        """
+        with self._shardsLock:
+            shards = list(self._shards)
+            remote = list(self._remote.values()) if includeRemote else []
+
+        counters = {}
+        histograms = {}
+        for shard in shards:
+            # Copying a dict does not release the GIL, so the copy is consistent while the owner keeps recording
+            for (name, label), value in dict(shard.counters).items():
+                labels = counters.setdefault(name, {})
+                labels[label or ""] = labels.get(label or "", 0) + value
+            for (name, label), histogram in dict(shard.histograms).items():
+                _addHistogram(histograms.setdefault(name, {}), label or "", histogram[:-2], *histogram[-2:])
+        for snapshot in remote:
+            for name, labels in snapshot["counters"].items():
+                merged = counters.setdefault(name, {})
+                for label, value in labels.items():
+                    merged[label] = merged.get(label, 0) + value
+            for name, labels in snapshot["histograms"].items():
+                for label, histogram in labels.items():
+                    _addHistogram(histograms.setdefault(name, {}), label, histogram["buckets"], histogram["sum"],
+                                  histogram["count"])
+        return {"counters": counters, "histograms": histograms}
+
+    def _shard(self):
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = _Shard()
+            with self._shardsLock:
+                self._shards.append(shard)
+        return shard
+
+
+def _addHistogram(labels, label, buckets, total, count):
+    merged = labels.get(label)
+    if merged is None:
+        merged = labels[label] = {"buckets": [0] * len(buckets), "sum": 0.0, "count": 0}
+    merged["buckets"] = [a + b for a, b in zip(merged["buckets"], buckets)]
+    merged["sum"] += total
+    merged["count"] += count
+
+
+def quantile(histogram, fraction):
+    """
+    Estimates a quantile of a histogram by the upper bound of its bucket
+    :return: seconds (or null if the histogram has no observations or the quantile is above the last bucket)
+    """
+    if not histogram["count"]:
+        return None
+    rank = fraction * histogram["count"]
+    seen = 0
+    for bound, count in zip(LATENCY_BUCKETS, histogram["buckets"]):
+        seen += count
+        if seen >= rank:
+            return bound
+    return None
+
+
+def toPrometheus(snapshot):
+    """
+    Renders a snapshot in the Prometheus text exposition format
+    """
+    lines = []
+    for name, (kind, description, labelName) in METRICS.items():
+        values = snapshot[kind + "s"].get(name)
+        if not values:
+            continue
+        lines.append("# HELP {}{} {}".format(PREFIX, name, description))
+        lines.append("# TYPE {}{} {}".format(PREFIX, name, kind))
+        for label, value in sorted(values.items()):
+            labels = '{}="{}"'.format(labelName, label) if labelName and label else ""
+            if kind == "counter":
+                lines.append("{}{}{} {}".format(PREFIX, name, "{" + labels + "}" if labels else "", value))
+                continue
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), value["buckets"]):
+                cumulative += count
+                bucketLabels = ",".join(filter(None, [labels, 'le="{}"'.format(bound)]))
+                lines.append("{}{}_bucket{{{}}} {}".format(PREFIX, name, bucketLabels, cumulative))
+            suffix = "{" + labels + "}" if labels else ""
+            lines.append("{}{}_sum{} {}".format(PREFIX, name, suffix, value["sum"]))
+            lines.append("{}{}_count{} {}".format(PREFIX, name, suffix, value["count"]))
+    return "\n".join(lines) + "\n"
+
+
+def logSummary(logger: Logger, snapshot):
+    """
+    Logs the count, mean and estimated p95 of each stage, the http status classes, bytes downloaded and pages
+    skipped or truncated, and the outcomes of revalidations, of the response cache, of failed fetches and of
+    extractions
+    """
+    stages = snapshot["histograms"].get(STAGE_SECONDS, {})
+    for stage in STAGES:
+        histogram = stages.get(stage)
+        if not histogram or not histogram["count"]:
+            continue
+        p95 = quantile(histogram, 0.95)
+        logger.info("Stage %s: %s observations, mean %.1f ms, p95 %s", stage, histogram["count"],
+                    1000 * histogram["sum"] / histogram["count"],
+                    "<= {:g} ms".format(1000 * p95) if p95 is not None else "> {:g} s".format(LATENCY_BUCKETS[-1]))
+    responses = snapshot["counters"].get(HTTP_RESPONSES, {})
+    if responses:
+        downloaded = sum(snapshot["counters"].get(DOWNLOADED_BYTES, {}).values())
+        limited = snapshot["counters"].get(LIMITED_DOWNLOADS, {})
+        logger.info("HTTP responses: %s | %.1f MB downloaded%s",
+                    ", ".join("{} {}".format(label, count) for label, count in sorted(responses.items())),
+                    downloaded / 2 ** 20,
+                    "".join(" | {} {}".format(count, label) for label, count in sorted(limited.items())))
+    for name, title in ((REVALIDATIONS, "Revalidated pages"), (RESPONSE_CACHE, "Response cache"),
+                        (FETCH_FAILURES, "Failed fetches"), (DUPLICATE_ARTICLES, "Duplicate articles"),
+                        (EXTRACTIONS, "Extracted pages")):
+        counts = snapshot["counters"].get(name, {})
+        if counts:
+            logger.info("%s: %s", title, ", ".join("{} {}".format(label, count)
+                                                    for label, count in sorted(counts.items())))
+
+
+class MetricsExporter:
+    """
+    Exports the metrics of the process: as Prometheus text on http://<host>:{port}/metrics when {port} is set,
+    and as a JSON snapshot written to {snapshotFile} every {interval} seconds when it is set
+    """
+
+    def __init__(self, logger: Logger, metrics=None, port=METRICS_PORT, snapshotFile=METRICS_SNAPSHOT_FILE,
+                 interval=METRICS_INTERVAL, host="0.0.0.0"):
+        self.logger = logger
+        self.metrics = metrics or getMetrics()
+        self.snapshotFile = snapshotFile
+        self.interval = interval
+        self._stop = threading.Event()
+        self._server = None
+        self._snapshotThread = None
+        if port:
+            self._server = ThreadingHTTPServer((host, port), self._handlerClass())
+            self._server.daemon_threads = True
+            threading.Thread(target=self._server.serve_forever, daemon=True).start()
+            self.logger.info("Serving metrics on port %s", self._server.server_address[1])
+        if snapshotFile and interval > 0:
+            self._snapshotThread = threading.Thread(target=self._snapshotRun, daemon=True)
+            self._snapshotThread.start()
+
+    @property
+    def port(self):
+        return self._server.server_address[1] if self._server is not None else None
+
+    def writeSnapshot(self):
+        """
+        Writes a snapshot to {snapshotFile}, replacing the previous one at once so readers never see a partial file
+        """
+        if not self.snapshotFile:
+            return
+        temporaryFile = self.snapshotFile + ".tmp"
+        try:
+            with open(temporaryFile, "w") as file:
+                json.dump(self.metrics.snapshot(), file)
+            os.replace(temporaryFile, self.snapshotFile)
+        except Exception as e:
+            self.logger.error("Failed to write metrics snapshot to %s", self.snapshotFile, exc_info=e)
+
+    def close(self):
+        """
+        Stops exporting after writing a last snapshot
+        """
+        self._stop.set()
+        if self._snapshotThread is not None:
+            self._snapshotThread.join()
+        self.writeSnapshot()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def _snapshotRun(self):
+        while not self._stop.wait(self.interval):
+            self.writeSnapshot()
+
+    def _handlerClass(self):
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = toPrometheus(exporter.metrics.snapshot()).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+_metrics = None
+_metricsPid = None
+_metricsLock = threading.Lock()
+
+
+def getMetrics():
+    """
+    Gets the metrics of the current process. Forked processes start with their own empty metrics.
+    """
+    global _metrics, _metricsPid
+    if _metricsPid != os.getpid():
+        with _metricsLock:
+            if _metricsPid != os.getpid():
+                _metrics = Metrics()
+                _metricsPid = os.getpid()
+    return _metrics
@@ -1,11 +1,109 @@
+import logging
+import time
+from datetime import datetime, timedelta, timezone
 from logging import Logger
-from uuid import UUID
-import uuid
+from uuid import UUID, uuid4
 import reactivex as rx
 from reactivex import operators as ops
-from pymongo import MongoClient
+from pymongo import MongoClient, IndexModel, UpdateOne, UpdateMany, HASHED, ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
 from bson.binary import Binary
+from src.bulk_writer import BulkArticleWriter
 from src.config import *
+from src.metrics import getMetrics, STAGE_SECONDS, DB_READ, ARTICLES_READ
+from src.scrap_result import SKIPPED, FAILED, NO_TEXT
+from src.stored_html import encodeWebScrap, decodeWebScrap
+from src.http_cache import Validators
+
+# Indexes used by the "needs scraping" and summary queries.
+# Partial indexes cannot filter on missing fields, so hashed indexes are used instead.
+# They index missing fields as null, support null equality lookups and keep keys small for large html/text fields.
+# The "needs scraping" indexes end in _id, so each branch of its $or reads articles in _id order from the index and
+# the branches are merged without sorting, see getNonWebScrapArticles. Compound hashed indexes require mongo 4.4.
+ARTICLE_INDEXES = [
+    IndexModel([("web_scrap", HASHED), ("_id", ASCENDING)], name="web_scrap_hashed"),
+    IndexModel([("clean_full_text", HASHED), ("_id", ASCENDING)], name="clean_full_text_hashed"),
+    IndexModel([("summary", HASHED)], name="summary_hashed"),
+    IndexModel([("lease.expires", ASCENDING)], name="lease_expires"),
+]
+# Projected as true for articles with a stored page, whose validators can be used to revalidate it
+STORED_WEB_SCRAP = {"$in": [{"$type": "$web_scrap"}, ["string", "binData"]]}
+# Fields written by the fetch of an article, copied to the articles with the same url
+FETCH_RESULT_FIELDS = ("web_scrap", "clean_full_text", "fetch_status", "content_type", "validators", "retry",
+                       "fetched_at")
+# Index of the high-water mark of daemon mode, only used in daemon mode. _id is always indexed
+if RUN_MODE == "daemon" and WATERMARK_FIELD != "_id":
+    ARTICLE_INDEXES.append(IndexModel([(WATERMARK_FIELD, ASCENDING)], name="watermark"))
+
+
+def nonWebScrapQuery(now=None, after=None, includeNoText=False):
+    """
+    Query for articles that require web scraping. Null equality matches missing fields and can use the hashed indexes.
+    Articles whose page was skipped because of its content type, that failed for good, or whose page has no article
+    text are excluded, as are articles waiting for the backoff of their last failure to end.
+    :param now: time retries are due by (default is now)
+    :param after: only match articles with a greater _id (or null for all articles). The bound is set in each branch
+    of the $or, so it bounds the index scan of each branch.
+    :param includeNoText: also match articles whose page has no article text, so their stored page is extracted again
+    :return: mongo query
+    """
+    branches = [
+        {"web_scrap": None},  # New articles to be fully scraped
+        {"clean_full_text": None}  # Articles that lack clean text
+    ]
+    if after is not None:
+        branches = [dict(branch, _id={"$gt": after}) for branch in branches]
+    return {
+        "$or": branches,
+        "fetch_status": {"$nin": [SKIPPED, FAILED] if includeNoText else [SKIPPED, FAILED, NO_TEXT]},
+        # Matches articles that never failed, which have no retry time
+        "retry.next": {"$not": {"$gt": now or datetime.now(timezone.utc)}}}
+
+
+def nonWebScrapFind(includeStoredHtml=False, window=None, after=None):
+    """
+    Arguments of the find that reads the articles that require web scraping, see getNonWebScrapArticles
+    :return: dict of the filter, projection and sort of the find
+    """
+    query = watermarkQuery(*window) if window is not None else None
+    # Each branch of the query reads its index in _id order, the branches are merged (SORT_MERGE) so the first
+    # batch does not wait for a sort of all matching articles
+    return {"filter": _andQuery(nonWebScrapQuery(after=after, includeNoText=includeStoredHtml), query),
+            "projection": _articleProjection(includeStoredHtml), "sort": [("_id", ASCENDING)]}
+
+
+def leaseAvailableQuery(now):
+    """
+    Query for articles without a lease or with an expired lease. Null equality matches articles never claimed.
+    :return: mongo query
+    """
+    return {
+        "$or": [
+            {"lease.expires": None},
+            {"lease.expires": {"$lt": now}}
+        ]}
+
+
+def claimableQuery(now, includeNoText=False):
+    """
+    Query for articles that require web scraping and can be claimed
+    :param includeNoText: also match articles whose page has no article text, see nonWebScrapQuery
+    :return: mongo query
+    """
+    return {"$and": [nonWebScrapQuery(now, includeNoText=includeNoText), leaseAvailableQuery(now)]}
+
+
+def watermarkQuery(lower, upper, field=WATERMARK_FIELD):
+    """
+    Query for articles with a {field} value above {lower} and up to {upper}
+    :param lower: exclusive lower bound (or null for no lower bound)
+    :param upper: inclusive upper bound
+    :return: mongo query
+    """
+    bounds = {"$lte": upper}
+    if lower is not None:
+        bounds["$gt"] = lower
+    return {field: bounds}
 
 
 class MongoService:
@@ -13,78 +111,386 @@ class MongoService:
     Service that handles all mongo db operations
     """
 
-    def __init__(self, logger, scheduler):
+    def __init__(self, logger, scheduler, claimArticles=CLAIM_ARTICLES):
+        """
+        :param claimArticles: claim articles with a lease before processing them, so nodes sharing the collection
+        do not process the same articles
+        """
         self.logger = logger
         self.scheduler = scheduler
+        self.claimArticles = claimArticles
         self.client = MongoClient("mongodb://{}:{}/".format(MONGO_HOST, MONGO_PORT), 
                                   username=MONGO_USERNAME, 
                                   password=MONGO_PASSWORD,
                                   uuidRepresentation='standard')
         self.collection = self.client[MONGO_DB_NAME][MONGO_COLLECTION]
-    
+        self.stateCollection = self.client[MONGO_DB_NAME][STATE_COLLECTION]
+        self.writer = BulkArticleWriter(self.collection, logger)
+
+    def flush(self):
+        """
+        Writes all buffered article updates to the db
+        """
+        self.writer.flush()
+
+    def close(self):
+        """
+        Flushes buffered article updates and stops the background writer
+        """
+        self.writer.close()
+
+    def ensureIndexes(self):
+        """
+        Creates the indexes required by the article queries. Indexes with an outdated definition are rebuilt.
+        """
+        existing = self.collection.index_information()
+        for index in ARTICLE_INDEXES:
+            name = index.document["name"]
+            if name in existing and existing[name]["key"] != list(index.document["key"].items()):
+                self.logger.info("Rebuilding outdated index %s", name)
+                self.collection.drop_index(name)
+            try:
+                self.collection.create_indexes([index])
+            except OperationFailure as e:
+                self.logger.error("Failed to create index %s", name, exc_info=e)
+        self.logger.info("Article indexes are up to date")
+
+    def checkQueryPlans(self):
+        """
+        Runs explain on the finds of the article queries as they are run, and logs a warning for each query that
+        scans the whole collection (COLLSCAN), sorts all matching articles before returning the first (SORT) or scans
+        the _id index without bounds, which fetches every article
+        :return: names of the queries with such a plan
+        """
+        finds = {
+            "articles to web scrap": nonWebScrapFind(),
+            "articles without summary": {"filter": summaryQuery()},
+        }
+        first = self.collection.find_one({}, {"_id": 1}, sort=[("_id", ASCENDING)])
+        if first is not None:
+            # Reads resumed after a failure are bounded by the last article read
+            finds["articles to web scrap after the last read"] = nonWebScrapFind(after=first["_id"])
+        if self.claimArticles:
+            finds["articles to claim"] = {"filter": claimableQuery(datetime.now(timezone.utc)),
+                                          "projection": {"_id": 1}}
+        slowQueries = []
+        for name, find in finds.items():
+            try:
+                plan = self.collection.find(**find).explain().get("queryPlanner", {}).get("winningPlan", {})
+            except Exception as e:
+                self.logger.error("Failed to explain query for %s", name, exc_info=e)
+                continue
+
+            if _hasStage(plan, "COLLSCAN"):
+                self.logger.warning("Query for %s uses a collection scan (COLLSCAN). Check the article indexes", name)
+            elif _hasStage(plan, "SORT"):
+                self.logger.warning("Query for %s sorts all matching articles (SORT). Check the article indexes", name)
+            elif _hasUnboundedIdScan(plan):
+                self.logger.warning("Query for %s scans the whole _id index. Check the article indexes", name)
+            else:
+                continue
+            slowQueries.append(name)
+        return slowQueries
+
     def insertWebScrapArticle(self, id, web_scrap):
         """
-        Insert article web scrap into db
+        Insert article web scrap into db, compressed as defined by {WEB_SCRAP_COMPRESSION}.
+        The write is buffered and merged with other updates for the article.
         """
-        self.collection.update_one({"_id": id}, {"$set": {"web_scrap": web_scrap}}) # dump web scraped article into db
+        # dump web scraped article into db
+        self.writer.set(_normalizeId(id), {"web_scrap": encodeWebScrap(web_scrap)})
         self.logger.debug('Added web scrap to database')
+
+    def getWebScrap(self, id):
+        """
+        Reads the web scrap of an article, compressed or stored as a string
+        :return: page in unicode (or null if the article has no web scrap)
+        """
+        document = self.collection.find_one({"_id": _normalizeId(id)}, {"web_scrap": 1})
+        return decodeWebScrap(document.get("web_scrap")) if document is not None else None
+
+    def compressStoredWebScraps(self, batchSize=WRITE_BATCH_SIZE, compression=WEB_SCRAP_COMPRESSION):
+        """
+        Compresses the web scraps stored as strings. Documents are streamed from one cursor and updated with one bulk
+        write per {batchSize} documents. Updates only apply to web scraps that are still strings, so web scraps
+        written while migrating are kept.
+        :return: number of web scraps compressed
+        """
+        if compression == "none":
+            self.logger.warning("Web scrap compression is disabled, nothing to compress")
+            return 0
+        self.logger.info("Compressing stored web scraps")
+        compressed = 0
+        savedBytes = 0
+        updates = []
+        cursor = self.collection.find({"web_scrap": {"$type": "string"}}, {"web_scrap": 1},
+                                      batch_size=READ_BATCH_SIZE)
+        for document in cursor:
+            value = encodeWebScrap(document["web_scrap"], compression)
+            savedBytes += len(document["web_scrap"].encode("utf-8")) - len(value)
+            updates.append(UpdateOne({"_id": document["_id"], "web_scrap": {"$type": "string"}},
+                                     {"$set": {"web_scrap": value}}))
+            if len(updates) >= batchSize:
+                compressed += self.collection.bulk_write(updates, ordered=False).modified_count
+                updates = []
+                if compressed % (batchSize * LOG_FREQUENCY) < batchSize:
+                    self.logger.info("Compressed %s web scraps", compressed)
+        if updates:
+            compressed += self.collection.bulk_write(updates, ordered=False).modified_count
+        self.logger.info("Compressed %s web scraps, saving %.1f MB", compressed, savedBytes / 2 ** 20)
+        return compressed
     
-    def getNonWebScrapArticles(self):
+    def insertFetchStatus(self, id, fetchStatus, contentType):
+        """
+        Marks an article whose page was skipped or truncated. The write is buffered and merged with other updates for
+        the article.
+        :param fetchStatus: SKIPPED or TRUNCATED
+        :param contentType: media type of the page (or null if unknown)
+        """
+        self.writer.set(_normalizeId(id), {"fetch_status": fetchStatus, "content_type": contentType})
+
+    def markNoText(self, id):
+        """
+        Marks an article whose page has no article text, so it is only extracted again by reprocess mode.
+        The write is buffered and merged with other updates for the article.
+        """
+        self.writer.set(_normalizeId(id), {"fetch_status": NO_TEXT})
+
+    def insertFetchFailure(self, id, attempts, error, status, nextAttempt):
+        """
+        Saves the failure state of an article: its failed attempts, the error class and http status of the last one,
+        and the time it can be fetched again. Articles without a next attempt are marked {FAILED} and are no longer
+        fetched. The write is buffered and merged with other updates for the article.
+        :param status: http status of the last failure (or null if no response was received)
+        :param nextAttempt: time the article can be fetched again (or null if it is not retried)
+        """
+        fields = {"retry": {"attempts": attempts, "error": error, "status": status, "next": nextAttempt}}
+        if nextAttempt is None:
+            fields["fetch_status"] = FAILED
+        self.writer.set(_normalizeId(id), fields)
+
+    def clearFetchFailure(self, id):
         """
-        Gets article info for articles that has not been web scraped 
-        :return: list of article info that requires web scraping 
+        Clears the failure state of an article that was fetched after failing
         """
-        query = {
-                "$or": [
-                    {"web_scrap": {"$exists": False}},  # New articles to be fully scraped
-                    {"clean_full_text": {"$exists": False, "$ne": ""}}  # Articles that lack clean text
-                ]}
-        result = self.collection.find(query)
+        self.writer.set(_normalizeId(id), {"retry": None})
 
-        # create array of Article Info 
-        articles = []
-        for r in result:
-            articles.append(ArticleInfo(r["_id"], r["link"]))
-        return articles
+    def insertFetchTime(self, id, fetchedAt=None):
+        """
+        Saves the time an article was fetched, whatever the outcome. The write is buffered and merged with other
+        updates for the article.
+        :param fetchedAt: time of the fetch (default is now)
+        """
+        self.writer.set(_normalizeId(id), {"fetched_at": fetchedAt or datetime.now(timezone.utc)})
+
+    def setDuplicates(self, id, duplicateIds):
+        """
+        Writes the updates of an article to its duplicates as well until they are cleared, see clearDuplicates
+        :param duplicateIds: ids of articles with the same url
+        """
+        self.writer.setDuplicates(_normalizeId(id), [_normalizeId(duplicateId) for duplicateId in duplicateIds])
+
+    def clearDuplicates(self, id):
+        """
+        Stops writing the updates of an article to its duplicates, updates already buffered are still written to them
+        """
+        self.writer.clearDuplicates(_normalizeId(id))
+
+    def copyFetchResults(self, copies):
+        """
+        Copies the fetch results of articles to their duplicates, with one update per article in one bulk write.
+        Articles are only copied once their fetch was written, which is found by its fetch time. Articles without a
+        submit time are copied as stored, such as articles whose stored page was not modified.
+        :param copies: list of (article id, time the article was submitted or null, duplicate ids, ...) of the
+        duplicates
+        :return: tuple of the number of duplicates written, and the copies of the articles that are not written yet
+        """
+        if not copies:
+            return 0, []
+        documents = {document["_id"]: document for document in
+                     self.collection.find({"_id": {"$in": [_normalizeId(copy[0]) for copy in copies]}},
+                                          {field: 1 for field in FETCH_RESULT_FIELDS})}
+        updates = []
+        waiting = []
+        written = 0
+        for copy in copies:
+            articleId, startedAt, duplicateIds = copy[:3]
+            document = documents.get(_normalizeId(articleId))
+            fetchedAt = document.get("fetched_at") if document is not None else None
+            if document is None or (startedAt is not None and
+                                    (fetchedAt is None or fetchedAt.replace(tzinfo=None) < startedAt)):
+                waiting.append(copy)
+                continue
+            updates.append(UpdateMany({"_id": {"$in": [_normalizeId(duplicateId) for duplicateId in duplicateIds]}},
+                                      {"$set": {field: document.get(field) for field in FETCH_RESULT_FIELDS}}))
+            written += len(duplicateIds)
+        if updates:
+            self.collection.bulk_write(updates, ordered=False)
+        return written, waiting
+
+    def insertValidators(self, id, validators: Validators):
+        """
+        Saves the ETag, Last-Modified and content hash of the page saved for an article, so it can be revalidated when
+        the article is scraped again. The write is buffered and merged with other updates for the article.
+        """
+        self.writer.set(_normalizeId(id), {"validators": validators.toDocument()})
 
-    def getNonWebScrapArticleAsStream(self):
+    def getNonWebScrapArticles(self, includeStoredHtml=False, window=None, after=None):
+        """
+        Gets article info for articles that has not been web scraped.
+        Reads from a cursor that only returns the id, link, failure state and validators of articles,
+        {READ_BATCH_SIZE} documents per batch, in _id order so a failed read can resume after the last article read.
+        When claiming articles, only the articles claimed by this node are returned. Claimed articles keep their lease,
+        so a claim that failed is resumed by claiming again.
+        :param includeStoredHtml: also read the stored web scrap of articles so they can be reprocessed without fetching
+        :param window: (lower, upper) bounds of {WATERMARK_FIELD} to only read articles inserted in between,
+        see watermarkQuery
+        :param after: _id of the last article read, only articles after it are read (or null to read from the start)
+        :return: generator of article info that requires web scraping
+        """
+        if self.claimArticles:
+            self.logger.log(logging.DEBUG if window is not None else logging.INFO,
+                            "Claiming Articles to web scrap as %s", NODE_ID)
+            yield from self.claimNonWebScrapArticles(_articleProjection(includeStoredHtml),
+                                                     query=watermarkQuery(*window) if window is not None else None,
+                                                     includeNoText=includeStoredHtml)
+            return
+
+        self.logger.log(logging.DEBUG if window is not None or after is not None else logging.INFO,
+                        "Reading Articles to web scrap" if after is None else "Resuming read of Articles to web scrap")
+        yield from self._readArticles(self.collection.find(**nonWebScrapFind(includeStoredHtml, window, after),
+                                                           batch_size=READ_BATCH_SIZE))
+
+    def claimNonWebScrapArticles(self, projection, owner=NODE_ID, batchSize=CLAIM_BATCH_SIZE,
+                                 leaseDuration=LEASE_DURATION, query=None, includeNoText=False):
+        """
+        Claims articles that require web scraping in batches until none are left.
+        A batch of candidates is leased with one update whose filter only matches articles that are still available,
+        so an article raced for by several nodes is leased by only one of them. The articles of the batch that were
+        leased are then read back by the token of the claim.
+        Leases are not released when articles complete: completed articles no longer match, and failed articles are
+        retried by the next claim after their lease expires.
+        :param projection: fields of the articles to read
+        :param owner: id of this node stored on the lease
+        :param query: additional query the articles must match
+        :param includeNoText: also claim articles whose page has no article text, see nonWebScrapQuery
+        :return: generator of claimed article info
+        """
+        while True:
+            start = time.perf_counter()
+            now = datetime.now(timezone.utc)
+            candidates = [document["_id"] for document in
+                          self.collection.find(_andQuery(claimableQuery(now, includeNoText), query), {"_id": 1},
+                                               limit=batchSize)]
+            if not candidates:
+                return
+
+            token = uuid4()
+            lease = {"owner": owner, "token": token, "expires": now + timedelta(seconds=leaseDuration)}
+            claimed = self.collection.update_many({"_id": {"$in": candidates}, **leaseAvailableQuery(now)},
+                                                  {"$set": {"lease": lease}})
+            self.logger.debug("Claimed %s of %s candidate articles", claimed.modified_count, len(candidates))
+            if claimed.modified_count == 0:
+                # Other nodes claimed the candidates first
+                continue
+
+            # The claim of a batch is recorded as one read, reading the claimed articles as one read per article
+            getMetrics().observe(STAGE_SECONDS, time.perf_counter() - start, DB_READ)
+            yield from self._readArticles(self.collection.find({"_id": {"$in": candidates}, "lease.token": token},
+                                                               projection, batch_size=batchSize))
+
+    def _readArticles(self, cursor):
+        """
+        Reads article info from a cursor.
+        The time to read each article is recorded, which is the time of its batch spread over the batch.
+        :return: generator of article info
+        """
+        metrics = getMetrics()
+        documents = iter(cursor)
+        # yield Article Info as each batch arrives
+        while True:
+            start = time.perf_counter()
+            r = next(documents, None)
+            if r is None:
+                return
+            metrics.observe(STAGE_SECONDS, time.perf_counter() - start, DB_READ)
+            metrics.increment(ARTICLES_READ)
+            validators = Validators.fromDocument(r.get("validators")) if r.get("stored_web_scrap") else None
+            attempts = (r.get("retry") or {}).get("attempts", 0)
+            yield ArticleInfo(r["_id"], r["link"], r.get("web_scrap") or None, validators, attempts)
+
+    def getNonWebScrapArticleAsStream(self, includeStoredHtml=False, window=None):
         """
         Gets article info for articles that has not been web scrap as a stream
+        :param includeStoredHtml: also read the stored web scrap of articles so they can be reprocessed without fetching
+        :param window: (lower, upper) bounds of {WATERMARK_FIELD} to only read articles inserted in between
         :return: Observable that emits all article info that requires web scraping
         """
-        # Start stream with value so when database calls are called, errors are transmitted into stream
-        return rx.of(0).pipe(
-            ops.do_action(on_next=lambda v: self.logger.info("Reading Articles to web scrap")),
-            # Extract id
-            ops.map(lambda b: self.getNonWebScrapArticles()),
+        articleCount = 0
+        lastId = None
+
+        def countArticle(articleInfo):
+            nonlocal articleCount
+            articleCount += 1
+
+        def readArticle(articleInfo):
+            nonlocal lastId
+            lastId = articleInfo.articleId
+
+        # Defer so the query is only executed on subscription, and resumed after the last article read on retry.
+        # Cursors idle while reading is paused can be closed by the server, articles already read are not read again.
+        return rx.defer(lambda scheduler: rx.from_iterable(
+            self.getNonWebScrapArticles(includeStoredHtml, window, lastId))).pipe(
+            ops.do_action(on_next=readArticle,
+                          on_error=lambda err: self.logger.error("Failed to read from db", exc_info=err)),
             # Retry
-            ops.do_action(on_error=lambda err: self.logger.error("Failed to read from db", exc_info=err)),
             ops.retry(DB_MAX_RETRIES),
             ops.do_action(on_error=lambda err: self.logger.error("Retries Exhausted", exc_info=err)),
             ops.catch(rx.empty()),
-            # Split array into individual elements
-            ops.do_action(on_next=lambda articleInfoList: self.logger.info("Found %s articles to process", str(len(articleInfoList)))),
-            ops.flat_map(lambda articleInfoList: rx.from_iterable(articleInfoList)),
+            ops.do_action(on_next=countArticle,
+                          on_completed=lambda: self.logger.info("Found %s articles to process", str(articleCount))),
             # Scheduler setup
             ops.subscribe_on(self.scheduler)
         )
         
 
+    def hasArticles(self):
+        """
+        :return: if the collection has at least one article
+        """
+        return self.collection.find_one({}, {"_id": 1}) is not None
+
+    def latestWatermark(self, field=WATERMARK_FIELD):
+        """
+        Gets the highest {field} value of the articles, read from the end of its index
+        :return: the value (or null if no article has the field)
+        """
+        document = self.collection.find_one({field: {"$ne": None}}, {field: 1}, sort=[(field, DESCENDING)])
+        return _getField(document, field) if document is not None else None
+
+    def loadWatermark(self, field=WATERMARK_FIELD):
+        """
+        Gets the saved high-water mark of daemon mode, the highest {field} value of the articles already processed
+        :return: the value (or null if no mark was saved)
+        """
+        state = self.stateCollection.find_one({"_id": _watermarkId(field)})
+        return state.get("value") if state is not None else None
+
+    def saveWatermark(self, value, field=WATERMARK_FIELD):
+        """
+        Saves the high-water mark of daemon mode. The saved mark only moves forward, so nodes sharing the collection
+        can save their marks in any order.
+        """
+        self.stateCollection.update_one({"_id": _watermarkId(field)},
+                                        {"$max": {"value": value}, "$set": {"updatedAt": datetime.now(timezone.utc)}},
+                                        upsert=True)
+
     def insertCleanFullText(self, article_id: str, clean_text: str):
-        """Insert the cleaned text into Mongo"""
+        """Insert the cleaned text into Mongo. The write is buffered and merged with other updates for the article."""
         if not clean_text:
             return
         try:
-            if isinstance(article_id, uuid.UUID):
-                db_id = Binary(article_id.bytes, subtype=4)
-            else:
-                db_id = Binary(uuid.UUID(article_id).bytes, subtype=4)
-
-            self.collection.update_one(
-                {"_id": db_id},
-                {"$set": {"clean_full_text": clean_text}},
-                upsert=True
-            )
+            self.writer.set(_normalizeId(article_id), {"clean_full_text": clean_text}, upsert=True)
         except Exception as e:
             self.logger.error("Failed to insert clean full text", exc_info=e)
 
@@ -93,8 +499,8 @@ class MongoService:
         """
         Returns articles where the 'summary' field is missing or null.
         """
-        return list(self.db.articleContent.find(
-            {"summary": {"$exists": False}},
+        return list(self.collection.find(
+            summaryQuery(),
             {"clean_full_text": 1, "link": 1}
         ).limit(limit))
 
@@ -103,19 +509,152 @@ class MongoService:
         """
         Updates an article with its generated summary.
         """
-        self.db.articleContent.update_one(
+        self.collection.update_one(
             {"_id": article_id},
             {"$set": {"summary": summary}}
         )
+
+
+def summaryQuery():
+    """
+    Query for articles where the 'summary' field is missing or null
+    :return: mongo query
+    """
+    return {"summary": None}
+
+
+def _articleProjection(includeStoredHtml):
+    """
+    Fields read for the articles that require web scraping: the id, link, failure state and validators of articles
+    :param includeStoredHtml: also read the stored web scrap of articles so they can be reprocessed without fetching
+    """
+    projection = {"_id": 1, "link": 1, "retry": 1}
+    if includeStoredHtml:
+        projection["web_scrap"] = 1
+    elif CONDITIONAL_REQUESTS:
+        # Articles scraped again are revalidated when their page is still stored
+        projection["validators"] = 1
+        projection["stored_web_scrap"] = STORED_WEB_SCRAP
+    return projection
+
+
+def _andQuery(query, other):
+    """
+    Combines two queries, {other} can be null
+    """
+    return {"$and": [query, other]} if other else query
+
+
+def _watermarkId(field):
+    return "watermark:{}:{}".format(MONGO_COLLECTION, field)
+
+
+def _getField(document, path):
+    """
+    Gets the value of a dotted path in a document (or null if missing)
+    """
+    for key in path.split("."):
+        if not isinstance(document, dict):
+            return None
+        document = document.get(key)
+    return document
+
+
+def _planStages(plan):
+    """
+    :return: generator of a query plan stage and all its input stages
+    """
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            yield plan
+        for value in plan.values():
+            yield from _planStages(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            yield from _planStages(value)
+
+
+def _hasStage(plan, stage):
+    """
+    Checks if a query plan stage or any of its input stages is of the given type
+    """
+    return any(planStage["stage"] == stage for planStage in _planStages(plan))
+
+
+def _hasUnboundedIdScan(plan):
+    """
+    Checks if a query plan scans the _id index without a lower or upper bound, which reads it to one of its ends
+    """
+    return any(planStage["stage"] == "IXSCAN" and planStage.get("keyPattern") == {"_id": 1} and
+               any("MinKey" in bound or "MaxKey" in bound for bound in planStage.get("indexBounds", {}).get("_id", []))
+               for planStage in _planStages(plan))
+
+
+def _normalizeId(articleId):
+    """
+    Converts an article id to the form used as the bulk writer key so updates for the same article are merged.
+    UUID strings and UUID binaries are converted to UUID, which the client encodes as a standard UUID binary.
+    """
+    if isinstance(articleId, UUID):
+        return articleId
+    if isinstance(articleId, Binary) and articleId.subtype == 4:
+        return UUID(bytes=bytes(articleId))
+    if isinstance(articleId, str):
+        try:
+            return UUID(articleId)
+        except ValueError:
+            return articleId
+    return articleId
+
+
 class ArticleInfo:
     """
-    Object containing Article URL and id
+    Object containing Article URL and id, and the stored web scrap when articles are reprocessed.
+    The stored web scrap is kept as stored, compressed or not, and decoded by the worker processing the article.
+    Articles scraped again carry the validators of their stored page instead, and articles that failed carry their
+    failed attempts. Articles fetched for other articles with the same url carry the ids of these duplicates, which
+    are written with the article.
+    Uses slots and keeps UUID ids as their 16 bytes as many articles can be waiting to be processed.
     """
-    def __init__(self, articleId: UUID, articleUrl: str):
-        self.articleId = articleId
+    __slots__ = ("_id", "articleUrl", "storedHtml", "validators", "attempts", "duplicateIds")
+
+    def __init__(self, articleId: UUID, articleUrl: str, storedHtml: str = None, validators: Validators = None,
+                 attempts=0, duplicateIds=()):
+        articleId = _normalizeId(articleId)
+        self._id = articleId.bytes if isinstance(articleId, UUID) else articleId
         self.articleUrl = articleUrl
+        self.storedHtml = storedHtml
+        self.validators = validators
+        self.attempts = attempts
+        self.duplicateIds = tuple(duplicateIds)
+
+    @classmethod
+    def fromIdBytes(cls, idBytes: bytes, articleUrl: str, storedHtml: str = None, validators: Validators = None,
+                    attempts=0, duplicateIds=()):
+        """
+        Creates article info from the 16 bytes of its UUID without converting them to a UUID
+        """
+        article = cls.__new__(cls)
+        article._id = idBytes
+        article.articleUrl = articleUrl
+        article.storedHtml = storedHtml
+        article.validators = validators
+        article.attempts = attempts
+        article.duplicateIds = tuple(duplicateIds)
+        return article
+
+    @property
+    def articleId(self):
+        return UUID(bytes=self._id) if type(self._id) is bytes else self._id
+
+    @property
+    def idBytes(self):
+        """
+        :return: 16 bytes of the article UUID, null if the article id is not a UUID
+        """
+        return self._id if type(self._id) is bytes else None
 
     def __eq__(self, other):
         return (isinstance(other, ArticleInfo)
-                and self.articleId == other.articleId
-                and self.articleUrl == other.articleUrl)
\ No newline at end of file
+                and self._id == other._id
+                and self.articleUrl == other.articleUrl)
@@ -0,0 +1,126 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import reactivex as rx
+
+
+class PipelineStage:
+    """
+    Runs the tasks of one pipeline stage on its own thread pool of {workers} threads.
+    At most {queueSize} tasks wait for a thread, further submissions block until a task completes.
+    Counts waiting and running tasks so the depth of the stage can be reported.
+    """
+
+    def __init__(self, name, workers, queueSize):
+        self.name = name
+        self.workers = workers
+        self.capacity = workers + queueSize
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix=name)
+        self._slots = threading.BoundedSemaphore(self.capacity)
+        self._countLock = threading.Lock()
+        self.queued = 0
+        self.active = 0
+        self.completed = 0
+        self.maxQueued = 0
+
+    def submit(self, fn, *args):
+        """
+        Submits a task to the stage. Blocks while the queue of the stage is full.
+        :return: Future of the task result
+        """
+        self._slots.acquire()
+        with self._countLock:
+            self.queued += 1
+            self.maxQueued = max(self.maxQueued, self.queued)
+        try:
+            return self.executor.submit(self._run, fn, args)
+        except Exception:
+            with self._countLock:
+                self.queued -= 1
+            self._slots.release()
+            raise
+
+    def observe(self, fn, *args, onSubmitted=None):
+        """
+        Submits a task to the stage on subscription
+        :param onSubmitted: called once the stage accepted the task
+        :return: Observable that emits the task result
+        """
+        def submit(scheduler):
+            future = self.submit(fn, *args)
+            if onSubmitted is not None:
+                onSubmitted()
+            return rx.from_future(future)
+
+        return rx.defer(submit)
+
+    def depth(self):
+        """
+        :return: tuple of waiting and running tasks
+        """
+        with self._countLock:
+            return self.queued, self.active
+
+    def shutdown(self):
+        self.executor.shutdown()
+
+    def _run(self, fn, args):
+        with self._countLock:
+            self.queued -= 1
+            self.active += 1
+        try:
+            return fn(*args)
+        finally:
+            with self._countLock:
+                self.active -= 1
+                self.completed += 1
+            self._slots.release()
+
+
+class ConcurrencyLimit:
+    """
+    Limits the number of articles fetched at the same time by a worker and counts the articles being fetched.
+    Slots are freed once the page of an article is accepted by the extraction stage, which bounds the pages waiting
+    for extraction itself. The limit can be changed while articles are fetched, slots above a lowered limit are not
+    reused.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._condition = threading.Condition()
+        self._acquired = 0
+        self.inUse = 0
+
+    def acquire(self):
+        """
+        Waits for a free slot
+        """
+        with self._condition:
+            while self._acquired >= self.limit:
+                self._condition.wait()
+            self._acquired += 1
+
+    def started(self):
+        """
+        Marks an acquired slot as fetching an article
+        """
+        with self._condition:
+            self.inUse += 1
+
+    def release(self, result=None):
+        """
+        Frees the slot of a fetched article
+        :param result: ScrapResult of the article (or null if none), used by subclasses that adjust the limit
+        """
+        with self._condition:
+            self.inUse -= 1
+            self._acquired -= 1
+            self._condition.notify()
+
+    def setLimit(self, limit):
+        """
+        Changes the number of slots, waiting articles are started at once when the limit is raised
+        """
+        with self._condition:
+            self.limit = limit
+            self._condition.notify_all()
@@ -0,0 +1,278 @@
+import cProfile
+import glob
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+from logging import Logger
+
+from src.config import PROFILE_MODE, PROFILE_DIR, PROFILE_SAMPLE_INTERVAL, PROFILE_TOP
+
+CPROFILE = "cprofile"
+SAMPLE = "sample"
+PROFILE_MODES = (CPROFILE, SAMPLE)
+
+# Stack tops of threads waiting for work, counted as idle instead of attributed to a function.
+# Waits in C calls (lock acquire, SimpleQueue.get, sleep) show the python function that called them.
+IDLE_FRAMES = {("threading.py", "wait"), ("threading.py", "_wait_for_tstate_lock"), ("queue.py", "get"),
+               ("queues.py", "get"), ("connection.py", "_recv"), ("thread.py", "_worker"),
+               ("periodic_executor.py", "_run"), ("task_channel.py", "_run")}
+REPORT_FILE = "report.txt"
+
+
+def createProfileDir(mode=PROFILE_MODE, directory=PROFILE_DIR):
+    """
+    Creates the directory of the profiles of this run, under {PROFILE_DIR}
+    :return: path of the directory (or null if profiling is disabled)
+    """
+    if not mode:
+        return None
+    if mode not in PROFILE_MODES:
+        raise ValueError("Unknown profile mode '{}', expected one of {}".format(mode, ", ".join(PROFILE_MODES)))
+    path = os.path.join(directory, "{}-{}".format(time.strftime("%Y%m%d-%H%M%S"), os.getpid()))
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def runProfiled(mode, directory, role, fn, *args):
+    """
+    Runs a function under the profiler of {mode} and saves the profile of the process to {directory} when it returns
+    :param role: name of the process in the profile file names
+    """
+    profiler = CProfileProfiler() if mode == CPROFILE else StackSampler()
+    profiler.start()
+    try:
+        return fn(*args)
+    finally:
+        profiler.stop()
+        profiler.save(os.path.join(directory, "{}-{}".format(role, os.getpid())))
+
+
+class CProfileProfiler:
+    """
+    Profiles every thread of the process with cProfile. Threads started after {start} get their own profiler, as a
+    cProfile profiler only sees the thread that enabled it. Profiles of all threads are merged when saved.
+    Deterministic and exact call counts, but slows down python heavy code.
+    """
+
+    def __init__(self):
+        self._profiles = []
+        self._lock = threading.Lock()
+        self._profile = None
+
+    def start(self):
+        threading.setprofile(self._startThread)
+        self._profile = self._enable()
+
+    def stop(self):
+        threading.setprofile(None)
+        # Profilers of other threads cannot be disabled from this thread, their entries are read as they are
+        self._profile.disable()
+
+    def save(self, path):
+        """
+        Saves the merged profile of all threads as {path}.prof, readable with pstats or snakeviz
+        """
+        with self._lock:
+            profiles = list(self._profiles)
+        stats = None
+        for profile in profiles:
+            profile.snapshot_stats()
+            if not profile.stats:
+                continue
+            if stats is None:
+                stats = pstats.Stats(_LoadedStats(profile.stats))
+            else:
+                stats.add(_LoadedStats(profile.stats))
+        if stats is not None:
+            stats.dump_stats(path + ".prof")
+
+    def _startThread(self, frame, event, arg):
+        # Called once in each new thread, enabling cProfile replaces this hook for the thread
+        self._enable()
+
+    def _enable(self):
+        profile = cProfile.Profile()
+        with self._lock:
+            self._profiles.append(profile)
+        profile.enable()
+        return profile
+
+
+class _LoadedStats:
+    """
+    Stats already collected from a profiler, in the form pstats loads them from
+    """
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+class StackSampler:
+    """
+    Samples the stacks of all threads every {interval} seconds from a background thread.
+    Counts samples per function where the thread is (self) and per function on the stack (cumulative), and whole
+    stacks in collapsed format for flame graphs. Threads waiting for work are counted as idle.
+    Samples of threads that used the CPU since the previous sample are also counted per function (cpu), which tells
+    functions burning CPU apart from functions waiting on the network or locks.
+    The overhead only depends on the interval, not on the code being profiled.
+    """
+
+    def __init__(self, interval=PROFILE_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.samples = 0
+        self.idle = 0
+        self.selfCounts = {}
+        self.cpuCounts = {}
+        self.cumulativeCounts = {}
+        self.stacks = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._functionNames = {}
+        self._cpuTimes = {}
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def save(self, path):
+        """
+        Saves the sample counts as {path}.json and the collapsed stacks as {path}.stacks
+        """
+        with open(path + ".json", "w") as file:
+            json.dump({"interval": self.interval, "samples": self.samples, "idle": self.idle,
+                       "self": self.selfCounts, "cpu": self.cpuCounts, "cumulative": self.cumulativeCounts}, file)
+        with open(path + ".stacks", "w") as file:
+            for stack, count in self.stacks.items():
+                file.write("{} {}\n".format(stack, count))
+
+    def sample(self, frames, onCpu=frozenset()):
+        """
+        Counts one sample of the stacks of threads
+        :param frames: dict of thread id to its current frame, as returned by sys._current_frames
+        :param onCpu: ids of the threads that used the CPU since the previous sample
+        """
+        for threadId, frame in frames.items():
+            self.samples += 1
+            code = frame.f_code
+            if (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES:
+                self.idle += 1
+                continue
+            names = []
+            while frame is not None:
+                names.append(self._functionName(frame.f_code))
+                frame = frame.f_back
+            self.selfCounts[names[0]] = self.selfCounts.get(names[0], 0) + 1
+            if threadId in onCpu:
+                self.cpuCounts[names[0]] = self.cpuCounts.get(names[0], 0) + 1
+            for name in set(names):
+                self.cumulativeCounts[name] = self.cumulativeCounts.get(name, 0) + 1
+            stack = ";".join(reversed(names))
+            self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+    def _functionName(self, code):
+        name = self._functionNames.get(code)
+        if name is None:
+            parts = code.co_filename.replace("\\", "/").split("/")
+            name = self._functionNames[code] = "{}:{}({})".format("/".join(parts[-2:]), code.co_firstlineno,
+                                                                  code.co_name)
+        return name
+
+    def _run(self):
+        ownId = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            frames.pop(ownId, None)
+            self.sample(frames, self._threadsOnCpu(frames))
+
+    def _threadsOnCpu(self, frames):
+        """
+        :return: ids of the threads that used at least half of the interval of CPU time since the previous sample
+        """
+        onCpu = set()
+        cpuTimes = {}
+        for threadId in frames:
+            try:
+                cpuTime = time.clock_gettime(time.pthread_getcpuclockid(threadId))
+            except (AttributeError, OSError):
+                # Per thread CPU clocks are not available on this platform, or the thread has exited
+                continue
+            cpuTimes[threadId] = cpuTime
+            if cpuTime - self._cpuTimes.get(threadId, cpuTime) >= self.interval / 2:
+                onCpu.add(threadId)
+        self._cpuTimes = cpuTimes
+        return onCpu
+
+
+def writeReport(directory, logger: Logger, top=PROFILE_TOP):
+    """
+    Merges the profiles of all processes in {directory} into a report of the {top} hottest functions,
+    written to {directory}/report.txt. The first lines of the report are logged.
+    :return: path of the report (or null if there are no profiles)
+    """
+    profiles = sorted(glob.glob(os.path.join(directory, "*.prof")))
+    samples = sorted(glob.glob(os.path.join(directory, "*.json")))
+    if profiles:
+        report = _cProfileReport(profiles, top)
+    elif samples:
+        report = _sampleReport(samples, top)
+    else:
+        logger.warning("No profiles were written to %s", directory)
+        return None
+
+    path = os.path.join(directory, REPORT_FILE)
+    with open(path, "w") as file:
+        file.write(report)
+    logger.info("Profile report of %s processes written to %s", len(profiles) or len(samples), path)
+    for line in report.splitlines()[:min(top, 15) + 4]:
+        logger.info("%s", line)
+    return path
+
+
+def _cProfileReport(profiles, top):
+    output = io.StringIO()
+    stats = pstats.Stats(*profiles, stream=output)
+    stats.strip_dirs()
+    for sortKey in ("tottime", "cumulative"):
+        output.write("Top {} functions by {} of {} processes\n".format(top, sortKey, len(profiles)))
+        stats.sort_stats(sortKey).print_stats(top)
+    return output.getvalue()
+
+
+def _sampleReport(samples, top):
+    total = idle = 0
+    selfCounts = {}
+    cpuCounts = {}
+    cumulativeCounts = {}
+    interval = None
+    for path in samples:
+        with open(path) as file:
+            profile = json.load(file)
+        interval = profile["interval"]
+        total += profile["samples"]
+        idle += profile["idle"]
+        for name, count in profile["self"].items():
+            selfCounts[name] = selfCounts.get(name, 0) + count
+        for name, count in profile["cpu"].items():
+            cpuCounts[name] = cpuCounts.get(name, 0) + count
+        for name, count in profile["cumulative"].items():
+            cumulativeCounts[name] = cumulativeCounts.get(name, 0) + count
+
+    busy = max(total - idle, 1)
+    lines = ["{} thread samples every {} s of {} processes, {:.1f}% idle (waiting for work)".format(
+        total, interval, len(samples), 100 * idle / max(total, 1))]
+    for title, counts in (("cpu", cpuCounts), ("self", selfCounts), ("cumulative", cumulativeCounts)):
+        lines.append("")
+        lines.append("Top {} functions by {} samples (% of busy samples)".format(top, title))
+        for name, count in sorted(counts.items(), key=lambda item: -item[1])[:top]:
+            lines.append("{:8d} {:6.1f}%  {}".format(count, 100 * count / busy, name))
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,38 @@
+from datetime import datetime, timedelta, timezone
+
+from src.config import WEB_SCRAP_RETRIES, RETRY_BASE_DELAY, RETRY_MAX_DELAY, PERMANENT_FAILURE_STATUSES
+
+# Outcomes of a failed fetch: the article is fetched again after its backoff, its page is gone, or it failed more
+# than the allowed retries
+RETRY = "retry"
+PERMANENT = "permanent"
+EXHAUSTED = "exhausted"
+
+
+def retryDelay(attempts, baseDelay=RETRY_BASE_DELAY, maxDelay=RETRY_MAX_DELAY):
+    """
+    :param attempts: failed attempts of the article, including the last one
+    :return: seconds before the article is fetched again, doubled after each failure
+    """
+    return min(maxDelay, baseDelay * 2 ** (attempts - 1))
+
+
+def failureOutcome(attempts, status, retries=WEB_SCRAP_RETRIES):
+    """
+    :param attempts: failed attempts of the article, including the last one
+    :param status: http status of the last failure (or null if no response was received)
+    :return: RETRY, PERMANENT or EXHAUSTED
+    """
+    if status in PERMANENT_FAILURE_STATUSES:
+        return PERMANENT
+    if attempts > retries:
+        return EXHAUSTED
+    return RETRY
+
+
+def nextAttempt(attempts, now=None):
+    """
+    :param attempts: failed attempts of the article, including the last one
+    :return: time the article can be fetched again
+    """
+    return (now or datetime.now(timezone.utc)) + timedelta(seconds=retryDelay(attempts))
@@ -0,0 +1,38 @@
+# Error of articles that were skipped because the circuit of their host is open
+CIRCUIT_OPEN = "CircuitOpen"
+# Fetch status of articles whose page was not downloaded because of its content type
+SKIPPED = "skipped"
+# Fetch status of articles whose page was cut off at the maximum download size
+TRUNCATED = "truncated"
+# Fetch status of articles whose page is gone or that failed more than the allowed retries, which are not fetched again
+FAILED = "failed"
+# Fetch status of articles whose page has no article text, which are only extracted again by reprocess mode
+NO_TEXT = "no_text"
+
+
+class ScrapResult:
+    """
+    Outcome of web scraping an article, reported back to the main process
+    """
+    __slots__ = ("status", "error", "elapsed", "fetchStatus", "contentType")
+
+    def __init__(self, status=None, error=None, elapsed=0.0):
+        self.status = status  # HTTP status code, null if no response was received
+        self.error = error  # Exception class name, null if successful
+        self.elapsed = elapsed  # Fetch time in seconds
+        # Only used by the worker process to save the download outcome, not sent to the main process
+        self.fetchStatus = None  # SKIPPED or TRUNCATED, null if the page was fully downloaded
+        self.contentType = None  # Content type of the response
+
+    def recordLimited(self, fetchStatus, contentType):
+        self.fetchStatus = fetchStatus
+        self.contentType = contentType
+
+    def recordSuccess(self, elapsed):
+        self.status = 200
+        self.elapsed = elapsed
+
+    def recordFailure(self, err, elapsed):
+        self.status = getattr(err, "status_code", None)
+        self.error = type(err).__name__
+        self.elapsed = elapsed
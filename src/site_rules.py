@@ -0,0 +1,145 @@
+import json
+import logging
+import threading
+from logging import Logger
+
+from cssselect import GenericTranslator
+from lxml import etree
+
+from src.config import SITE_RULES_FILE
+from src.domain_scheduler import hostOf
+
+# Rules of sites with stable article containers, by host.
+# "content" selects the article container, "remove" selects elements inside it that are not part of the article.
+# Selectors are XPath expressions, or CSS selectors when prefixed with "css:".
+BUILTIN_RULES = {
+    "thehackernews.com": {
+        "content": "//div[@id='articlebody']",
+    },
+    "bleepingcomputer.com": {
+        "content": "css:div.articleBody",
+        "remove": "css:div.cz-related-article-wrapp",
+    },
+    "krebsonsecurity.com": {
+        "content": "css:article div.entry-content",
+        "remove": "css:div.sharedaddy",
+    },
+}
+
+
+def toXPath(selector):
+    """
+    Converts a rule selector to an XPath expression
+    """
+    if selector.startswith("css:"):
+        return GenericTranslator().css_to_xpath(selector[len("css:"):].strip())
+    return selector
+
+
+class SiteRule:
+    """
+    Extraction rule of a site with its selectors compiled to XPath
+    """
+
+    def __init__(self, host, content, remove=None):
+        self.host = host
+        self.content = etree.XPath(toXPath(content))
+        self.remove = etree.XPath(toXPath(remove)) if remove else None
+
+    def findContent(self, root):
+        """
+        :return: article containers of a page with the elements that are not part of the article removed
+        """
+        containers = self.content(root)
+        if self.remove is not None:
+            for container in containers:
+                for element in self.remove(container):
+                    if element.getparent() is not None:
+                        element.drop_tree()
+        return containers
+
+
+class SiteRules:
+    """
+    Registry of extraction rules by host, loaded once per process from the built in rules and {SITE_RULES_FILE}.
+    Rules are compiled once per thread as compiled XPath expressions are not shared between threads.
+    Counts per host how many pages were extracted by a rule (hits) and by the generic extractor (misses).
+    """
+
+    def __init__(self, logger: Logger, definitions=None, rulesFile=SITE_RULES_FILE):
+        self.logger = logger
+        self.definitions = dict(BUILTIN_RULES if definitions is None else definitions)
+        if rulesFile:
+            try:
+                with open(rulesFile, encoding="utf-8") as file:
+                    self.definitions.update(json.load(file))
+            except Exception as e:
+                self.logger.error("Failed to load site rules from %s", rulesFile, exc_info=e)
+        self._local = threading.local()
+        self._countLock = threading.Lock()
+        self.hits = {}
+        self.misses = {}
+
+    def find(self, url):
+        """
+        Finds the rule of the host of a url or of one of its parent domains
+        :return: tuple of the host and its rule (or null if the site has no rule)
+        """
+        host = hostOf(url or "")
+        if host.startswith("www."):
+            host = host[len("www."):]
+        rules = getattr(self._local, "rules", None)
+        if rules is None:
+            rules = self._local.rules = {}
+
+        domain = host
+        while domain:
+            if domain in rules:
+                return host, rules[domain]
+            if domain in self.definitions:
+                rules[domain] = self._compile(domain)
+                return host, rules[domain]
+            domain = domain.partition(".")[2]
+        return host, None
+
+    def recordHit(self, host):
+        with self._countLock:
+            self.hits[host] = self.hits.get(host, 0) + 1
+
+    def recordMiss(self, host):
+        with self._countLock:
+            self.misses[host] = self.misses.get(host, 0) + 1
+
+    def logStats(self, logger: Logger, top=10):
+        """
+        Logs rule hits and misses per host. Hosts with the most misses are where adding a rule pays off the most.
+        """
+        with self._countLock:
+            hits = dict(self.hits)
+            misses = dict(self.misses)
+        for host in sorted(set(hits) | set(misses), key=lambda h: (-misses.get(h, 0), -hits.get(h, 0)))[:top]:
+            logger.info("Site rules for %s: %s hits, %s misses", host, hits.get(host, 0), misses.get(host, 0))
+
+    def _compile(self, domain):
+        definition = self.definitions[domain]
+        try:
+            return SiteRule(domain, definition["content"], definition.get("remove"))
+        except Exception as e:
+            self.logger.error("Invalid site rule for %s", domain, exc_info=e)
+            return None
+
+
+_siteRules = None
+_siteRulesLock = threading.Lock()
+
+
+def getSiteRules():
+    """
+    Gets the site rules of the current process
+    """
+    global _siteRules
+    if _siteRules is None:
+        with _siteRulesLock:
+            if _siteRules is None:
+                _siteRules = SiteRules(logging.getLogger('SiteRules'))
+    return _siteRules
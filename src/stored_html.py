@@ -0,0 +1,40 @@
+import zlib
+
+from bson.binary import Binary, USER_DEFINED_SUBTYPE
+
+from src.config import WEB_SCRAP_COMPRESSION, WEB_SCRAP_COMPRESSION_LEVEL
+
+# Stored web scraps are either plain strings (stored before compression, or with compression disabled) or binaries
+# of the user defined subtype starting with a format marker byte
+ZLIB_FORMAT = 1
+COMPRESSIONS = ("zlib", "none")
+
+
+def encodeWebScrap(html, compression=WEB_SCRAP_COMPRESSION, level=WEB_SCRAP_COMPRESSION_LEVEL):
+    """
+    Encodes a web scrap for storage
+    :param html: page in unicode (or null)
+    :param compression: "zlib" stores the utf-8 page compressed at {level}, "none" stores the page as a string
+    :return: value of the web_scrap field (or null if {html} is null)
+    """
+    if html is None or compression == "none":
+        return html
+    if compression != "zlib":
+        raise ValueError("Unknown web scrap compression '{}', expected one of {}".format(
+            compression, ", ".join(COMPRESSIONS)))
+    return Binary(bytes([ZLIB_FORMAT]) + zlib.compress(html.encode("utf-8"), level), USER_DEFINED_SUBTYPE)
+
+
+def decodeWebScrap(value):
+    """
+    Decodes a stored web scrap, compressed or plain
+    :param value: value of the web_scrap field (or null)
+    :return: page in unicode (or null if no web scrap is stored)
+    """
+    if value is None or isinstance(value, str):
+        return value
+    if not value:
+        return ""
+    if value[0] == ZLIB_FORMAT:
+        return zlib.decompress(memoryview(value)[1:]).decode("utf-8")
+    raise ValueError("Unknown web scrap format marker {}".format(value[0]))
@@ -0,0 +1,195 @@
+import pickle
+import queue
+import struct
+import threading
+import time
+from uuid import UUID
+
+from src.http_cache import Validators
+from src.mongo_service import ArticleInfo
+from src.scrap_result import ScrapResult
+
+# Ends a channel when sent in place of a batch
+_END = None
+
+# Task wire format: kind, task id, time the task was submitted, 16 byte article id, url length and failed attempts
+# (at most 255), followed by the url and the stored web scrap, the validators of the stored page or the ids of the
+# duplicates of the article
+_TASK_HEADER = struct.Struct("<BQd16sIB")
+_ARTICLE = 0
+_ARTICLE_WITH_HTML = 1
+# Articles whose id is not a UUID are pickled after the kind byte
+_PICKLED = 2
+# Compressed stored web scraps are sent as stored, so they are only decompressed by the worker
+_ARTICLE_WITH_COMPRESSED_HTML = 3
+# Validators are sent as their ETag, Last-Modified and content hash separated by new lines, which headers cannot contain
+_ARTICLE_WITH_VALIDATORS = 4
+# Duplicates are sent as their 16 byte ids
+_ARTICLE_WITH_DUPLICATES = 5
+
+# Result wire format: task id, whether a result was reported, status (-1 if none), elapsed and error length,
+# followed by the error
+_RESULT_HEADER = struct.Struct("<QBhdH")
+
+
+class BatchSender:
+    """
+    Sends items to a process queue in batches of at most {maxBatch} items from a background thread.
+    Items put while a batch is being sent are collected into the next batch, so a busy channel sends few
+    large messages and an idle channel sends each item without waiting for more.
+    """
+
+    def __init__(self, processQueue, maxBatch):
+        self.processQueue = processQueue
+        self.maxBatch = max(1, maxBatch)
+        self._items = queue.SimpleQueue()
+        self._closed = object()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+        # Statistics
+        self.itemCount = 0
+        self.batchCount = 0
+
+    def put(self, item):
+        """
+        Queues an item to be sent. Never blocks.
+        """
+        self._items.put(item)
+
+    def close(self):
+        """
+        Sends all queued items and stops the sending thread
+        """
+        self._items.put(self._closed)
+        self._thread.join()
+
+    def _run(self):
+        closed = False
+        while not closed:
+            batch = [self._items.get()]
+            while len(batch) < self.maxBatch:
+                try:
+                    batch.append(self._items.get_nowait())
+                except queue.Empty:
+                    break
+
+            if self._closed in batch:
+                closed = True
+                batch = [item for item in batch if item is not self._closed]
+            if batch:
+                self.processQueue.put(batch)
+                self.itemCount += len(batch)
+                self.batchCount += 1
+
+
+def endChannel(processQueue):
+    """
+    Signals one receiver of a process queue to stop
+    """
+    processQueue.put(_END)
+
+
+def receiveBatches(processQueue):
+    """
+    Receives items sent by BatchSender until the channel is ended
+    :return: generator of received items
+    """
+    while True:
+        try:
+            batch = processQueue.get()
+        except (EOFError, OSError):
+            # Queue has closed
+            return
+        if batch is _END:
+            return
+        yield from batch
+
+
+def encodeTask(articleInfo: ArticleInfo, taskId, submittedAt=None):
+    """
+    Encodes an article and its task id in the task wire format
+    :param submittedAt: epoch time the task was submitted, so the time it waited can be measured (default is now)
+    :return: bytes of the task
+    """
+    if submittedAt is None:
+        submittedAt = time.time()
+    idBytes = articleInfo.idBytes
+    storedHtml = articleInfo.storedHtml
+    validators = articleInfo.validators
+    duplicateIds = articleInfo.duplicateIds
+    # Only articles fetched without a stored page have duplicates, all with UUID ids unless the article is pickled
+    if idBytes is None or (duplicateIds and (storedHtml is not None or validators is not None
+                                             or not all(isinstance(value, UUID) for value in duplicateIds))):
+        return bytes([_PICKLED]) + pickle.dumps((articleInfo.articleId, articleInfo.articleUrl, storedHtml, validators,
+                                                 articleInfo.attempts, duplicateIds, taskId, submittedAt),
+                                                pickle.HIGHEST_PROTOCOL)
+
+    url = articleInfo.articleUrl.encode()
+    if storedHtml is not None:
+        kind = _ARTICLE_WITH_COMPRESSED_HTML if isinstance(storedHtml, bytes) else _ARTICLE_WITH_HTML
+    elif validators is not None:
+        kind = _ARTICLE_WITH_VALIDATORS
+    else:
+        kind = _ARTICLE_WITH_DUPLICATES if duplicateIds else _ARTICLE
+    data = _TASK_HEADER.pack(kind, taskId, submittedAt, idBytes, len(url), min(articleInfo.attempts, 255)) + url
+    if kind == _ARTICLE:
+        return data
+    if kind == _ARTICLE_WITH_DUPLICATES:
+        return data + b"".join(duplicateId.bytes for duplicateId in duplicateIds)
+    if kind == _ARTICLE_WITH_VALIDATORS:
+        return data + "\n".join(value or "" for value in (validators.etag, validators.lastModified,
+                                                           validators.contentHash)).encode()
+    return data + (bytes(storedHtml) if kind == _ARTICLE_WITH_COMPRESSED_HTML else storedHtml.encode())
+
+
+def decodeTask(data):
+    """
+    Decodes a task encoded by encodeTask
+    :return: tuple of article info, task id and epoch time the task was submitted
+    """
+    if data[0] == _PICKLED:
+        articleId, articleUrl, storedHtml, validators, attempts, duplicateIds, taskId, submittedAt = \
+            pickle.loads(data[1:])
+        return ArticleInfo(articleId, articleUrl, storedHtml, validators, attempts, duplicateIds), taskId, submittedAt
+
+    kind, taskId, submittedAt, idBytes, urlLength, attempts = _TASK_HEADER.unpack_from(data)
+    urlEnd = _TASK_HEADER.size + urlLength
+    storedHtml = None
+    validators = None
+    duplicateIds = ()
+    if kind == _ARTICLE_WITH_HTML:
+        storedHtml = data[urlEnd:].decode()
+    elif kind == _ARTICLE_WITH_COMPRESSED_HTML:
+        storedHtml = bytes(data[urlEnd:])
+    elif kind == _ARTICLE_WITH_VALIDATORS:
+        validators = Validators(*(value or None for value in data[urlEnd:].decode().split("\n")))
+    elif kind == _ARTICLE_WITH_DUPLICATES:
+        duplicateIds = [UUID(bytes=bytes(data[start:start + 16])) for start in range(urlEnd, len(data), 16)]
+    articleInfo = ArticleInfo.fromIdBytes(idBytes, data[_TASK_HEADER.size:urlEnd].decode(), storedHtml, validators,
+                                          attempts, duplicateIds)
+    return articleInfo, taskId, submittedAt
+
+
+def encodeResult(taskId, result: ScrapResult):
+    """
+    Encodes the result of a task in the result wire format
+    :return: bytes of the result
+    """
+    if result is None:
+        return _RESULT_HEADER.pack(taskId, 0, -1, 0.0, 0)
+    error = (result.error or "").encode()[:0xFFFF]
+    status = -1 if result.status is None else result.status
+    return _RESULT_HEADER.pack(taskId, 1, status, result.elapsed or 0.0, len(error)) + error
+
+
+def decodeResult(data):
+    """
+    Decodes a result encoded by encodeResult
+    :return: tuple of task id and ScrapResult (or null if the task reported no result)
+    """
+    taskId, hasResult, status, elapsed, errorLength = _RESULT_HEADER.unpack_from(data)
+    if not hasResult:
+        return taskId, None
+    error = data[_RESULT_HEADER.size:_RESULT_HEADER.size + errorLength].decode() if errorLength else None
+    return taskId, ScrapResult(None if status < 0 else status, error, elapsed)
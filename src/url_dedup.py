@@ -0,0 +1,199 @@
+import threading
+import time
+from datetime import datetime, timezone
+from urllib.parse import urlsplit, urlunsplit
+
+import reactivex as rx
+from reactivex.disposable import Disposable
+
+from src.config import TRACKING_PARAMETERS, WRITE_FLUSH_INTERVAL
+
+# Ports left out of canonical urls
+DEFAULT_PORTS = {"http": 80, "https": 443}
+# Duplicates are copied from the article fetched for them once its write is found. Articles whose write is still
+# missing after this many seconds were not written (such as a worker lost while writing), their duplicates are left
+# for a later run
+COPY_TIMEOUT = max(60.0, 10 * WRITE_FLUSH_INTERVAL)
+
+# States of the article fetched for a url
+QUEUED = "queued"
+STARTED = "started"
+DONE = "done"
+
+
+def isTrackingParameter(name, trackingParameters=TRACKING_PARAMETERS):
+    """
+    :param name: name of a query parameter
+    :return: if the parameter is one of {trackingParameters}, or starts with a prefix ending with *
+    """
+    name = name.lower()
+    return any(name.startswith(parameter[:-1]) if parameter.endswith("*") else name == parameter
+               for parameter in trackingParameters)
+
+
+def canonicalUrl(url, trackingParameters=TRACKING_PARAMETERS):
+    """
+    Converts a link to the form shared by links of the same page: the scheme and host are lower case, the host has no
+    trailing dot nor default port, the path is at least "/", and the fragment and tracking parameters are removed.
+    Other query parameters are kept in their order.
+    :return: canonical url (or the url as it is if it cannot be parsed)
+    """
+    url = url.strip()
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        return url
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").rstrip(".")
+    if ":" in host:
+        host = "[{}]".format(host)
+    if port is not None and DEFAULT_PORTS.get(scheme) != port:
+        host = "{}:{}".format(host, port)
+    if parts.username is not None:
+        host = "{}@{}".format(parts.netloc.rpartition("@")[0], host)
+    query = "&".join(parameter for parameter in parts.query.split("&")
+                     if parameter and not isTrackingParameter(parameter.split("=", 1)[0], trackingParameters))
+    return urlunsplit((scheme, host, parts.path or "/", query, ""))
+
+
+def _now():
+    """
+    :return: current time as stored by mongo: naive utc, truncated to milliseconds
+    """
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+
+class UrlGroup:
+    """
+    Articles of a run sharing a canonical url. Only the first article is fetched, the others are its duplicates.
+    Duplicates found while the article is queued are sent with it and written by the worker with the article,
+    duplicates found later are copied from the article once it is written.
+    """
+    __slots__ = ("article", "state", "startedAt", "result", "observers", "late")
+
+    def __init__(self, article):
+        self.article = article
+        self.state = QUEUED
+        self.startedAt = None  # time the article was submitted to the processor, as stored by mongo
+        self.result = None
+        self.observers = []  # observers of duplicates waiting for the result of the article
+        self.late = []  # ids of duplicates to copy from the article
+
+
+class UrlRegistry:
+    """
+    Tracks the canonical urls of the articles of a run, so each url is fetched and extracted once.
+    Articles with a stored page are not tracked, they are revalidated against their own page.
+    """
+
+    def __init__(self, trackingParameters=TRACKING_PARAMETERS):
+        self.trackingParameters = trackingParameters
+        self._groups = {}
+        self._lock = threading.Lock()
+        # Groups with duplicates to copy, as (article id, time the article was submitted, duplicate ids, found at)
+        self._copies = []
+
+    def reset(self):
+        """
+        Forgets the urls of the previous run. Duplicates still to be copied are kept.
+        """
+        with self._lock:
+            self._groups = {}
+
+    def join(self, article):
+        """
+        Adds an article to the group of its url, the first article of a url is the one fetched for the group
+        :return: tuple of the group (or null if the article is not tracked) and whether the article is fetched
+        """
+        if article.storedHtml is not None or article.validators is not None:
+            return None, True
+        key = canonicalUrl(article.articleUrl, self.trackingParameters)
+        with self._lock:
+            group = self._groups.get(key)
+            if group is None:
+                self._groups[key] = UrlGroup(article)
+                return None, True
+            if group.state == QUEUED:
+                group.article.duplicateIds = group.article.duplicateIds + (article.articleId,)
+            else:
+                group.late.append(article.articleId)
+                if group.state == DONE:
+                    self._queueCopy(group)
+            return group, False
+
+    def start(self, article):
+        """
+        Marks a tracked article as submitted to the processor. Duplicates found from now on are copied from it.
+        """
+        if article.storedHtml is not None or article.validators is not None:
+            return
+        with self._lock:
+            group = self._groups.get(canonicalUrl(article.articleUrl, self.trackingParameters))
+            if group is not None and group.article is article:
+                group.state = STARTED
+                group.startedAt = _now()
+
+    def complete(self, article, result):
+        """
+        Completes the group of a tracked article with its result, and the duplicates waiting for it
+        :param result: ScrapResult of the article (or null if none was reported)
+        """
+        if article.storedHtml is not None or article.validators is not None:
+            return
+        with self._lock:
+            group = self._groups.get(canonicalUrl(article.articleUrl, self.trackingParameters))
+            if group is None or group.article is not article:
+                return
+            group.state = DONE
+            group.result = result
+            observers = group.observers
+            group.observers = []
+            self._queueCopy(group)
+        for observer in observers:
+            observer.on_next(result)
+            observer.on_completed()
+
+    def waitFor(self, group: UrlGroup):
+        """
+        :return: Observable that emits the ScrapResult of the article fetched for a group once it completes
+        """
+        def subscribe(observer, scheduler=None):
+            with self._lock:
+                done = group.state == DONE
+                if not done:
+                    group.observers.append(observer)
+            if done:
+                observer.on_next(group.result)
+                observer.on_completed()
+            return Disposable()
+
+        return rx.create(subscribe)
+
+    def takeCopies(self):
+        """
+        :return: list of (article id, time the article was submitted, duplicate ids, time found) of the duplicates to
+        copy, which are no longer tracked
+        """
+        with self._lock:
+            copies = self._copies
+            self._copies = []
+            return copies
+
+    def returnCopies(self, copies):
+        """
+        Tracks again the duplicates of articles that are not written yet, unless they waited {COPY_TIMEOUT} seconds
+        :return: number of duplicates left for a later run
+        """
+        now = time.monotonic()
+        kept = [copy for copy in copies if now - copy[3] < COPY_TIMEOUT]
+        with self._lock:
+            self._copies.extend(kept)
+        return sum(len(copy[2]) for copy in copies) - sum(len(copy[2]) for copy in kept)
+
+    def _queueCopy(self, group):
+        # Articles that were never submitted or did not report a result were not written
+        if group.late and group.startedAt is not None and group.result is not None:
+            self._copies.append((group.article.articleId, group.startedAt, group.late, time.monotonic()))
+        group.late = []
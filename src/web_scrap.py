@@ -1,5 +1,13 @@
+import asyncio
+import itertools
+import logging
 import threading
+import time
+import uuid
+from concurrent.futures import wait
 from logging import Logger
+import aiohttp
+from bson.binary import Binary
 import reactivex as rx
 from reactivex import operators as ops
 from reactivex.subject import Subject
@@ -8,47 +16,86 @@ import html
 import re
 import requests
 import warnings
-from readability import Document
 
 
+from src.charset import decodeHtml, detectEncoding, charsetFromContentType
 from src.config import *
+from src.domain_scheduler import DomainScheduler
+from src.exceptions import WebScrapException, SkippedContentException, WatermarkFieldException
+from src.extractors import getExtractor
+from src.metrics import getMetrics, statusClass, STAGE_SECONDS, FETCH, EXTRACT, HTTP_RESPONSES, DOWNLOADED_BYTES, \
+    ARTICLES_COMPLETED, LIMITED_DOWNLOADS, REVALIDATIONS, RESPONSE_CACHE, FETCH_FAILURES, DUPLICATE_ARTICLES, \
+    EXTRACTIONS
+from src.scrap_result import ScrapResult, SKIPPED, TRUNCATED, NO_TEXT
+from src.pipeline_stage import PipelineStage
+from src.stored_html import decodeWebScrap
+from src.retry_policy import failureOutcome, nextAttempt, RETRY
+from src.http_cache import Validators, getResponseCache, NOT_MODIFIED, UNCHANGED, CHANGED, CACHE_HIT, \
+    CACHE_REVALIDATED, CACHE_MISS
+from src.http_session import getSession, createAsyncConnector, createAsyncTraceConfig
+from src.url_dedup import UrlRegistry
 
+# Bytes read at a time from the stream of a page
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# Outcomes of duplicate articles: written by the worker with the article fetched for them, or copied from it
+FANNED_OUT = "fanned_out"
+COPIED = "copied"
+# Outcome of the extraction of pages with article text, pages without any are counted as NO_TEXT
+TEXT = "text"
 
 class WebScrap:
     """
     Class for Web Scraping articles
     """
 
-    def __init__(self, logger: Logger, mongoService, scheduler, webScrapProcessor):
+    def __init__(self, logger: Logger, mongoService, scheduler, webScrapProcessor, reprocess=False,
+                 dedupUrls=DEDUP_URLS):
+        """
+        :param reprocess: extract clean text from stored web scraps instead of fetching articles again
+        :param dedupUrls: fetch articles with the same canonical url once per run, see src.url_dedup
+        """
         self.completeSubject = Subject()
-        self.countingLock = threading.Lock()
+        # Counting with itertools.count does not take a lock
+        self._articleCounter = itertools.count(1)
         self.articleCount = 0
         self.scrapLock = threading.Lock()
         self.articleScrapCount = 0
+        # Limits articles read from the db but not yet processed so the stream does not buffer the whole backlog
+        self.pendingSemaphore = threading.BoundedSemaphore(MAX_PENDING_ARTICLES)
+        # Limits articles of saturated hosts waiting in their host queue, which do not take a pending slot
+        self.setAsideSemaphore = threading.BoundedSemaphore(MAX_SET_ASIDE_ARTICLES)
 
         self.mongoService = mongoService
         self.scheduler = scheduler
         self.logger = logger
         self.webScrapProcessor = webScrapProcessor
+        self.reprocess = reprocess
+        self.urlRegistry = UrlRegistry() if dedupUrls else None
+        self.domainScheduler = DomainScheduler(self.startArticle, logging.getLogger('DomainScheduler'), scheduler)
 
     def complete(self):
         """
         Called when web scrap is complete. Logs completed articles and unblocks main thread
         """
+        # All articles were counted once the stream completes
+        self.articleCount = next(self._articleCounter) - 1
         self.logger.info("Completed extraction for %s articles", self.articleCount)
+        skipCounts = self.domainScheduler.circuitBreaker.getSkipCounts()
+        if skipCounts:
+            self.logger.info("Skipped %s articles of unavailable hosts: %s", sum(skipCounts.values()),
+                             ", ".join("{} ({})".format(host, count) for host, count in sorted(skipCounts.items())))
         self.completeSubject.on_next(1)
         self.completeSubject.on_completed()
 
     def countAndLog(self):
         """
         Counts articles that goes through the stream. Logs based off the frequency defined in {LOG_FREQUENCY}.
-        Is a synchronous function that only allows 1 thread to execute.
+        Time spent in each stage is recorded by the metrics of the processes, see src.metrics.
         """
-        # Avoid race conditions by adding a lock
-        with self.countingLock:
-            self.articleCount += 1
-            if self.articleCount % LOG_FREQUENCY == 0:
-                self.logger.info("Completed web scraping for %s articles", self.articleCount)
+        count = next(self._articleCounter)
+        getMetrics().increment(ARTICLES_COMPLETED)
+        if count % LOG_FREQUENCY == 0:
+            self.logger.info("Completed web scraping for %s articles", count)
 
     def run(self):
         """
@@ -63,15 +110,88 @@ class WebScrap:
             ops.do_action(on_error=lambda err: self.logger.error("Error occurred during web scraping", exc_info=err))
         ).run()
 
-    def buildWebScrapPipeline(self):
+    def runDaemon(self, stopEvent: threading.Event, pollInterval=POLL_INTERVAL, fullSweepInterval=FULL_SWEEP_INTERVAL):
+        """
+        Web scraps new articles until {stopEvent} is set, keeping the worker processes and host limits warm.
+        Every {pollInterval} seconds, articles inserted after the high-water mark are processed: the articles that
+        require web scraping with a {WATERMARK_FIELD} value above the mark and up to the latest value, read just before.
+        The mark is then moved to that value and saved, so only new articles are read and restarts continue from it.
+        A full sweep of all articles that require web scraping runs on startup without a saved mark and then every
+        {fullSweepInterval} seconds, to retry failed articles and find articles the mark missed.
+        Raises WatermarkFieldException on startup if {WATERMARK_FIELD} cannot find new articles, see
+        checkWatermarkField.
+        """
+        self.checkWatermarkField()
+        watermark = self.mongoService.loadWatermark()
+        lastSweep = time.monotonic() if watermark is not None else None
+        warnedMissingField = False
+        self.logger.info("Polling for new articles every %s seconds from %s %s", pollInterval, WATERMARK_FIELD,
+                         watermark)
+
+        while not stopEvent.is_set():
+            try:
+                latest = self.mongoService.latestWatermark()
+                if latest is None and not warnedMissingField:
+                    self.logger.warning("No article has a %s field, new articles are only found by full sweeps",
+                                        WATERMARK_FIELD)
+                    warnedMissingField = True
+
+                if lastSweep is None or time.monotonic() - lastSweep >= fullSweepInterval:
+                    lastSweep = time.monotonic()
+                    self.logger.info("Starting full sweep of articles to web scrap")
+                    self.runPass(stopEvent)
+                elif latest is not None and latest != watermark:
+                    self.runPass(stopEvent, (watermark, latest))
+
+                # Only move the mark past articles that were all read, a pass cut short by a stop is read again
+                if latest is not None and latest != watermark and not stopEvent.is_set():
+                    self.mongoService.saveWatermark(latest)
+                    watermark = latest
+                self.copyDuplicates()
+            except Exception as e:
+                self.logger.error("Error occurred while polling for articles", exc_info=e)
+            stopEvent.wait(pollInterval)
+
+        self.complete()
+
+    def checkWatermarkField(self):
+        """
+        Checks that {WATERMARK_FIELD} can find new articles. The articles must have the field and its values must
+        increase with insertion, which UUID ids are not as they are random. An empty collection is not checked.
+        """
+        latest = self.mongoService.latestWatermark()
+        if latest is None and self.mongoService.hasArticles():
+            raise WatermarkFieldException(WATERMARK_FIELD, "no article has the field")
+        if isinstance(latest, (uuid.UUID, Binary)):
+            raise WatermarkFieldException(WATERMARK_FIELD, "its values are UUIDs, which are random")
+
+    def runPass(self, stopEvent: threading.Event = None, window=None):
+        """
+        Web scraps the articles that require it and blocks until they are processed.
+        Reading stops early when {stopEvent} is set, articles already read are still processed.
+        :param window: (lower, upper) bounds of {WATERMARK_FIELD} to only read articles inserted in between
+        :return: number of articles processed
+        """
+        return self.buildWebScrapPipeline(window, stopEvent).pipe(ops.count()).run()
+
+    def buildWebScrapPipeline(self, window=None, stopEvent: threading.Event = None):
         """
         Builds observable stream for web scraping
+        :param window: (lower, upper) bounds of {WATERMARK_FIELD} to only read articles inserted in between
+        :param stopEvent: stops reading articles when set
         :return: Observable containing Web Scrap pipeline
         """
+        if self.urlRegistry is not None:
+            self.urlRegistry.reset()
         # Call Mongo to get web scrap ids
-        return self.mongoService.getNonWebScrapArticleAsStream().pipe(
+        articles = self.mongoService.getNonWebScrapArticleAsStream(includeStoredHtml=self.reprocess, window=window)
+        return articles.pipe(
+            ops.take_while(lambda article: stopEvent is None or not stopEvent.is_set()),
+            # Block reading from the db while {MAX_PENDING_ARTICLES} articles are waiting to be processed, or while
+            # {MAX_SET_ASIDE_ARTICLES} articles of saturated hosts are
+            ops.map(lambda article: (article, self.acquireSlot(article))),
             # web scrap content
-            ops.flat_map(lambda article: self.submitArticleToProcessor(article)),
+            ops.flat_map(lambda item: self.submitArticleToProcessor(*item)),
             # Counts article
             ops.do_action(on_next=lambda article: self.countAndLog()),
             # Error handling
@@ -81,30 +201,361 @@ class WebScrap:
             ops.subscribe_on(scheduler=self.scheduler),
         )
 
-    def submitArticleToProcessor(self, article):
-        return rx.of(article).pipe(
-            ops.do_action(on_next=lambda a: self.webScrapProcessor.submitArticle(a)),
+    def acquireSlot(self, article):
+        """
+        Takes a pending slot for an article, blocking until one is free. Articles of hosts with {HOST_MAX_PENDING}
+        pending articles take a set aside slot instead, so one slow host cannot take all {MAX_PENDING_ARTICLES} slots
+        and stop reading. They wait in the queue of their host like the other articles of the host.
+        Reprocessed articles are not fetched, so host limits do not apply.
+        :return: if the article was set aside
+        """
+        if article.storedHtml is not None or self.domainScheduler.reservePending(article):
+            self.pendingSemaphore.acquire()
+            return False
+        self.setAsideSemaphore.acquire()
+        return True
+
+    def releaseSlot(self, article, setAside):
+        """
+        Frees the slot of a processed article, see acquireSlot
+        """
+        if setAside:
+            self.setAsideSemaphore.release()
+            return
+        if article.storedHtml is None:
+            self.domainScheduler.releasePending(article)
+        self.pendingSemaphore.release()
+
+    def submitArticleToProcessor(self, article, setAside=False):
+        if self.urlRegistry is not None:
+            group, fetched = self.urlRegistry.join(article)
+            if not fetched:
+                # Duplicates complete with the article fetched for their url
+                return self.urlRegistry.waitFor(group).pipe(
+                    ops.finally_action(lambda: self.releaseSlot(article, setAside)))
+
+        if article.storedHtml is not None:
+            # Reprocessed articles are not fetched, so host limits do not apply
+            submitted = rx.defer(lambda scheduler: rx.from_future(self.webScrapProcessor.submitArticle(article)))
+        else:
+            # Articles are submitted to the processor once the limits of their host allow it
+            submitted = self.domainScheduler.schedule(article)
+        if self.urlRegistry is not None:
+            submitted = submitted.pipe(
+                ops.do_action(on_next=lambda result: self.completeArticle(article, result),
+                              on_error=lambda err: self.completeArticle(article, None)))
+        return submitted.pipe(
             ops.do_action(on_error=lambda err: self.logger.error("Error occurred.", exc_info=err)),
             ops.catch(rx.empty()),
+            ops.finally_action(lambda: self.releaseSlot(article, setAside)),
             # Scheduler setup for entire stream
             ops.subscribe_on(scheduler=self.scheduler),
         )
 
+    def startArticle(self, article):
+        """
+        Submits an article to the processor once the limits of its host allow it
+        :return: Future of the ScrapResult of the article
+        """
+        if self.urlRegistry is not None:
+            self.urlRegistry.start(article)
+        return self.webScrapProcessor.submitArticle(article)
+
+    def completeArticle(self, article, result):
+        """
+        Completes the duplicates of an article waiting for its result
+        :param result: ScrapResult of the article (or null if it did not report one)
+        """
+        if article.duplicateIds and result is not None:
+            getMetrics().increment(DUPLICATE_ARTICLES, len(article.duplicateIds), FANNED_OUT)
+        self.urlRegistry.complete(article, result)
 
-def get_raw_page(url, logger: Logger):
+    def copyDuplicates(self, final=False):
+        """
+        Copies the fetch results of articles to the duplicates found after they were submitted. Duplicates of articles
+        whose write is not found yet are copied by a later call, see src.url_dedup.
+        :param final: workers have written all their updates, duplicates not copied now are left for a later run
+        """
+        if self.urlRegistry is None:
+            return
+        copies = self.urlRegistry.takeCopies()
+        if not copies:
+            return
+        try:
+            written, waiting = self.mongoService.copyFetchResults(copies)
+        except Exception as e:
+            self.logger.error("Failed to copy articles to their duplicates", exc_info=e)
+            written, waiting = 0, copies
+        if written:
+            getMetrics().increment(DUPLICATE_ARTICLES, written, COPIED)
+            self.logger.info("Copied fetched articles to %s duplicate articles", written)
+        left = sum(len(copy[2]) for copy in waiting) if final else self.urlRegistry.returnCopies(waiting)
+        if left:
+            self.logger.warning("Left %s duplicate articles for a later run, their article was not written", left)
+
+
+class RawPage:
     """
-    Get raw web scrap page for given url
+    Downloaded page of an article. Its bytes are decoded when its text is first read, so pages fetched on the event
+    loop are decoded on the extraction stage.
+    """
+    __slots__ = ("body", "headerCharset", "validators", "notModified", "_text", "_encoding")
+
+    def __init__(self, body: bytes, headerCharset: str = None, validators: Validators = None, notModified=False):
+        """
+        :param headerCharset: charset of the content type header (or null if it has none)
+        :param validators: ETag, Last-Modified and content hash of the page
+        :param notModified: the stored page of the article was not modified, the page has no body
+        """
+        self.body = body
+        self.headerCharset = headerCharset
+        self.validators = validators
+        self.notModified = notModified
+        self._text = None
+        self._encoding = None
+
+    @property
+    def text(self):
+        """
+        Page in unicode, decoded with the encoding found by src.charset.decodeHtml
+        """
+        if self._text is None:
+            self._text, self._encoding = decodeHtml(self.body, self.headerCharset)[:2]
+        return self._text
+
+    @property
+    def encoding(self):
+        """
+        Codec name of the page, found from its headers and declarations without decoding it when possible
+        """
+        if self._encoding is None:
+            self._encoding = detectEncoding(self.body, self.headerCharset)[0]
+            if self._encoding is None:
+                # Pages without declared encoding are detected while decoding
+                self.text
+        return self._encoding
+
+
+def get_raw_page(url, logger: Logger, session: requests.Session = None, result: ScrapResult = None):
+    """
+    Get raw web scrap page for given url. The page is downloaded as a stream of at most {MAX_DOWNLOAD_BYTES}.
     :param url: the url of the page to web scrap
+    :param session: session used for the request (default is the pooled session of the process)
+    :param result: records pages that were skipped or truncated when given
     :return: web scrap page in unicode
+    :raises SkippedContentException: if the content type of the page is not in {ALLOWED_CONTENT_TYPES}
+    """
+    return fetchPage(url, logger, session, result).text
+
+
+def fetchPage(url, logger: Logger, session: requests.Session = None, result: ScrapResult = None,
+              validators: Validators = None):
+    """
+    Downloads the page of a url as a stream of at most {MAX_DOWNLOAD_BYTES}, see get_raw_page.
+    The request is conditional on the validators of the stored page of the article, or of the cached response.
+    :param validators: validators of the stored page of the article (or null if it has none)
+    :return: RawPage of the url, marked not modified when the stored page of the article is still current
+    """
+    cache, cached, headers = prepareRequest(url, validators)
+    if cached is not None and cached.isFresh(cache.ttl):
+        return cachedPage(cached, CACHE_HIT)
+
+    start = time.perf_counter()
+    try:
+        page = (session or getSession()).get(url, timeout=(REQUEST_CONNECT_TIMEOUT, REQUEST_READ_TIMEOUT),
+                                             stream=True, headers=headers)
+    except Exception:
+        recordFetch(start, None, 0)
+        raise
+    # Closing a streamed response that was not fully read closes its connection instead of reusing it
+    with page:
+        if page.status_code == 304 and headers:
+            recordFetch(start, page.status_code, 0)
+            return notModifiedPage(url, logger, validators, cache, cached)
+        if page.status_code != 200:
+            recordFetch(start, page.status_code, 0)
+            logger.error("Web scrapping failed (status %s): %s", page.status_code, url)
+            raise WebScrapException(url, page.status_code)
+        try:
+            contentType = checkContentType(url, page.headers.get("Content-Type"), logger, result)
+        except SkippedContentException:
+            recordFetch(start, page.status_code, 0)
+            raise
+        body = bytearray()
+        try:
+            for chunk in page.iter_content(DOWNLOAD_CHUNK_SIZE):
+                body += chunk
+                if len(body) > MAX_DOWNLOAD_BYTES:
+                    break
+        except Exception:
+            recordFetch(start, None, len(body))
+            raise
+    recordFetch(start, page.status_code, len(body))
+    rawPage = downloadedPage(limitPage(url, body, contentType, logger, result),
+                             charsetFromContentType(page.headers.get("Content-Type")), page.headers, cache)
+    if cache is not None:
+        cache.put(url, rawPage.body, rawPage.headerCharset, rawPage.validators)
+    return rawPage
+
+async def get_raw_page_async(url, logger: Logger, session: aiohttp.ClientSession, result: ScrapResult = None):
+    """
+    Get raw web scrap page for given url without blocking the event loop.
+    The page is downloaded as a stream of at most {MAX_DOWNLOAD_BYTES}.
+    :param url: the url of the page to web scrap
+    :param session: aiohttp session used for the request
+    :param result: records pages that were skipped or truncated when given
+    :return: web scrap page in unicode
+    :raises SkippedContentException: if the content type of the page is not in {ALLOWED_CONTENT_TYPES}
+    """
+    return (await fetchPageAsync(url, logger, session, result)).text
+
+
+async def fetchPageAsync(url, logger: Logger, session: aiohttp.ClientSession, result: ScrapResult = None,
+                         validators: Validators = None):
+    """
+    Downloads the page of a url as a stream of at most {MAX_DOWNLOAD_BYTES} without blocking the event loop,
+    see get_raw_page_async and fetchPage
+    :param validators: validators of the stored page of the article (or null if it has none)
+    :return: RawPage of the url, decoded when its text is read
+    """
+    cache = getResponseCache()
+    if cache is not None:
+        # Cached responses are read from disk off the event loop
+        cache, cached, headers = await asyncio.to_thread(prepareRequest, url, validators)
+        if cached is not None and cached.isFresh(cache.ttl):
+            return cachedPage(cached, CACHE_HIT)
+    else:
+        cache, cached, headers = prepareRequest(url, validators)
+
+    timeout = aiohttp.ClientTimeout(sock_connect=REQUEST_CONNECT_TIMEOUT, sock_read=REQUEST_READ_TIMEOUT)
+    start = time.perf_counter()
+    body = bytearray()
+    try:
+        async with session.get(url, timeout=timeout, headers=headers) as page:
+            if page.status == 304 and headers:
+                recordFetch(start, page.status, 0)
+                if cache is not None:
+                    return await asyncio.to_thread(notModifiedPage, url, logger, validators, cache, cached)
+                return notModifiedPage(url, logger, validators, cache, cached)
+            if page.status != 200:
+                recordFetch(start, page.status, 0)
+                logger.error("Web scrapping failed (status %s): %s", page.status, url)
+                raise WebScrapException(url, page.status)
+            try:
+                contentType = checkContentType(url, page.headers.get("Content-Type"), logger, result)
+            except SkippedContentException:
+                recordFetch(start, page.status, 0)
+                raise
+            async for chunk in page.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                body += chunk
+                if len(body) > MAX_DOWNLOAD_BYTES:
+                    # Releasing a response that was not fully read closes its connection
+                    page.close()
+                    break
+    except WebScrapException:
+        raise
+    except Exception:
+        recordFetch(start, None, len(body))
+        raise
+    recordFetch(start, page.status, len(body))
+    rawPage = downloadedPage(limitPage(url, body, contentType, logger, result), page.charset, page.headers, cache)
+    if cache is not None:
+        await asyncio.to_thread(cache.put, url, rawPage.body, rawPage.headerCharset, rawPage.validators)
+    return rawPage
+
+
+def prepareRequest(url, validators: Validators = None):
+    """
+    Finds the cached response of a url and the conditional headers of its request. Requests are conditional on the
+    validators of the stored page of the article, or on those of the cached response when the article has none.
+    :param validators: validators of the stored page of the article (or null if it has none)
+    :return: tuple of the response cache (or null if disabled), the cached response (or null if not cached) and the
+    conditional headers (or null if the request is not conditional)
+    """
+    cache = getResponseCache()
+    cached = cache.get(url) if cache is not None else None
+    if not CONDITIONAL_REQUESTS:
+        return cache, cached, None
+    headers = validators.conditionalHeaders() if validators is not None else {}
+    if not headers and cached is not None:
+        headers = cached.validators.conditionalHeaders()
+    return cache, cached, headers or None
+
+
+def notModifiedPage(url, logger: Logger, validators: Validators, cache, cached):
+    """
+    Creates the page of a 304 response to a request made by prepareRequest
+    :return: RawPage marked not modified when the validators of the article were sent, else the cached response
+    """
+    if validators is not None and validators.conditionalHeaders():
+        logger.debug("Page not modified: %s", url)
+        return RawPage(b"", None, validators, notModified=True)
+    cache.refresh(url, cached)
+    return cachedPage(cached, CACHE_REVALIDATED)
+
+
+def cachedPage(cached, outcome):
+    """
+    :param outcome: CACHE_HIT or CACHE_REVALIDATED
+    :return: RawPage of a cached response
+    """
+    getMetrics().increment(RESPONSE_CACHE, label=outcome)
+    return RawPage(cached.body, cached.charset, cached.validators)
+
+
+def downloadedPage(body, charset, headers, cache):
     """
-    page = requests.get(url, timeout=REQUEST_TIMEOUT)
-    if page.status_code != 200:
-        logger.error("Web scrapping failed (status %s): %s", page.status_code, url)
-        raise Exception("Web scrapping failed (status " + str(page.status_code) + "):" + url)
+    :param headers: headers of the response, its ETag and Last-Modified validate the page
+    :return: RawPage of a downloaded response
+    """
+    if cache is not None:
+        getMetrics().increment(RESPONSE_CACHE, label=CACHE_MISS)
+    return RawPage(body, charset, Validators.fromResponse(headers, body))
+
+
+def checkContentType(url, contentType, logger: Logger, result: ScrapResult = None):
+    """
+    Checks the content type header of a page before its body is downloaded
+    :param contentType: value of the content type header (or null if missing, which is allowed)
+    :return: media type of the page (or null if missing)
+    :raises SkippedContentException: if the media type is not in {ALLOWED_CONTENT_TYPES}
+    """
+    if not contentType:
+        return None
+    mediaType = contentType.split(";", 1)[0].strip().lower()
+    if mediaType in ALLOWED_CONTENT_TYPES:
+        return mediaType
+    logger.debug("Skipped %s page: %s", mediaType, url)
+    getMetrics().increment(LIMITED_DOWNLOADS, label=SKIPPED)
+    if result is not None:
+        result.recordLimited(SKIPPED, mediaType)
+    raise SkippedContentException(url, mediaType)
 
-    # page.text is the content of the response in Unicode
-    # page.content is the content of the response in bytes
-    return page.text
+
+def limitPage(url, body, contentType, logger: Logger, result: ScrapResult = None):
+    """
+    Cuts off a page downloaded past {MAX_DOWNLOAD_BYTES}. Readers stop one chunk after the limit.
+    :return: bytes of the page
+    """
+    if len(body) <= MAX_DOWNLOAD_BYTES:
+        return bytes(body)
+    logger.debug("Truncated page at %s bytes: %s", MAX_DOWNLOAD_BYTES, url)
+    getMetrics().increment(LIMITED_DOWNLOADS, label=TRUNCATED)
+    if result is not None:
+        result.recordLimited(TRUNCATED, contentType)
+    return bytes(body[:MAX_DOWNLOAD_BYTES])
+
+
+def recordFetch(start, status, size):
+    """
+    Records the time, status class and downloaded bytes of a request started at {start} (perf_counter)
+    :param status: http status (or null if no response was received)
+    """
+    metrics = getMetrics()
+    metrics.observe(STAGE_SECONDS, time.perf_counter() - start, FETCH)
+    metrics.increment(HTTP_RESPONSES, label=statusClass(status))
+    if size:
+        metrics.increment(DOWNLOADED_BYTES, size)
 
 def html_escape(html_content):
      # convert to HTML-safe sequence
@@ -132,26 +583,41 @@ def remove_ads(page_content):
     return soup.prettify()
     
 
-def extract_full_text_from_html(html_content):
+def extract_full_text_from_html(html_content, url=None, encoding=None):
     """
     Extracts and cleans main text content by targeting the specific article container
-    on The Hacker News (and similar sites).
+    on The Hacker News (and similar sites). Uses the engine defined in {EXTRACTOR_ENGINE}.
+    :param html_content: html page as text, or as bytes in {encoding} which are parsed without decoding them
+    :param url: url of the page, sites with an extraction rule are extracted with their rule
     """
+    start = time.perf_counter()
+    try:
+        return getExtractor().extract(html_content, url, encoding)
+    finally:
+        getMetrics().observe(STAGE_SECONDS, time.perf_counter() - start, EXTRACT)
 
-    doc = Document(html_content)
-    html = doc.summary()  # returns main article html
-    soup = BeautifulSoup(html, "html.parser")
-    text = soup.get_text(separator="\n", strip=True)
-    return text
-
-def web_scrap(url, logger: Logger, scheduler):
+def web_scrap(url, logger: Logger, scheduler, result: ScrapResult = None, validators: Validators = None):
     """
     Web scrap given article page
     :param url: the url of the page to web scrap
-    :return: html web scraped page content (or null if web scrap failed)
+    :param result: records the status and fetch time of the request when given
+    :param validators: validators of the stored page of the article, the request is conditional on them
+    :return: RawPage of the web scraped page (or null if web scrap failed)
     """
+    def fetch(url):
+        start = time.perf_counter()
+        try:
+            page = fetchPage(url, logger, result=result, validators=validators)
+        except Exception as err:
+            if result is not None:
+                result.recordFailure(err, time.perf_counter() - start)
+            raise
+        if result is not None:
+            result.recordSuccess(time.perf_counter() - start)
+        return page
+
     return rx.of(url).pipe(
-        ops.map(lambda url: get_raw_page(url, logger)),  # raw HTML
+        ops.map(fetch),  # raw page
         ops.catch(rx.of(None)),
         ops.subscribe_on(scheduler))
 
@@ -161,28 +627,293 @@ def logIfFailed(result, url, logger: Logger):
         logger.error('Web scrap failed (return null) : %s', url)
 
 
-def webScrap(article, logger: Logger, mongoService, scheduler):
+def saveWebScrap(article, page: RawPage, mongoService, result: ScrapResult = None):
+    """
+    Saves the outcome of the fetch of an article with its fetch time, to the article and its duplicates, see savePage.
+    Pages that are the stored page of the article only save what the article lacks, without a fetch time, see
+    saveUnchangedPage.
+    :param article: article that was web scraped
+    :param page: raw page (or null if web scrap failed)
+    :param result: result of the fetch
+    """
+    if page is not None and isUnchanged(article, page):
+        saveUnchangedPage(article, page, mongoService)
+        return
+    if article.duplicateIds:
+        mongoService.setDuplicates(article.articleId, article.duplicateIds)
+    try:
+        mongoService.insertFetchTime(article.articleId)
+        savePage(article, page, mongoService, result)
+    finally:
+        if article.duplicateIds:
+            mongoService.clearDuplicates(article.articleId)
+
+
+def savePage(article, page: RawPage, mongoService, result: ScrapResult = None):
+    """
+    Saves the raw page of an article, then extracts and saves its cleaned full text, see saveCleanText.
+    The text is extracted from the bytes of the page, the parser decodes them itself.
+    :param article: article that was web scraped
+    :param page: raw page (or null if web scrap failed, the failure is saved instead)
+    :param result: result of the fetch, pages that were skipped or truncated are marked on the article
+    """
+    if page is None:
+        if result is not None and result.fetchStatus is not None:
+            mongoService.insertFetchStatus(article.articleId, result.fetchStatus, result.contentType)
+        else:
+            saveFetchFailure(article, mongoService, result)
+        return
+    if article.attempts:
+        mongoService.clearFetchFailure(article.articleId)
+    mongoService.insertWebScrapArticle(article.articleId, page.text)
+    if result is not None and result.fetchStatus is not None:
+        mongoService.insertFetchStatus(article.articleId, result.fetchStatus, result.contentType)
+    if page.validators is not None:
+        mongoService.insertValidators(article.articleId, page.validators)
+    saveCleanText(article, extract_full_text_from_html(page.body, article.articleUrl, page.encoding)
+                  if page.body else None, mongoService)
+
+
+def saveCleanText(article, cleanText, mongoService):
+    """
+    Saves the cleaned full text extracted for an article. Articles whose page has no article text are marked instead,
+    so they are not scraped again on every run, only by reprocess mode. Both outcomes are counted.
+    :param cleanText: extracted text (or null or empty if the page has none)
+    """
+    getMetrics().increment(EXTRACTIONS, label=TEXT if cleanText else NO_TEXT)
+    if cleanText:
+        mongoService.insertCleanFullText(article.articleId, cleanText)
+    else:
+        mongoService.markNoText(article.articleId)
+
+
+def saveUnchangedPage(article, page: RawPage, mongoService):
+    """
+    Saves the cleaned full text of an article whose stored page is current, see isUnchanged. Articles with a stored
+    page are only scraped again when they lack clean text, so it is extracted from the stored page: the page itself
+    when its content hash matched, or the stored web scrap read from the db after a 304, see saveCleanText.
+    Duplicates of the article get the stored fetch results of the article copied, then the writes of the article.
+    :param page: page of the article that is its stored page
+    """
+    if page.body:
+        cleanText = extract_full_text_from_html(page.body, article.articleUrl, page.encoding)
+    else:
+        storedHtml = mongoService.getWebScrap(article.articleId)
+        if storedHtml is None:
+            # The stored page was removed since the article was read, it is fetched again by the next run
+            return
+        cleanText = extract_full_text_from_html(storedHtml, article.articleUrl)
+    if article.duplicateIds:
+        mongoService.copyFetchResults([(article.articleId, None, article.duplicateIds)])
+        mongoService.setDuplicates(article.articleId, article.duplicateIds)
+    try:
+        if article.attempts:
+            mongoService.clearFetchFailure(article.articleId)
+        saveCleanText(article, cleanText, mongoService)
+    finally:
+        if article.duplicateIds:
+            mongoService.clearDuplicates(article.articleId)
+
+
+def saveFetchFailure(article, mongoService, result: ScrapResult = None):
+    """
+    Saves the failure of the fetch of an article so it is fetched again once its backoff ends, see retry_policy.
+    Articles whose page is gone or that failed more than {WEB_SCRAP_RETRIES} retries are no longer fetched.
+    :param result: result of the failed fetch (or null if unknown)
+    """
+    attempts = article.attempts + 1
+    status = result.status if result is not None else None
+    outcome = failureOutcome(attempts, status)
+    getMetrics().increment(FETCH_FAILURES, label=outcome)
+    mongoService.insertFetchFailure(article.articleId, attempts, result.error if result is not None else None, status,
+                                    nextAttempt(attempts) if outcome == RETRY else None)
+
+
+def isUnchanged(article, page: RawPage):
+    """
+    Checks if the page of an article scraped again is its stored page: the server answered that it was not modified,
+    or the page has the content hash of the stored page
+    :param article: article with the validators of its stored page (or null validators if it has none)
+    :return: if the stored page of the article is current
+    """
+    if page.notModified:
+        outcome = NOT_MODIFIED
+    elif article.validators is None or page.validators is None:
+        return False
+    else:
+        outcome = UNCHANGED if page.validators.contentHash == article.validators.contentHash else CHANGED
+    getMetrics().increment(REVALIDATIONS, label=outcome)
+    return outcome != CHANGED
+
+
+def reprocessWebScrap(article, mongoService):
     """
-    Web Scrap page for a given article.
+    Extracts and saves the cleaned full text of an article from its stored web scrap without fetching it, see
+    saveCleanText
+    :param article: article with a stored web scrap, compressed or not
+    :return: ScrapResult of the article
+    """
+    storedHtml = decodeWebScrap(article.storedHtml)
+    saveCleanText(article, extract_full_text_from_html(storedHtml, article.articleUrl), mongoService)
+    return ScrapResult()
+
+
+def runOnStage(stage: PipelineStage, fn, *args, onSubmitted=None):
+    """
+    Runs a function on a pipeline stage, or on the subscribing thread when there is no stage
+    :param onSubmitted: called once the stage accepted the function (or before it runs when there is no stage)
+    :return: Observable that emits the function result
+    """
+    if stage is None:
+        def run(args):
+            if onSubmitted is not None:
+                onSubmitted()
+            return fn(*args)
+
+        return rx.of(args).pipe(ops.map(run))
+    return stage.observe(fn, *args, onSubmitted=onSubmitted)
+
+
+def webScrap(article, logger: Logger, mongoService, scheduler, extractStage: PipelineStage = None, onFetched=None):
+    """
+    Web Scrap page for a given article. Articles with a stored web scrap are only extracted.
     :param articleContent: article to web scrap
-    :return: Observable Stream that web scraps article page
+    :param scheduler: scheduler the page is fetched on
+    :param extractStage: stage the page is extracted and saved on (default is the fetching thread)
+    :param onFetched: called with the ScrapResult of the fetch (or null if the article is not fetched) once the page
+    is accepted by the extraction stage, before it is extracted and saved
+    :return: Observable Stream that web scraps article page and emits its ScrapResult
     """
+    if article.storedHtml is not None:
+        return rx.of(article).pipe(
+            ops.flat_map(lambda article: runOnStage(extractStage, reprocessWebScrap, article, mongoService,
+                                                    onSubmitted=onFetched and (lambda: onFetched(None)))),
+            # Error handling
+            ops.do_action(on_error=lambda err: logger.error("Error occurred while reprocessing", exc_info=err)),
+            ops.catch(rx.of(ScrapResult())),
+            ops.subscribe_on(scheduler=scheduler)
+        )
+
+    result = ScrapResult()
     return rx.of(article).pipe(
         # Get link
         ops.map(lambda article: article.articleUrl),
         # Web scrap the article at the URL
-        ops.flat_map(lambda url: web_scrap(url, logger, scheduler)),
-        # Insert into mongo db
-        ops.do_action(lambda web_scrap: mongoService.insertWebScrapArticle(article.articleId, web_scrap)),
-        # Extract and save cleaned full text
-        ops.do_action(lambda raw_html: (
-            mongoService.insertCleanFullText(
-                article.articleId, extract_full_text_from_html(raw_html)
-            ) if raw_html else None
-        )),
+        ops.flat_map(lambda url: web_scrap(url, logger, scheduler, result, article.validators)),
+        # Insert into mongo db, then extract and save cleaned full text
+        ops.flat_map(lambda page: runOnStage(extractStage, saveWebScrap, article, page, mongoService, result,
+                                             onSubmitted=onFetched and (lambda: onFetched(result)))),
         # Error handling
         ops.do_action(on_error=lambda err: logger.error("Error occurred while web scraping", exc_info=err)),
         ops.catch(rx.of(0)),
         ops.subscribe_on(scheduler=scheduler),
-        ops.to_list()
-    )
\ No newline at end of file
+        ops.to_list(),
+        ops.map(lambda _: result)
+    )
+
+
+async def webScrapAsync(article, logger: Logger, mongoService, session: aiohttp.ClientSession, extract,
+                        onFetched=None):
+    """
+    Web Scrap page for a given article on the event loop.
+    Extraction and db writes are CPU or blocking work, so they are run on the extraction stage.
+    :param article: article to web scrap
+    :param session: aiohttp session used for the request
+    :param extract: coroutine function that runs a function and its arguments on the extraction stage, and calls its
+    onSubmitted keyword argument once the stage accepted them
+    :param onFetched: called with the ScrapResult of the fetch (or null if the article is not fetched) once the page
+    is accepted by the extraction stage, before it is extracted and saved
+    :return: ScrapResult of the article
+    """
+    if article.storedHtml is not None:
+        try:
+            return await extract(reprocessWebScrap, article, mongoService,
+                                 onSubmitted=onFetched and (lambda: onFetched(None)))
+        except Exception as err:
+            logger.error("Error occurred while reprocessing", exc_info=err)
+            return ScrapResult()
+
+    result = ScrapResult()
+    try:
+        start = time.perf_counter()
+        try:
+            page = await fetchPageAsync(article.articleUrl, logger, session, result, article.validators)
+            result.recordSuccess(time.perf_counter() - start)
+        except Exception as err:
+            logger.debug("Web scrap failed: %s", article.articleUrl, exc_info=err)
+            result.recordFailure(err, time.perf_counter() - start)
+            page = None
+
+        # The page is decoded on the extraction stage rather than the event loop
+        await extract(saveWebScrap, article, page, mongoService, result,
+                      onSubmitted=onFetched and (lambda: onFetched(result)))
+    except Exception as err:
+        logger.error("Error occurred while web scraping", exc_info=err)
+    return result
+
+
+class AsyncFetchEngine:
+    """
+    Fetches articles concurrently on an asyncio event loop running in its own thread.
+    Extraction and db writes are run on the extraction stage so they do not block the loop.
+    """
+
+    def __init__(self, logger: Logger, mongoService, concurrency=ASYNC_CONCURRENCY, extractStage: PipelineStage = None):
+        self.logger = logger
+        self.mongoService = mongoService
+        self.extractStage = extractStage or PipelineStage("extract", EXTRACT_THREADS, EXTRACT_QUEUE_SIZE)
+        self._futures = set()
+        self._futuresLock = threading.Lock()
+
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self._thread.start()
+        self.session = asyncio.run_coroutine_threadsafe(self._createSession(concurrency), self.loop).result()
+        # Waits on the loop for a free slot of the extraction stage, so submitting to the stage never blocks the loop
+        self._extractSlots = asyncio.run_coroutine_threadsafe(self._createSlots(), self.loop).result()
+
+    async def _createSession(self, concurrency):
+        return aiohttp.ClientSession(connector=createAsyncConnector(concurrency),
+                                     trace_configs=[createAsyncTraceConfig()])
+
+    async def _createSlots(self):
+        return asyncio.Semaphore(self.extractStage.capacity)
+
+    async def _extract(self, fn, *args, onSubmitted=None):
+        async with self._extractSlots:
+            future = self.extractStage.submit(fn, *args)
+            if onSubmitted is not None:
+                onSubmitted()
+            return await asyncio.wrap_future(future)
+
+    def submit(self, article, onComplete, onFetched=None):
+        """
+        Schedules web scraping of an article on the event loop
+        :param article: article to web scrap
+        :param onComplete: called with the ScrapResult once the article is processed
+        :param onFetched: called with the ScrapResult of the fetch once its page is accepted by the extraction stage
+        """
+        future = asyncio.run_coroutine_threadsafe(
+            webScrapAsync(article, self.logger, self.mongoService, self.session, self._extract, onFetched), self.loop)
+        with self._futuresLock:
+            self._futures.add(future)
+        future.add_done_callback(lambda f: self._complete(f, onComplete))
+        return future
+
+    def _complete(self, future, onComplete):
+        with self._futuresLock:
+            self._futures.discard(future)
+        onComplete(None if future.cancelled() or future.exception() else future.result())
+
+    def close(self, timeout=None):
+        """
+        Waits for submitted articles, then closes the session and stops the event loop
+        """
+        with self._futuresLock:
+            futures = list(self._futures)
+        wait(futures, timeout=timeout)
+        asyncio.run_coroutine_threadsafe(self.session.close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+        self.extractStage.shutdown()
@@ -1,72 +1,157 @@
+import itertools
 import logging
+import os
+import threading
+import time
 
 from reactivex import operators as ops, Subject
 import reactivex as rx
-from multiprocess.synchronize import Lock
-from multiprocess import Process, Queue, Manager
-import dill
+from concurrent.futures import Future
+from multiprocess import Process, Queue, Event
 from reactivex.scheduler import ThreadPoolScheduler
-from threading import Semaphore as ThreadedSemaphore
 
-from src.config import THREADS_PER_CORE, LOGGER_FORMAT
+from src.adaptive_concurrency import AdaptiveConcurrencyLimit
+from src.config import THREADS_PER_CORE, LOGGER_FORMAT, FETCH_MODE, WORKER_CONCURRENCY, EXTRACT_THREADS, \
+    EXTRACT_QUEUE_SIZE, STAGE_REPORT_INTERVAL, TASK_BATCH_SIZE, METRICS_INTERVAL, PROFILE_MODE, ADAPTIVE_CONCURRENCY, \
+    CONCURRENCY_MAX
 from src.exceptions import DisposedException
+from src.http_session import installDnsCache, logConnectionStats
+from src.metrics import getMetrics, STAGE_SECONDS, QUEUE_WAIT
 from src.mongo_service import ArticleInfo, MongoService
-from src.web_scrap import webScrap
+from src.pipeline_stage import PipelineStage, ConcurrencyLimit
+from src.profiling import createProfileDir, runProfiled, writeReport
+from src.site_rules import getSiteRules
+from src.task_channel import BatchSender, endChannel, receiveBatches, encodeTask, decodeTask, encodeResult, \
+    decodeResult
+from src.web_scrap import webScrap, AsyncFetchEngine
 
 
 class WebScrapProcessor:
-    def __init__(self, max_workers=1):
-        dill.settings['recurse'] = True
+    """
+    Web scraps articles in {max_workers} worker processes.
+    Articles are sent to the workers over one task queue and their results come back over one result queue,
+    both in batches of compactly encoded items, where a listener thread completes the future of each submitted article.
+    Workers send snapshots of their metrics every {METRICS_INTERVAL} seconds over a metrics queue, which are merged
+    into the metrics of this process.
+    When {PROFILE_MODE} is set, workers run under a profiler and a merged report is written on dispose.
+    """
+
+    def __init__(self, max_workers=1, batchSize=TASK_BATCH_SIZE, profileMode=PROFILE_MODE):
         self.max_workers = max_workers
+        self.batchSize = batchSize
+        self.profileMode = profileMode
+        self.profileDir = createProfileDir(profileMode)
         self._processes = []
-        self._manager = Manager()
-        self._taskQueue = self._manager.Queue()
-        self._disposedValue = self._manager.Value(bool, False)
+        self._taskQueue = Queue()
+        self._resultQueue = Queue()
+        self._metricsQueue = Queue()
+        self._disposed = threading.Event()
+        # Futures of submitted articles by task id
+        self._futures = {}
+        self._futuresLock = threading.Lock()
+        self._taskIds = itertools.count()
+        # Workers take a batch at once, so batches are not larger than the articles a worker processes at a time
+        self._taskSender = BatchSender(self._taskQueue, min(batchSize, WORKER_CONCURRENCY))
 
-        startLocks = []
+        startEvents = []
         for pid in range(max_workers):
-            startLock: Lock = self._manager.Lock()
-            startLock.acquire()
-            p = Process(target=self._processRun, args=[self._taskQueue, startLock, self._disposedValue])
+            startEvent = Event()
+            args = [self._taskQueue, self._resultQueue, startEvent, self._metricsQueue]
+            if self.profileDir:
+                p = Process(target=runProfiled, args=[self.profileMode, self.profileDir, "worker", self._processRun]
+                                                     + args)
+            else:
+                p = Process(target=self._processRun, args=args)
             p.daemon = True
             self._processes.append(p)
-            startLocks.append(startLock)
+            startEvents.append(startEvent)
             p.start()
 
         # Wait for all processes to start
-        for lock in startLocks:
-            lock.acquire()
+        for event in startEvents:
+            event.wait()
+
+        self._listener = threading.Thread(target=self._listenResults, daemon=True)
+        self._listener.start()
+        self._metricsListener = threading.Thread(target=self._listenMetrics, daemon=True)
+        self._metricsListener.start()
 
     def dispose(self):
         """
-        Releases resources for processes
+        Releases resources for processes. Each process flushes its buffered db writes before exiting.
+        Articles that did not complete are completed without a result.
         """
-        self._disposedValue.value = True
+        self._disposed.set()
+        self._taskSender.close()
         # unblock all processes
         for i in range(self.max_workers):
-            self._taskQueue.put(i)
+            endChannel(self._taskQueue)
 
-        self._taskQueue._close()
         for p in self._processes:
             # Wait 10 seconds max for shutdown
             p.join(10)
 
+        endChannel(self._resultQueue)
+        self._listener.join(10)
+        # Workers send their last metrics before exiting
+        endChannel(self._metricsQueue)
+        self._metricsListener.join(10)
+        with self._futuresLock:
+            futures = list(self._futures.values())
+            self._futures.clear()
+        for future in futures:
+            future.set_result(None)
+        if self.profileDir:
+            writeReport(self.profileDir, logging.getLogger('Profiler'))
+
     def submitArticle(self, articleInfo: ArticleInfo):
-        if self._disposedValue.value:
+        """
+        Web scraps an article in one of the processes. Does not wait for the article to be processed.
+        :return: Future of the ScrapResult of the article (or null if the process did not report one)
+        """
+        if self._disposed.is_set():
             raise DisposedException()
 
-        completeLock: Lock = self._manager.Lock()
-        # Lock is initially unlocked, lock it before submitting
-        completeLock.acquire()
-        self._taskQueue.put([articleInfo, completeLock])
-        # Wait for completion
-        completeLock.acquire()
+        taskId = next(self._taskIds)
+        future = Future()
+        with self._futuresLock:
+            self._futures[taskId] = future
+        self._taskSender.put(encodeTask(articleInfo, taskId))
+        return future
+
+    def _listenResults(self):
+        """
+        Completes the futures of articles reported by the processes
+        """
+        for data in receiveBatches(self._resultQueue):
+            taskId, result = decodeResult(data)
+            with self._futuresLock:
+                future = self._futures.pop(taskId, None)
+            if future is not None:
+                future.set_result(result)
+
+    def _listenMetrics(self):
+        """
+        Merges the metrics snapshots sent by the processes
+        """
+        metrics = getMetrics()
+        while True:
+            try:
+                message = self._metricsQueue.get()
+            except (EOFError, OSError):
+                return
+            if message is None:
+                return
+            metrics.updateRemote(*message)
 
-    def _processRun(self, queue, startLock, disposedValue):
+    def _processRun(self, taskQueue, resultQueue, startEvent, metricsQueue=None):
         try:
-            scheduler = ThreadPoolScheduler(THREADS_PER_CORE)
+            # Fetch threads are started as needed, up to the highest limit
+            scheduler = ThreadPoolScheduler(max(THREADS_PER_CORE, CONCURRENCY_MAX) if ADAPTIVE_CONCURRENCY
+                                            else THREADS_PER_CORE)
             logging.basicConfig(level=logging.INFO, format=LOGGER_FORMAT)
             logger = logging.getLogger('Web Scrap Processor')
+            installDnsCache()
 
             # Instantiate Database services
             try:
@@ -76,39 +161,73 @@ class WebScrapProcessor:
                 return
 
             sourceSubject = Subject()
-            maxAllowedData = ThreadedSemaphore(THREADS_PER_CORE)
+            resultSender = BatchSender(resultQueue, self.batchSize)
+            # Fetching is limited by the articles being fetched, extraction by its own stage
+            if ADAPTIVE_CONCURRENCY:
+                maxAllowedData = AdaptiveConcurrencyLimit(WORKER_CONCURRENCY, logging.getLogger('Concurrency'))
+            else:
+                maxAllowedData = ConcurrencyLimit(WORKER_CONCURRENCY)
+            extractStage = PipelineStage("extract", EXTRACT_THREADS, EXTRACT_QUEUE_SIZE)
+            asyncEngine = None
 
-            logger.info("Web Scrap Processor started")
-            startLock.release()
-
-            try:
-                _runWebscrap(sourceSubject, logger, mongoService, scheduler, maxAllowedData)
-            except Exception:
-                pass
-
-            while not disposedValue.value:
+            if FETCH_MODE == "async":
+                asyncEngine = AsyncFetchEngine(logger, mongoService, extractStage=extractStage)
+                sourceSubject.subscribe(
+                    on_next=lambda request: _callScrapAsync(request, asyncEngine, resultSender, maxAllowedData))
+            else:
                 try:
-                    maxAllowedData.acquire()
-                    request = queue.get(block=True)
+                    _runWebscrap(sourceSubject, logger, mongoService, scheduler, resultSender, maxAllowedData,
+                                 extractStage)
                 except Exception:
-                    # Queue has closed
-                    break
+                    pass
+
+            stopReport = threading.Event()
+            if STAGE_REPORT_INTERVAL > 0:
+                threading.Thread(target=_reportStages, args=[logger, maxAllowedData, extractStage, stopReport],
+                                 daemon=True).start()
+            # Metrics are reported until all buffered writes are flushed
+            stopMetrics = threading.Event()
+            metricsReporter = None
+            if metricsQueue is not None:
+                metricsReporter = threading.Thread(target=_reportMetrics, args=[metricsQueue, stopMetrics],
+                                                   daemon=True)
+                metricsReporter.start()
+            metrics = getMetrics()
 
-                if disposedValue.value:
-                    break
+            logger.info("Web Scrap Processor started (%s fetch mode)", FETCH_MODE)
+            startEvent.set()
+
+            for data in receiveBatches(taskQueue):
+                maxAllowedData.acquire()
+                maxAllowedData.started()
+                request = decodeTask(data)
+                metrics.observe(STAGE_SECONDS, max(0.0, time.time() - request[2]), QUEUE_WAIT)
                 sourceSubject.on_next(request)
 
             # Shutdown
             sourceSubject.on_completed()
             sourceSubject.dispose()
+            if asyncEngine is not None:
+                asyncEngine.close()
+            stopReport.set()
+            extractStage.shutdown()
+            logConnectionStats(logger)
+            getSiteRules().logStats(logger)
+            # Write any buffered article updates before the process exits
+            mongoService.close()
+            resultSender.close()
+            stopMetrics.set()
+            if metricsReporter is not None:
+                metricsReporter.join()
 
         except Exception as err:
             logging.error('Something went wrong', exc_info=err)
 
 
-def _runWebscrap(source, logger, mongoService, scheduler, maxAllowedData):
+def _runWebscrap(source, logger, mongoService, scheduler, resultSender, maxAllowedData, extractStage=None):
     source.pipe(
-        ops.flat_map(lambda request: _callScrapFromTest(request, logger, mongoService, scheduler, maxAllowedData)),
+        ops.flat_map(lambda request: _callScrapFromTest(request, logger, mongoService, scheduler, resultSender,
+                                                        maxAllowedData, extractStage)),
         ops.do_action(on_error=lambda err: logger.error("Error occurred.", exc_info=err)),
         ops.catch(rx.empty()),
         # Ensures something is always returned
@@ -116,11 +235,73 @@ def _runWebscrap(source, logger, mongoService, scheduler, maxAllowedData):
     ).subscribe(scheduler=scheduler, on_completed=logger.info("Completed Processing"))
 
 
-def _callScrapFromTest(request, logger, mongoService, scheduler, maxAllowedData):
+def _callScrapFromTest(request, logger, mongoService, scheduler, resultSender, maxAllowedData, extractStage=None):
+    releaseSlot = _slotReleaser(maxAllowedData)
     return rx.of(request).pipe(
-        ops.flat_map(lambda rd: webScrap(request[0], logger, mongoService, scheduler)),
-        # Release the lock for this object as scraping is complete
-        ops.do_action(on_next=lambda rd: request[1].release()),
-        ops.do_action(on_next=lambda rd: maxAllowedData.release())
+        ops.flat_map(lambda rd: webScrap(request[0], logger, mongoService, scheduler, extractStage, releaseSlot)),
+        # Report the result as scraping is complete
+        ops.do_action(on_next=lambda result: _completeRequest(request, result, resultSender, releaseSlot))
     )
 
+
+def _callScrapAsync(request, asyncEngine, resultSender, maxAllowedData):
+    releaseSlot = _slotReleaser(maxAllowedData)
+    asyncEngine.submit(request[0], lambda result: _completeRequest(request, result, resultSender, releaseSlot),
+                       releaseSlot)
+
+
+def _slotReleaser(maxAllowedData):
+    """
+    Frees the fetch slot of a request once its page is accepted by the extraction stage, so fetching goes on while
+    pages wait for extraction until the queue of the stage is full
+    :return: function freeing the slot with the ScrapResult of the fetch, only its first call frees it
+    """
+    lock = threading.Lock()
+    released = False
+
+    def release(result=None):
+        nonlocal released
+        with lock:
+            if released:
+                return
+            released = True
+        maxAllowedData.release(result)
+
+    return release
+
+
+def _completeRequest(request, result, resultSender, releaseSlot):
+    """
+    Reports the result of a request to the submitting process, and frees its fetch slot if the page never reached the
+    extraction stage
+    """
+    resultSender.put(encodeResult(request[1], result))
+    releaseSlot(result)
+
+
+def _reportMetrics(metricsQueue, stopEvent):
+    """
+    Sends a snapshot of the metrics of the process every {METRICS_INTERVAL} seconds, and a last one once stopped.
+    Snapshots are cumulative, so a lost or late snapshot is corrected by the next one.
+    """
+    metrics = getMetrics()
+    while not stopEvent.wait(METRICS_INTERVAL if METRICS_INTERVAL > 0 else None):
+        metricsQueue.put((os.getpid(), metrics.snapshot(includeRemote=False)))
+    metricsQueue.put((os.getpid(), metrics.snapshot(includeRemote=False)))
+
+
+def _reportStages(logger, maxAllowedData, extractStage, stopEvent):
+    """
+    Logs the depth of the fetch and extraction stages every {STAGE_REPORT_INTERVAL} seconds while articles are in process.
+    A full fetch stage with an empty extraction queue means fetching is the bottleneck, a full extraction queue means
+    extraction is.
+    """
+    while not stopEvent.wait(STAGE_REPORT_INTERVAL):
+        fetching = maxAllowedData.inUse
+        queued, active = extractStage.depth()
+        if fetching == 0 and queued == 0 and active == 0:
+            continue
+        logger.info("Stages: fetching %s/%s | extract queue %s/%s (max %s) | extracting %s/%s | extracted %s",
+                    fetching, maxAllowedData.limit,
+                    queued, extractStage.capacity - extractStage.workers, extractStage.maxQueued,
+                    active, extractStage.workers, extractStage.completed)
@@ -0,0 +1,144 @@
+import unittest
+from logging import Logger
+from unittest.mock import *
+
+from src.adaptive_concurrency import AdaptiveConcurrencyLimit
+from src.scrap_result import ScrapResult, SKIPPED
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def createLimit(limit=4, **kwargs):
+    clock = FakeClock()
+    cpuClock = FakeClock()
+    loggerMock = Mock(spec_set=Logger)
+    settings = dict(minLimit=1, maxLimit=64, interval=1.0, latencyFactor=2.0, maxErrorRate=0.2, maxCpu=0.9)
+    settings.update(kwargs)
+    return AdaptiveConcurrencyLimit(limit, loggerMock, clock=clock, cpuClock=cpuClock, **settings), clock, cpuClock
+
+
+def runWindow(limit, clock, results, elapsed=1.0, saturate=True):
+    """
+    Processes the results in one window, with all slots in use when {saturate} is set
+    """
+    inProcess = limit.limit if saturate else 1
+    for i in range(inProcess):
+        limit.acquire()
+        limit.started()
+    clock.now += elapsed
+    for i, result in enumerate(results):
+        limit.release(result)
+        if i < len(results) - inProcess:
+            limit.acquire()
+            limit.started()
+
+
+def success(elapsed=0.1):
+    result = ScrapResult()
+    result.recordSuccess(elapsed)
+    return result
+
+
+class AdaptiveConcurrencyLimitTests(unittest.TestCase):
+    def test_slow_start_doubles_until_maximum(self):
+        limit, clock, cpuClock = createLimit(limit=4, maxLimit=20)
+
+        # Actual
+        limits = []
+        for i in range(4):
+            runWindow(limit, clock, [success() for i in range(limit.limit)])
+            limits.append(limit.limit)
+
+        # Assert
+        self.assertEqual([8, 16, 20, 20], limits)
+        self.assertTrue(limit.slowStart)
+        self.assertEqual(3, limit.decisions)
+        self.assertEqual(3, limit.logger.info.call_count)
+
+    def test_latency_increase_decreases_then_adds_one(self):
+        limit, clock, cpuClock = createLimit(limit=8)
+
+        # Actual
+        runWindow(limit, clock, [success(0.1) for i in range(8)])
+        runWindow(limit, clock, [success(0.5) for i in range(16)])
+        afterDecrease = limit.limit
+        runWindow(limit, clock, [success(0.2) for i in range(12)])
+
+        # Assert
+        self.assertEqual(12, afterDecrease)
+        self.assertFalse(limit.slowStart)
+        self.assertEqual(13, limit.limit)
+        self.assertIn("latency", limit.logger.info.call_args_list[1][0][3])
+
+    def test_host_failures_decrease_limit(self):
+        limit, clock, cpuClock = createLimit(limit=8)
+        failures = [ScrapResult(503, "WebScrapException", 0.1) for i in range(4)]
+        timeouts = [ScrapResult(None, "ReadTimeout", 1.0) for i in range(2)]
+
+        # Actual
+        runWindow(limit, clock, failures + timeouts + [success() for i in range(4)])
+
+        # Assert
+        self.assertEqual(6, limit.limit)
+        self.assertIn("error rate", limit.logger.info.call_args[0][3])
+
+    def test_skipped_pages_not_counted_as_failures(self):
+        limit, clock, cpuClock = createLimit(limit=4)
+        skipped = ScrapResult(None, "SkippedContentException", 0.1)
+        skipped.recordLimited(SKIPPED, "application/pdf")
+
+        # Actual
+        runWindow(limit, clock, [skipped for i in range(4)])
+
+        # Assert
+        self.assertEqual(8, limit.limit)
+
+    def test_cpu_use_decreases_limit(self):
+        limit, clock, cpuClock = createLimit(limit=8)
+
+        # Actual
+        cpuClock.now += 0.95
+        runWindow(limit, clock, [success() for i in range(8)])
+
+        # Assert
+        self.assertEqual(6, limit.limit)
+        self.assertIn("cpu", limit.logger.info.call_args[0][3])
+
+    def test_limit_held_when_slots_not_used(self):
+        limit, clock, cpuClock = createLimit(limit=8)
+
+        # Actual
+        runWindow(limit, clock, [success() for i in range(8)], saturate=False)
+
+        # Assert
+        self.assertEqual(8, limit.limit)
+        limit.logger.info.assert_not_called()
+
+    def test_window_waits_for_enough_results(self):
+        limit, clock, cpuClock = createLimit(limit=4)
+
+        # Actual
+        runWindow(limit, clock, [success() for i in range(2)], saturate=False)
+        heldOnFewResults = limit.limit
+        runWindow(limit, clock, [ScrapResult(503, "WebScrapException", 0.1) for i in range(2)], elapsed=0.0)
+
+        # Assert
+        self.assertEqual(4, heldOnFewResults)
+        self.assertEqual(3, limit.limit)
+
+    def test_initial_limit_within_bounds(self):
+        # Actual
+        limit, clock, cpuClock = createLimit(limit=200, maxLimit=64)
+
+        # Assert
+        self.assertEqual(64, limit.limit)
+
+
+if __name__ == '__main__':
+    unittest.main()
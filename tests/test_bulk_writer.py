@@ -0,0 +1,121 @@
+import time
+import unittest
+from logging import Logger
+from unittest.mock import *
+from uuid import UUID
+
+from pymongo.collection import Collection
+from pymongo.errors import BulkWriteError
+
+from src.bulk_writer import BulkArticleWriter
+
+UUID_1 = UUID("5d8a48c7-8799-49ba-8a61-b96c6f0d08e8")
+UUID_2 = UUID("2c398d08-22e0-4f69-955b-69fb39666a9c")
+UUID_3 = UUID("8c819db1-3dfa-4343-b6e7-9b73495fcdec")
+
+
+def getMockObjects():
+    loggerMock = Mock(spec_set=Logger)
+    collectionMock = Mock(spec_set=Collection)
+
+    return loggerMock, collectionMock
+
+
+class BulkArticleWriterTests(unittest.TestCase):
+    def test_flush_on_batch_size(self):
+        loggerMock, collectionMock = getMockObjects()
+        writer = BulkArticleWriter(collectionMock, loggerMock, batchSize=2, flushInterval=60)
+
+        # Actual
+        writer.set(UUID_1, {"web_scrap": "a"})
+        collectionMock.bulk_write.assert_not_called()
+        writer.set(UUID_2, {"web_scrap": "b"})
+        # Full batches are written by the background thread
+        for i in range(100):
+            if collectionMock.bulk_write.called:
+                break
+            time.sleep(0.01)
+
+        # Assert
+        collectionMock.bulk_write.assert_called_once()
+        self.assertEqual(2, len(collectionMock.bulk_write.call_args[0][0]))
+        self.assertEqual(1, writer.batchCount)
+        self.assertEqual(2, writer.writeCount)
+        writer.close()
+
+    def test_flush_on_interval(self):
+        loggerMock, collectionMock = getMockObjects()
+        writer = BulkArticleWriter(collectionMock, loggerMock, batchSize=100, flushInterval=0.1)
+
+        # Actual
+        writer.set(UUID_1, {"web_scrap": "a"})
+        time.sleep(0.5)
+
+        # Assert
+        collectionMock.bulk_write.assert_called_once()
+        writer.close()
+
+    def test_merge_same_article(self):
+        loggerMock, collectionMock = getMockObjects()
+        writer = BulkArticleWriter(collectionMock, loggerMock, batchSize=100, flushInterval=60)
+
+        # Actual
+        writer.set(UUID_1, {"web_scrap": "a"})
+        writer.set(UUID_1, {"clean_full_text": "b"}, upsert=True)
+        writer.close()
+
+        # Assert
+        requests = collectionMock.bulk_write.call_args[0][0]
+        self.assertEqual(1, len(requests))
+        self.assertEqual({"$set": {"web_scrap": "a", "clean_full_text": "b"}}, requests[0]._doc)
+        self.assertTrue(requests[0]._upsert)
+
+    def test_duplicates_written_with_article(self):
+        loggerMock, collectionMock = getMockObjects()
+        writer = BulkArticleWriter(collectionMock, loggerMock, batchSize=100, flushInterval=60)
+
+        # Actual
+        writer.set(UUID_1, {"web_scrap": "a"})
+        writer.setDuplicates(UUID_1, [UUID_2, UUID_3])
+        writer.set(UUID_1, {"clean_full_text": "b"})
+        writer.clearDuplicates(UUID_1)
+        writer.flush()
+        writer.set(UUID_1, {"fetch_status": "truncated"})
+        writer.close()
+
+        # Assert
+        fanOut, single = [call[0][0][0] for call in collectionMock.bulk_write.call_args_list]
+        self.assertEqual({"_id": {"$in": [UUID_1, UUID_2, UUID_3]}}, fanOut._filter)
+        self.assertEqual({"$set": {"web_scrap": "a", "clean_full_text": "b"}}, fanOut._doc)
+        self.assertEqual({"_id": UUID_1}, single._filter)
+        self.assertEqual(4, writer.writeCount)
+
+    def test_bulk_write_errors_counted(self):
+        loggerMock, collectionMock = getMockObjects()
+        collectionMock.bulk_write.side_effect = BulkWriteError({"writeErrors": [{"index": 0}]})
+        writer = BulkArticleWriter(collectionMock, loggerMock, batchSize=100, flushInterval=60)
+
+        # Actual
+        writer.set(UUID_1, {"web_scrap": "a"})
+        writer.set(UUID_2, {"web_scrap": "b"})
+        writer.set(UUID_3, {"web_scrap": "c"})
+        writer.close()
+
+        # Assert
+        self.assertEqual(1, writer.errorCount)
+        self.assertEqual(2, writer.writeCount)
+        loggerMock.error.assert_called_once()
+
+    def test_close_without_writes(self):
+        loggerMock, collectionMock = getMockObjects()
+        writer = BulkArticleWriter(collectionMock, loggerMock)
+
+        # Actual
+        writer.close()
+
+        # Assert
+        collectionMock.bulk_write.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
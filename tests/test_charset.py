@@ -0,0 +1,77 @@
+import codecs
+import unittest
+from unittest.mock import patch
+
+from src.charset import decodeHtml, detectEncoding, charsetFromContentType, normalizeEncoding, BOM, HEADER, META, \
+    UTF8, SNIFF, SNIFF_BYTES
+
+PAGE = "<html><head>{}</head><body><p>Café crème à la carte</p></body></html>"
+
+
+class CharsetTests(unittest.TestCase):
+    def test_charset_from_content_type(self):
+        self.assertEqual("utf-8", charsetFromContentType("text/html; charset=utf-8"))
+        self.assertEqual("ISO-8859-1", charsetFromContentType('text/html;charset="ISO-8859-1"'))
+        self.assertIsNone(charsetFromContentType("text/html"))
+        self.assertIsNone(charsetFromContentType(None))
+
+    def test_normalize_encoding(self):
+        self.assertEqual("utf-8", normalizeEncoding("UTF8"))
+        self.assertEqual("cp1252", normalizeEncoding("iso-8859-1"))
+        self.assertEqual("cp1252", normalizeEncoding("us-ascii"))
+        self.assertEqual("utf-8", normalizeEncoding("utf-16", declared=True))
+        self.assertIsNone(normalizeEncoding("unknown-charset"))
+
+    def test_detect_encoding_sources(self):
+        metaPage = PAGE.format('<meta charset="windows-1252">').encode("cp1252")
+        httpEquivPage = PAGE.format('<meta http-equiv="Content-Type" content="text/html; charset=Shift_JIS">')
+
+        # Assert
+        self.assertEqual(("utf-8", BOM), detectEncoding(codecs.BOM_UTF8 + metaPage, "cp1252"))
+        self.assertEqual(("utf-8", HEADER), detectEncoding(metaPage, "utf-8"))
+        self.assertEqual(("cp1252", META), detectEncoding(metaPage))
+        self.assertEqual(("cp1252", META), detectEncoding(metaPage, "not-a-charset"))
+        self.assertEqual(("shift_jis", META), detectEncoding(httpEquivPage.encode()))
+        self.assertEqual(("euc_jp", META), detectEncoding(b'<?xml version="1.0" encoding="EUC-JP"?><html></html>'))
+        self.assertEqual((None, None), detectEncoding(PAGE.format("").encode()))
+
+    def test_decode_declared_page(self):
+        page = PAGE.format('<meta charset="windows-1252">')
+
+        # Actual
+        text, encoding, source = decodeHtml(page.encode("cp1252"))
+        bomText, bomEncoding, bomSource = decodeHtml(codecs.BOM_UTF8 + page.encode())
+
+        # Assert
+        self.assertEqual((page, "cp1252", META), (text, encoding, source))
+        self.assertEqual((page, "utf-8", BOM), (bomText, bomEncoding, bomSource))
+
+    @patch("src.charset.chardet.detect")
+    def test_decode_undeclared_utf8_page_without_sniffing(self, detectMock):
+        page = PAGE.format("")
+
+        # Actual
+        text, encoding, source = decodeHtml(page.encode())
+        # Cut off inside the last character
+        truncated = decodeHtml(page.encode()[:page.encode().index("é".encode()) + 1])
+
+        # Assert
+        self.assertEqual((page, "utf-8", UTF8), (text, encoding, source))
+        self.assertEqual(("utf-8", UTF8), truncated[1:])
+        detectMock.assert_not_called()
+
+    @patch("src.charset.chardet.detect")
+    def test_decode_undeclared_page_sniffs_prefix(self, detectMock):
+        detectMock.return_value = {"encoding": "ISO-8859-1"}
+        page = PAGE.format("") + "<!-- {} -->".format("é" * 3 * SNIFF_BYTES)
+
+        # Actual
+        text, encoding, source = decodeHtml(page.encode("cp1252"))
+
+        # Assert
+        self.assertEqual((page, "cp1252", SNIFF), (text, encoding, source))
+        self.assertEqual(SNIFF_BYTES, len(detectMock.call_args[0][0]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import time
+import unittest
+from logging import Logger
+from unittest.mock import *
+
+from src.circuit_breaker import CircuitBreaker, isHostFailure, CLOSED, OPEN, HALF_OPEN
+from src.scrap_result import ScrapResult
+
+HOST = "down.com"
+FAILURE = ScrapResult(None, "ConnectTimeout", 10)
+SUCCESS = ScrapResult(200, None, 0.1)
+
+
+class CircuitBreakerTests(unittest.TestCase):
+    def test_isHostFailure(self):
+        self.assertTrue(isHostFailure(FAILURE))
+        self.assertTrue(isHostFailure(ScrapResult(502, "WebScrapException")))
+        self.assertFalse(isHostFailure(ScrapResult(404, "WebScrapException")))
+        self.assertFalse(isHostFailure(SUCCESS))
+        self.assertFalse(isHostFailure(None))
+
+    def test_opens_after_consecutive_failures(self):
+        loggerMock = Mock(spec_set=Logger)
+        breaker = CircuitBreaker(loggerMock, failureThreshold=3, cooldown=60)
+
+        # Actual
+        for i in range(2):
+            breaker.recordResult(HOST, FAILURE)
+        stateBeforeThreshold = breaker.getState(HOST)
+        breaker.recordResult(HOST, FAILURE)
+
+        # Assert
+        self.assertEqual(CLOSED, stateBeforeThreshold)
+        self.assertEqual(OPEN, breaker.getState(HOST))
+        self.assertFalse(breaker.allowRequest(HOST))
+        self.assertFalse(breaker.allowRequest(HOST))
+        self.assertTrue(breaker.allowRequest("other.com"))
+        self.assertEqual({HOST: 2}, breaker.getSkipCounts())
+        loggerMock.warning.assert_called_once()
+
+    def test_success_resets_failures(self):
+        loggerMock = Mock(spec_set=Logger)
+        breaker = CircuitBreaker(loggerMock, failureThreshold=2, cooldown=60)
+
+        # Actual
+        breaker.recordResult(HOST, FAILURE)
+        breaker.recordResult(HOST, SUCCESS)
+        breaker.recordResult(HOST, FAILURE)
+
+        # Assert
+        self.assertEqual(CLOSED, breaker.getState(HOST))
+
+    def test_half_open_trial(self):
+        loggerMock = Mock(spec_set=Logger)
+        breaker = CircuitBreaker(loggerMock, failureThreshold=1, cooldown=0.05)
+        breaker.recordResult(HOST, FAILURE)
+        time.sleep(0.1)
+
+        # Actual
+        trialAllowed = breaker.allowRequest(HOST)
+        otherAllowed = breaker.allowRequest(HOST)
+        state = breaker.getState(HOST)
+        breaker.recordResult(HOST, SUCCESS)
+
+        # Assert
+        self.assertTrue(trialAllowed)
+        self.assertFalse(otherAllowed)
+        self.assertEqual(HALF_OPEN, state)
+        self.assertEqual(CLOSED, breaker.getState(HOST))
+        self.assertTrue(breaker.allowRequest(HOST))
+
+    def test_failed_trial_reopens(self):
+        loggerMock = Mock(spec_set=Logger)
+        breaker = CircuitBreaker(loggerMock, failureThreshold=1, cooldown=0.05)
+        breaker.recordResult(HOST, FAILURE)
+        time.sleep(0.1)
+
+        # Actual
+        breaker.allowRequest(HOST)
+        breaker.recordResult(HOST, FAILURE)
+
+        # Assert
+        self.assertEqual(OPEN, breaker.getState(HOST))
+        self.assertFalse(breaker.allowRequest(HOST))
+
+
+if __name__ == '__main__':
+    unittest.main()
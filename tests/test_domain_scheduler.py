@@ -0,0 +1,193 @@
+import threading
+import time
+import unittest
+from concurrent.futures import Future
+from logging import Logger
+from unittest.mock import *
+from uuid import uuid4
+
+import reactivex.operators as ops
+import reactivex as rx
+from reactivex.scheduler import CurrentThreadScheduler, ThreadPoolScheduler
+
+from src.circuit_breaker import CircuitBreaker
+from src.domain_scheduler import DomainScheduler, hostOf, isThrottled
+from src.scrap_result import CIRCUIT_OPEN
+from src.mongo_service import ArticleInfo
+from src.web_scrap import ScrapResult
+
+
+def article(url):
+    return ArticleInfo(uuid4(), url)
+
+
+def completed(result):
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+class DomainSchedulerTests(unittest.TestCase):
+    def test_hostOf(self):
+        self.assertEqual("thehackernews.com", hostOf("https://TheHackerNews.com/2024/article.html"))
+        self.assertEqual("", hostOf("not a url"))
+
+    def test_isThrottled(self):
+        self.assertTrue(isThrottled(ScrapResult(429, "WebScrapException")))
+        self.assertTrue(isThrottled(ScrapResult(503, "WebScrapException")))
+        self.assertTrue(isThrottled(ScrapResult(None, "ReadTimeout")))
+        self.assertFalse(isThrottled(ScrapResult(404, "WebScrapException")))
+        self.assertFalse(isThrottled(ScrapResult(200)))
+        self.assertFalse(isThrottled(None))
+
+    def test_schedule_emits_result(self):
+        loggerMock = Mock(spec_set=Logger)
+        expected = ScrapResult(200, elapsed=0.1)
+        submitMock = Mock(return_value=completed(expected))
+        domainScheduler = DomainScheduler(submitMock, loggerMock, CurrentThreadScheduler())
+
+        # Actual
+        actual = domainScheduler.schedule(article("https://a.com/1")).pipe(ops.to_list()).run()
+
+        # Assert
+        self.assertEqual([expected], actual)
+        submitMock.assert_called_once()
+
+    def test_schedule_emits_result_when_future_completes(self):
+        loggerMock = Mock(spec_set=Logger)
+        future = Future()
+        domainScheduler = DomainScheduler(Mock(return_value=future), loggerMock, CurrentThreadScheduler())
+        actual = []
+
+        # Actual
+        domainScheduler.schedule(article("https://a.com/1")).subscribe(on_next=actual.append)
+        emittedBeforeCompletion = list(actual)
+        future.set_result(ScrapResult(200, elapsed=0.1))
+
+        # Assert
+        self.assertEqual([], emittedBeforeCompletion)
+        self.assertEqual(1, len(actual))
+        self.assertEqual(0, domainScheduler._hosts["a.com"].inFlight)
+
+    def test_per_host_concurrency_limit(self):
+        loggerMock = Mock(spec_set=Logger)
+        lock = threading.Lock()
+        inFlight = {}
+        maxInFlight = {}
+
+        def submit(a):
+            host = hostOf(a.articleUrl)
+            with lock:
+                inFlight[host] = inFlight.get(host, 0) + 1
+                maxInFlight[host] = max(maxInFlight.get(host, 0), inFlight[host])
+            time.sleep(0.05)
+            with lock:
+                inFlight[host] -= 1
+            return completed(ScrapResult(200, elapsed=0.05))
+
+        domainScheduler = DomainScheduler(submit, loggerMock, ThreadPoolScheduler(20), maxConcurrency=2)
+        articles = [article("https://slow.com/{}".format(i)) for i in range(10)] + \
+                   [article("https://other.com/{}".format(i)) for i in range(2)]
+
+        # Actual
+        rx.from_iterable(articles).pipe(
+            ops.flat_map(lambda a: domainScheduler.schedule(a)),
+            ops.to_list()
+        ).run()
+
+        # Assert
+        self.assertEqual(2, maxInFlight["slow.com"])
+        self.assertEqual(2, maxInFlight["other.com"])
+
+    def test_throttled_host_slowed_down(self):
+        loggerMock = Mock(spec_set=Logger)
+        submitMock = Mock(return_value=completed(ScrapResult(429, "WebScrapException", 0.1)))
+        domainScheduler = DomainScheduler(submitMock, loggerMock, CurrentThreadScheduler(), maxConcurrency=8,
+                                          maxInterval=0.5)
+
+        # Actual
+        rx.from_iterable([article("https://a.com/1"), article("https://a.com/2")]).pipe(
+            ops.flat_map(lambda a: domainScheduler.schedule(a)),
+            ops.to_list()
+        ).run()
+
+        # Assert
+        state = domainScheduler._hosts["a.com"]
+        self.assertEqual(2, state.limit)
+        self.assertEqual(0.5, state.interval)
+        self.assertEqual(2, loggerMock.info.call_count)
+
+    def test_healthy_host_recovers(self):
+        loggerMock = Mock(spec_set=Logger)
+        results = [ScrapResult(503, "WebScrapException", 0.1)] + [ScrapResult(200, elapsed=0.1)] * 10
+        submitMock = Mock(side_effect=[completed(result) for result in results])
+        domainScheduler = DomainScheduler(submitMock, loggerMock, CurrentThreadScheduler(), maxConcurrency=4,
+                                          maxInterval=0.02)
+
+        # Actual
+        rx.from_iterable([article("https://a.com/{}".format(i)) for i in range(11)]).pipe(
+            ops.flat_map(lambda a: domainScheduler.schedule(a)),
+            ops.to_list()
+        ).run()
+
+        # Assert
+        state = domainScheduler._hosts["a.com"]
+        self.assertEqual(4, state.limit)
+        self.assertEqual(0, state.interval)
+
+    def test_latency_increase_slows_down(self):
+        loggerMock = Mock(spec_set=Logger)
+        results = [ScrapResult(200, elapsed=0.1)] * 3 + [ScrapResult(200, elapsed=5)]
+        submitMock = Mock(side_effect=[completed(result) for result in results])
+        domainScheduler = DomainScheduler(submitMock, loggerMock, CurrentThreadScheduler(), maxConcurrency=4,
+                                          maxInterval=0.01)
+
+        # Actual
+        rx.from_iterable([article("https://a.com/{}".format(i)) for i in range(4)]).pipe(
+            ops.flat_map(lambda a: domainScheduler.schedule(a)),
+            ops.to_list()
+        ).run()
+
+        # Assert
+        self.assertEqual(2, domainScheduler._hosts["a.com"].limit)
+        loggerMock.info.assert_called_once()
+
+    def test_open_circuit_skips_articles(self):
+        loggerMock = Mock(spec_set=Logger)
+        submitMock = Mock(return_value=completed(ScrapResult(None, "ConnectTimeout", 10)))
+        breaker = CircuitBreaker(loggerMock, failureThreshold=2, cooldown=60)
+        domainScheduler = DomainScheduler(submitMock, loggerMock, CurrentThreadScheduler(), maxInterval=0,
+                                          circuitBreaker=breaker)
+
+        # Actual
+        actual = rx.from_iterable([article("https://down.com/{}".format(i)) for i in range(5)]).pipe(
+            ops.flat_map(lambda a: domainScheduler.schedule(a)),
+            ops.to_list()
+        ).run()
+
+        # Assert
+        self.assertEqual(2, submitMock.call_count)
+        self.assertEqual(5, len(actual))
+        self.assertEqual(3, len([result for result in actual if result.error == CIRCUIT_OPEN]))
+        self.assertEqual({"down.com": 3}, breaker.getSkipCounts())
+
+    def test_pending_articles_limited_per_host(self):
+        loggerMock = Mock(spec_set=Logger)
+        domainScheduler = DomainScheduler(Mock(), loggerMock, CurrentThreadScheduler(), maxPending=2)
+        first, second, third = [article("https://slow.com/{}".format(i)) for i in range(3)]
+
+        # Actual
+        reserved = [domainScheduler.reservePending(a) for a in (first, second, third)]
+        otherHost = domainScheduler.reservePending(article("https://fast.com/1"))
+        domainScheduler.releasePending(first)
+        afterRelease = domainScheduler.reservePending(third)
+
+        # Assert
+        self.assertEqual([True, True, False], reserved)
+        self.assertTrue(otherHost)
+        self.assertTrue(afterRelease)
+        self.assertEqual({"slow.com": 2, "fast.com": 1}, domainScheduler._pending)
+
+
+if __name__ == '__main__':
+    unittest.main()
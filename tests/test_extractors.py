@@ -0,0 +1,133 @@
+import json
+import os
+import threading
+import unittest
+from unittest.mock import *
+
+from src.extractors import LxmlExtractor, ReadabilityExtractor, Extractor, createExtractor, getExtractor
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "extraction")
+
+
+def loadCorpus():
+    with open(os.path.join(FIXTURES, "corpus.json"), encoding="utf-8") as file:
+        corpus = json.load(file)
+    for entry in corpus:
+        with open(os.path.join(FIXTURES, entry["file"]), encoding="utf-8") as file:
+            entry["html"] = file.read()
+    return corpus
+
+
+def normalize(text):
+    return " ".join(text.split())
+
+
+class ExtractorTests(unittest.TestCase):
+    def test_lxml_extracts_corpus(self):
+        extractor = LxmlExtractor()
+
+        for entry in loadCorpus():
+            with self.subTest(entry["file"]):
+                # Actual
+                actual = extractor.extract(entry["html"], entry["url"])
+
+                # Assert
+                for expected in entry["expected"]:
+                    self.assertIn(expected, normalize(actual))
+                for boilerplate in entry["boilerplate"]:
+                    self.assertNotIn(boilerplate, actual)
+
+    def test_readability_extracts_corpus(self):
+        extractor = ReadabilityExtractor()
+
+        for entry in loadCorpus():
+            with self.subTest(entry["file"]):
+                # Actual
+                actual = extractor.extract(entry["html"])
+
+                # Assert
+                for expected in entry["expected"]:
+                    self.assertIn(expected, normalize(actual))
+
+    def test_lxml_one_block_per_line(self):
+        html = ("<html><body><article><h2>Title</h2><p>First paragraph of the article with enough text,\n"
+                "wrapped over two lines of the html source.</p><p>Second paragraph with <a href='#'>a link</a> and "
+                "more text, long enough to be scored.</p></article></body></html>")
+
+        # Actual
+        actual = LxmlExtractor().extract(html)
+
+        # Assert
+        self.assertEqual("Title\n"
+                         "First paragraph of the article with enough text, wrapped over two lines of the html source.\n"
+                         "Second paragraph with a link and more text, long enough to be scored.", actual)
+
+    def test_lxml_falls_back_without_paragraphs(self):
+        fallbackMock = Mock(spec_set=Extractor)
+        fallbackMock.extract.return_value = "fallback text"
+        html = "<html><body><div>Only a short line</div></body></html>"
+
+        # Actual
+        actual = LxmlExtractor(fallbackMock).extract(html)
+
+        # Assert
+        self.assertEqual("fallback text", actual)
+        fallbackMock.extract.assert_called_once_with(html)
+
+    def test_lxml_extracts_bytes_in_encoding(self):
+        fallbackMock = Mock(spec_set=Extractor)
+        fallbackMock.extract.return_value = "fallback text"
+        html = ("<html><body><article><p>Le café crème est servi à la terrasse, une phrase assez longue pour "
+                "être retenue comme paragraphe de l'article, avec encore quelques mots pour dépasser la longueur "
+                "minimale.</p></article></body></html>")
+
+        # Actual
+        cp1252 = LxmlExtractor(fallbackMock).extract(html.encode("cp1252"), encoding="cp1252")
+        # Encoding unknown to libxml2, the page is decoded by python
+        utf16 = LxmlExtractor(fallbackMock).extract(html.encode("utf-16-le"), encoding="utf-16-le")
+        fallback = LxmlExtractor(fallbackMock).extract("<p>Court é</p>".encode("cp1252"), encoding="cp1252")
+
+        # Assert
+        self.assertIn("Le café crème est servi à la terrasse", cp1252)
+        self.assertEqual(cp1252, utf16)
+        self.assertEqual("fallback text", fallback)
+        fallbackMock.extract.assert_called_once_with("<p>Court é</p>")
+
+    def test_lxml_empty_page(self):
+        fallbackMock = Mock(spec_set=Extractor)
+
+        # Actual
+        actual = LxmlExtractor(fallbackMock).extract("  ")
+
+        # Assert
+        self.assertEqual("", actual)
+        fallbackMock.extract.assert_not_called()
+
+    def test_createExtractor(self):
+        self.assertIsInstance(createExtractor("lxml"), LxmlExtractor)
+        self.assertIsInstance(createExtractor("readability"), ReadabilityExtractor)
+        self.assertRaises(ValueError, createExtractor, "unknown")
+
+    def test_extractor_without_extract(self):
+        # assembly
+        class IncompleteExtractor(Extractor):
+            name = "incomplete"
+
+        # Actual & Assert
+        self.assertRaises(TypeError, IncompleteExtractor)
+
+    def test_getExtractor_per_thread(self):
+        extractors = []
+
+        # Actual
+        thread = threading.Thread(target=lambda: extractors.append(getExtractor()))
+        thread.start()
+        thread.join()
+
+        # Assert
+        self.assertIs(getExtractor(), getExtractor())
+        self.assertIsNot(getExtractor(), extractors[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
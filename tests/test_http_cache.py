@@ -0,0 +1,66 @@
+import os
+import tempfile
+import time
+import unittest
+
+from src.http_cache import Validators, ResponseCache, contentHash
+
+PAGE = b"<html><body><p>Cached article</p></body></html>"
+
+
+class HttpCacheTests(unittest.TestCase):
+    def test_validators_headers_and_document(self):
+        validators = Validators('"v1"', "Wed, 21 Oct 2015 07:28:00 GMT", contentHash(PAGE))
+
+        # Assert
+        self.assertEqual({"If-None-Match": '"v1"', "If-Modified-Since": "Wed, 21 Oct 2015 07:28:00 GMT"},
+                         validators.conditionalHeaders())
+        self.assertEqual({}, Validators(None, None, contentHash(PAGE)).conditionalHeaders())
+        self.assertEqual(validators, Validators.fromDocument(validators.toDocument()))
+        self.assertIsNone(Validators.fromDocument(None))
+        self.assertEqual(Validators('"v1"', None, contentHash(PAGE)),
+                         Validators.fromResponse({"ETag": '"v1"'}, PAGE))
+
+    def test_cache_put_and_get(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ResponseCache(directory, ttl=60)
+
+            # Actual
+            cache.put("https://example.com/a", PAGE, "utf-8", Validators('"v1"', None, contentHash(PAGE)))
+            cached = cache.get("https://example.com/a")
+            missing = cache.get("https://example.com/b")
+            reopened = ResponseCache(directory, ttl=0).get("https://example.com/a")
+
+        # Assert
+        self.assertEqual(PAGE, cached.body)
+        self.assertEqual("utf-8", cached.charset)
+        self.assertEqual(Validators('"v1"', None, contentHash(PAGE)), cached.validators)
+        self.assertTrue(cached.isFresh(cache.ttl))
+        self.assertFalse(cached.isFresh(cache.ttl, now=time.time() + 120))
+        self.assertIsNone(missing)
+        self.assertFalse(reopened.isFresh(0))
+
+    def test_cache_evicts_least_recently_used(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ResponseCache(directory)
+            for i, url in enumerate(["https://example.com/1", "https://example.com/2", "https://example.com/3"]):
+                cache.put(url, PAGE, None, Validators())
+                # Entries are ordered by their last use
+                os.utime(cache._path(url), (1000 + i, 1000 + i))
+            # Room for three entries
+            cache.maxBytes = os.path.getsize(cache._path("https://example.com/1")) * 3 + 10
+            cache.get("https://example.com/1")
+
+            # Actual
+            cache.put("https://example.com/4", PAGE, None, Validators())
+
+            # Assert
+            self.assertIsNone(cache.get("https://example.com/2"))
+            self.assertIsNotNone(cache.get("https://example.com/1"))
+            self.assertIsNotNone(cache.get("https://example.com/4"))
+            self.assertLessEqual(sum(os.path.getsize(entry.path) for entry in os.scandir(directory)),
+                                 cache.maxBytes)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import socket
+import threading
+import unittest
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from unittest.mock import *
+
+from src import http_session
+from src.http_session import DnsCache, parseHostPoolSizes, createSession, getSession, getConnectionStats
+
+
+class _KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = b"<html></html>"
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class HttpSessionTests(unittest.TestCase):
+    def test_dns_cache_hit_within_ttl(self):
+        resolverMock = Mock(return_value=[("result",)])
+        cache = DnsCache(ttl=60, resolver=resolverMock)
+
+        # Actual
+        first = cache.getaddrinfo("example.com", 443, 0, socket.SOCK_STREAM)
+        second = cache.getaddrinfo("example.com", 443, 0, socket.SOCK_STREAM)
+
+        # Assert
+        self.assertEqual(first, second)
+        resolverMock.assert_called_once()
+        self.assertEqual(1, cache.hits)
+        self.assertEqual(1, cache.misses)
+
+    def test_dns_cache_expired(self):
+        resolverMock = Mock(return_value=[("result",)])
+        cache = DnsCache(ttl=0, resolver=resolverMock)
+
+        # Actual
+        cache.getaddrinfo("example.com", 443)
+        cache.getaddrinfo("example.com", 443)
+
+        # Assert
+        self.assertEqual(2, resolverMock.call_count)
+
+    def test_parseHostPoolSizes(self):
+        self.assertEqual({"thehackernews.com": 20, "example.com": 5},
+                         parseHostPoolSizes("TheHackerNews.com=20, example.com=5,invalid"))
+        self.assertEqual({}, parseHostPoolSizes(""))
+
+    @patch("src.http_session.HTTP_HOST_POOL_SIZES", "example.com=7")
+    def test_createSession_host_pool(self):
+        # Actual
+        session = createSession()
+
+        # Assert
+        self.assertEqual(7, session.get_adapter("https://example.com/article")._pool_maxsize)
+        self.assertEqual(http_session.HTTP_POOL_MAXSIZE, session.get_adapter("https://other.com/")._pool_maxsize)
+
+    def test_getSession_reuses_connections(self):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), _KeepAliveHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = "http://127.0.0.1:{}/".format(server.server_address[1])
+
+        # Actual
+        session = getSession()
+        for i in range(3):
+            session.get(url, timeout=5)
+        stats = getConnectionStats()
+        server.shutdown()
+
+        # Assert
+        self.assertIs(session, getSession())
+        self.assertEqual(3, stats["127.0.0.1"]["requests"])
+        self.assertEqual(1, stats["127.0.0.1"]["new_connections"])
+        self.assertEqual(2, stats["127.0.0.1"]["reused"])
+
+
+if __name__ == '__main__':
+    unittest.main()
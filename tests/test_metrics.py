@@ -0,0 +1,143 @@
+import json
+import os
+import socket
+import tempfile
+import threading
+import unittest
+import urllib.request
+from logging import Logger
+from unittest.mock import Mock
+
+from src.metrics import Metrics, MetricsExporter, toPrometheus, quantile, statusClass, logSummary, \
+    STAGE_SECONDS, FETCH, EXTRACT, HTTP_RESPONSES, ARTICLES_COMPLETED, LATENCY_BUCKETS
+
+
+def freePort():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class MetricsTests(unittest.TestCase):
+    def test_snapshot_merges_thread_shards(self):
+        metrics = Metrics()
+
+        def record():
+            for i in range(1000):
+                metrics.increment(ARTICLES_COMPLETED)
+                metrics.observe(STAGE_SECONDS, 0.003, FETCH)
+
+        threads = [threading.Thread(target=record) for i in range(4)]
+
+        # Actual
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        snapshot = metrics.snapshot()
+
+        # Assert
+        self.assertEqual(4000, snapshot["counters"][ARTICLES_COMPLETED][""])
+        histogram = snapshot["histograms"][STAGE_SECONDS][FETCH]
+        self.assertEqual(4000, histogram["count"])
+        self.assertAlmostEqual(12.0, histogram["sum"])
+        self.assertEqual(4000, histogram["buckets"][LATENCY_BUCKETS.index(0.005)])
+
+    def test_snapshot_merges_latest_remote_snapshot(self):
+        metrics = Metrics()
+        metrics.increment(HTTP_RESPONSES, label="2xx")
+        worker = Metrics()
+        worker.increment(HTTP_RESPONSES, 2, label="2xx")
+        worker.increment(HTTP_RESPONSES, label="5xx")
+        worker.observe(STAGE_SECONDS, 0.2, EXTRACT)
+
+        # Actual
+        metrics.updateRemote(1, {"counters": {HTTP_RESPONSES: {"2xx": 1}}, "histograms": {}})
+        metrics.updateRemote(1, worker.snapshot())
+        snapshot = metrics.snapshot()
+
+        # Assert
+        self.assertEqual({"2xx": 3, "5xx": 1}, snapshot["counters"][HTTP_RESPONSES])
+        self.assertEqual(1, snapshot["histograms"][STAGE_SECONDS][EXTRACT]["count"])
+        self.assertEqual({"2xx": 1}, metrics.snapshot(includeRemote=False)["counters"][HTTP_RESPONSES])
+
+    def test_quantile_uses_bucket_upper_bound(self):
+        metrics = Metrics()
+        for i in range(90):
+            metrics.observe(STAGE_SECONDS, 0.002, FETCH)
+        for i in range(10):
+            metrics.observe(STAGE_SECONDS, 3, FETCH)
+        histogram = metrics.snapshot()["histograms"][STAGE_SECONDS][FETCH]
+
+        # Assert
+        self.assertEqual(0.0025, quantile(histogram, 0.5))
+        self.assertEqual(5.0, quantile(histogram, 0.95))
+        self.assertIsNone(quantile({"count": 0, "buckets": [], "sum": 0}, 0.5))
+
+    def test_status_class(self):
+        self.assertEqual("2xx", statusClass(200))
+        self.assertEqual("4xx", statusClass(404))
+        self.assertEqual("error", statusClass(None))
+
+    def test_prometheus_text(self):
+        metrics = Metrics()
+        metrics.increment(HTTP_RESPONSES, label="2xx")
+        metrics.observe(STAGE_SECONDS, 0.02, FETCH)
+
+        # Actual
+        text = toPrometheus(metrics.snapshot())
+
+        # Assert
+        self.assertIn("# TYPE webscrap_stage_seconds histogram", text)
+        self.assertIn('webscrap_http_responses_total{class="2xx"} 1', text)
+        self.assertIn('webscrap_stage_seconds_bucket{stage="fetch",le="0.01"} 0', text)
+        self.assertIn('webscrap_stage_seconds_bucket{stage="fetch",le="0.025"} 1', text)
+        self.assertIn('webscrap_stage_seconds_bucket{stage="fetch",le="+Inf"} 1', text)
+        self.assertIn('webscrap_stage_seconds_count{stage="fetch"} 1', text)
+
+    def test_log_summary(self):
+        loggerMock = Mock(spec_set=Logger)
+        metrics = Metrics()
+        metrics.observe(STAGE_SECONDS, 0.02, FETCH)
+        metrics.increment(HTTP_RESPONSES, label="2xx")
+
+        # Actual
+        logSummary(loggerMock, metrics.snapshot())
+
+        # Assert
+        self.assertEqual(2, loggerMock.info.call_count)
+
+    def test_exporter_writes_snapshot(self):
+        metrics = Metrics()
+        metrics.increment(ARTICLES_COMPLETED, 5)
+        with tempfile.TemporaryDirectory() as directory:
+            snapshotFile = os.path.join(directory, "metrics.json")
+            exporter = MetricsExporter(Mock(spec_set=Logger), metrics, port=0, snapshotFile=snapshotFile,
+                                       interval=60)
+
+            # Actual
+            exporter.close()
+            with open(snapshotFile) as file:
+                snapshot = json.load(file)
+
+        # Assert
+        self.assertIsNone(exporter.port)
+        self.assertEqual({"": 5}, snapshot["counters"][ARTICLES_COMPLETED])
+
+    def test_exporter_serves_prometheus_text(self):
+        metrics = Metrics()
+        metrics.increment(ARTICLES_COMPLETED, 5)
+        exporter = MetricsExporter(Mock(spec_set=Logger), metrics, port=freePort(), snapshotFile="",
+                                   host="127.0.0.1")
+
+        # Actual
+        with urllib.request.urlopen("http://127.0.0.1:{}/metrics".format(exporter.port), timeout=5) as response:
+            body = response.read().decode()
+        exporter.close()
+
+        # Assert
+        self.assertIn("webscrap_articles_completed_total 5", body)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,14 +1,19 @@
 import unittest
+from datetime import datetime, timezone
 from logging import Logger
 from unittest.mock import *
 from uuid import UUID
 from pymongo import MongoClient
 from pymongo.collection import Collection
+from bson.binary import Binary
 
 from reactivex.scheduler import CurrentThreadScheduler
 import reactivex.operators as ops
 
-from src.mongo_service import MongoService, ArticleInfo
+from src.mongo_service import MongoService, ArticleInfo, ARTICLE_INDEXES, STORED_WEB_SCRAP, claimableQuery, \
+    nonWebScrapQuery, nonWebScrapFind, watermarkQuery
+from src.stored_html import encodeWebScrap, decodeWebScrap
+from src.http_cache import Validators
 
 UUID_1 = UUID("5d8a48c7-8799-49ba-8a61-b96c6f0d08e8")
 UUID_2 = UUID("2c398d08-22e0-4f69-955b-69fb39666a9c")
@@ -64,6 +69,68 @@ class MongoServiceTests(unittest.TestCase):
 
         mongoPatch.stop()
 
+    def test_getNonWebScrapArticleAsStream_projected_cursor(self):
+        loggerMock, collectionMock, documentMock = getMockObjects()
+        scheduler = CurrentThreadScheduler()
+
+        expectedArticle1 = ArticleInfo(UUID_1, "link 1")
+        read = []
+
+        def cursor():
+            # Fails if the whole cursor is read before the first article is emitted
+            for document in [{"_id": UUID_1, "link": "link 1"}, {"_id": UUID_2, "link": "link 2"}]:
+                read.append(document)
+                yield document
+
+        collectionMock.find.return_value = cursor()
+
+        mongoPatch = getPatches({"__getitem__.return_value.__getitem__.return_value": collectionMock})
+
+        mongoMock = mongoPatch.start()
+        mongoService = MongoService(loggerMock, scheduler)
+
+        # Actual
+        readOnFirstEmit = []
+        mongoService.getNonWebScrapArticleAsStream().pipe(
+            ops.take(1),
+            ops.do_action(on_next=lambda a: readOnFirstEmit.append(len(read))),
+            ops.to_list()
+        ).run()
+
+        # Assert
+        self.assertEqual([1], readOnFirstEmit)
+        args, kwargs = collectionMock.find.call_args
+        self.assertEqual({"_id": 1, "link": 1, "retry": 1, "validators": 1,
+                          "stored_web_scrap": STORED_WEB_SCRAP}, kwargs["projection"])
+        self.assertIn("batch_size", kwargs)
+
+        mongoPatch.stop()
+
+    def test_getNonWebScrapArticleAsStream_stored_html(self):
+        loggerMock, collectionMock, documentMock = getMockObjects()
+        scheduler = CurrentThreadScheduler()
+
+        collectionMock.find.return_value = [{"_id": UUID_1, "link": "link 1", "web_scrap": "<html></html>"},
+                                            {"_id": UUID_2, "link": "link 2", "web_scrap": None},
+                                            {"_id": UUID_3, "link": "link 3"}]
+
+        mongoPatch = getPatches({"__getitem__.return_value.__getitem__.return_value": collectionMock})
+
+        mongoMock = mongoPatch.start()
+        mongoService = MongoService(loggerMock, scheduler)
+
+        # Actual
+        actual = mongoService.getNonWebScrapArticleAsStream(includeStoredHtml=True).pipe(
+            ops.to_list()
+        ).run()
+
+        # Assert
+        self.assertEqual(["<html></html>", None, None], [article.storedHtml for article in actual])
+        self.assertEqual({"_id": 1, "link": 1, "retry": 1, "web_scrap": 1},
+                         collectionMock.find.call_args[1]["projection"])
+
+        mongoPatch.stop()
+
     def test_getNonWebScrapArticleAsStream_error_retry_success(self):
         loggerMock, collectionMock, documentMock = getMockObjects()
         scheduler = CurrentThreadScheduler()
@@ -91,6 +158,38 @@ class MongoServiceTests(unittest.TestCase):
 
         mongoPatch.stop()
 
+    def test_getNonWebScrapArticleAsStream_resumes_after_cursor_error(self):
+        loggerMock, collectionMock, documentMock = getMockObjects()
+        scheduler = CurrentThreadScheduler()
+
+        def failingCursor():
+            yield {"_id": UUID_2, "link": "link 2"}
+            yield {"_id": UUID_1, "link": "link 1"}
+            raise Exception("cursor id not found")
+
+        collectionMock.find.side_effect = [failingCursor(), [{"_id": UUID_3, "link": "link 3"}]]
+
+        mongoPatch = getPatches({"__getitem__.return_value.__getitem__.return_value": collectionMock})
+
+        mongoMock = mongoPatch.start()
+        mongoService = MongoService(loggerMock, scheduler)
+
+        # Actual
+        actual = mongoService.getNonWebScrapArticleAsStream().pipe(
+            ops.to_list()
+        ).run()
+
+        # Assert
+        self.assertEqual([UUID_2, UUID_1, UUID_3], [article.articleId for article in actual])
+        first, resumed = collectionMock.find.call_args_list
+        self.assertEqual([("_id", 1)], first[1]["sort"])
+        self.assertNotIn("_id", str(first[1]["filter"]))
+        self.assertEqual([{"web_scrap": None, "_id": {"$gt": UUID_1}},
+                          {"clean_full_text": None, "_id": {"$gt": UUID_1}}], resumed[1]["filter"]["$or"])
+        loggerMock.error.assert_called()
+
+        mongoPatch.stop()
+
     def test_getNonWebScrapArticleAsStream_error_retry_fail_complete(self):
         loggerMock, collectionMock, documentMock = getMockObjects()
         scheduler = CurrentThreadScheduler()
@@ -136,13 +235,462 @@ class MongoServiceTests(unittest.TestCase):
 
         # Actual
         actual = mongoService.insertWebScrapArticle(expectedArticle1.articleId, web_scrap),
+        mongoService.flush()
+
+        # Assert
+        collectionMock.update_one.assert_not_called()
+        collectionMock.bulk_write.assert_called_once()
+        mongoService.close()
+
+        mongoPatch.stop()
+
+    def test_insertWebScrapArticle_and_cleanText_merged(self):
+        loggerMock, collectionMock, documentMock = getMockObjects()
+        scheduler = CurrentThreadScheduler()
+
+        mongoPatch = getPatches({"__getitem__.return_value.__getitem__.return_value": collectionMock})
+
+        mongoMock = mongoPatch.start()
+        mongoService = MongoService(loggerMock, scheduler)
+
+        # Actual
+        mongoService.insertWebScrapArticle(UUID_1, "<html>Article</html>")
+        mongoService.insertCleanFullText(str(UUID_1), "Article")
+        mongoService.close()
 
         # Assert
-        loggerMock.debug.assert_called_once()
-        collectionMock.update_one.assert_called_once()
+        collectionMock.bulk_write.assert_called_once()
+        requests = collectionMock.bulk_write.call_args[0][0]
+        self.assertEqual(1, len(requests))
+        self.assertEqual({"_id": UUID_1}, requests[0]._filter)
+        update = requests[0]._doc["$set"]
+        self.assertEqual({"web_scrap", "clean_full_text"}, set(update))
+        self.assertIsInstance(update["web_scrap"], Binary)
+        self.assertEqual("<html>Article</html>", decodeWebScrap(update["web_scrap"]))
+        self.assertEqual("Article", update["clean_full_text"])
+        self.assertFalse(collectionMock.bulk_write.call_args[1]["ordered"])
 
         mongoPatch.stop()
 
+    def test_ensureIndexes_creates_missing(self):
+        loggerMock, collectionMock, documentMock = getMockObjects()
+        scheduler = CurrentThreadScheduler()
+        collectionMock.index_information.return_value = {"_id_": {"key": [("_id", 1)]}}
+
+        mongoPatch = getPatches({"__getitem__.return_value.__getitem__.return_value": collectionMock})
+
+        mongoMock = mongoPatch.start()
+        mongoService = MongoService(loggerMock, scheduler)
+
+        # Actual
+        mongoService.ensureIndexes()
+
+        # Assert
+        self.assertEqual(len(ARTICLE_INDEXES), collectionMock.create_indexes.call_count)
+        collectionMock.drop_index.assert_not_called()
+        loggerMock.error.assert_not_called()
+
+        mongoPatch.stop()
+
+    def test_watermark_index_only_in_daemon_mode(self):
+        # Assert
+        self.assertNotIn("watermark", [index.document["name"] for index in ARTICLE_INDEXES])
+
+    def test_ensureIndexes_rebuilds_outdated(self):
+        loggerMock, collectionMock, documentMock = getMockObjects()
+        scheduler = CurrentThreadScheduler()
+        collectionMock.index_information.return_value = {"web_scrap_hashed": {"key": [("web_scrap", 1)]}}
+
+        mongoPatch = getPatches({"__getitem__.return_value.__getitem__.return_value": collectionMock})
+
+        mongoMock = mongoPatch.start()
+        mongoService = MongoService(loggerMock, scheduler)
+
+        # Actual
+        mongoService.ensureIndexes()
+
+        # Assert
+        collectionMock.drop_index.assert_called_once_with("web_scrap_hashed")
+
+        mongoPatch.stop()
+
+    def test_checkQueryPlans_collscan_warning(self):
+        loggerMock, collectionMock, documentMock = getMockObjects()
+        scheduler = CurrentThreadScheduler()
+        collectionMock.find_one.return_value = {"_id": UUID_1}
+        collectionMock.find.return_value.explain.return_value = {
+            "queryPlanner": {"winningPlan": {"stage": "SUBSCAN", "inputStage": {"stage": "COLLSCAN"}}}}
+
+        mongoPatch = getPatches({"__getitem__.return_value.__getitem__.return_value": collectionMock})
+
+        mongoMock = mongoPatch.start()
+        mongoService = MongoService(loggerMock, scheduler)
+
+        # Actual
+        actual = mongoService.checkQueryPlans()
+
+        # Assert
+        self.assertEqual(3, len(actual))
+        loggerMock.warning.assert_called()
+        # The read of articles to web scrap is explained as it is run, and again as resumed after an article
+        scrapFind, summaryFind, resumedFind = [call[1] for call in collectionMock.find.call_args_list]
+        self.assertEqual(nonWebScrapFind()["sort"], scrapFind["sort"])
+        self.assertEqual(nonWebScrapFind()["projection"], scrapFind["projection"])
+        self.assertEqual({"$gt": UUID_1}, resumedFind["filter"]["$or"][0]["_id"])
+
+        mongoPatch.stop()
+
+    def test_checkQueryPlans_sort_and_id_scan_warning(self):
+        loggerMock, collectionMock, documentMock = getMockObjects()
+        scheduler = CurrentThreadScheduler()
+        collectionMock.find_one.return_value = None
+        idScan = {"stage": "IXSCAN", "keyPattern": {"_id": 1}, "indexBounds": {"_id": ["[MinKey, MaxKey]"]}}
+        sortMerge = {"stage": "SORT_MERGE", "inputStages": [
+            {"stage": "IXSCAN", "keyPattern": {"web_scrap": "hashed", "_id": 1},
+             "indexBounds": {"web_scrap": ["[1, 1]"], "_id": ["[MinKey, MaxKey]"]}}]}
+        collectionMock.find.return_value.explain.side_effect = [
+            {"queryPlanner": {"winningPlan": {"stage": "SORT", "inputStage": {"stage": "SUBPLAN"}}}},
+            {"queryPlanner": {"winningPlan": {"stage": "FETCH", "inputStage": idScan}}},
+        ]
+
+        mongoPatch = getPatches({"__getitem__.return_value.__getitem__.return_value": collectionMock})
+
+        mongoMock = mongoPatch.start()
+        mongoService = MongoService(loggerMock, scheduler)
+
+        # Actual
+        actual = mongoService.checkQueryPlans()
+        collectionMock.find.return_value.explain.side_effect = None
+        collectionMock.find.return_value.explain.return_value = {
+            "queryPlanner": {"winningPlan": {"stage": "FETCH", "inputStage": sortMerge}}}
+        merged = mongoService.checkQueryPlans()
+
+        # Assert
+        self.assertEqual(["articles to web scrap", "articles without summary"], actual)
+        self.assertIn("SORT", loggerMock.warning.call_args_list[0][0][0])
+        self.assertIn("_id index", loggerMock.warning.call_args_list[1][0][0])
+        self.assertEqual([], merged)
+
+        mongoPatch.stop()
+
+    def test_checkQueryPlans_index_scan(self):
+        loggerMock, collectionMock, documentMock = getMockObjects()
+        scheduler = CurrentThreadScheduler()
+        collectionMock.find_one.return_value = None
+        collectionMock.find.return_value.explain.return_value = {
+            "queryPlanner": {"winningPlan": {"stage": "SUBPLAN", "inputStage": {"stage": "OR", "inputStages": [
+                {"stage": "FETCH", "inputStage": {"stage": "IXSCAN"}},
+                {"stage": "FETCH", "inputStage": {"stage": "IXSCAN"}}]}}}}
+
+        mongoPatch = getPatches({"__getitem__.return_value.__getitem__.return_value": collectionMock})
+
+        mongoMock = mongoPatch.start()
+        mongoService = MongoService(loggerMock, scheduler)
+
+        # Actual
+        actual = mongoService.checkQueryPlans()
+
+        # Assert
+        self.assertEqual([], actual)
+        loggerMock.warning.assert_not_called()
+
+        mongoPatch.stop()
+
+    def test_claimNonWebScrapArticles_leases_batches(self):
+        loggerMock, collectionMock, documentMock = getMockObjects()
+        scheduler = CurrentThreadScheduler()
+        # First batch: 2 candidates, 1 claimed. Second batch: claimed by another node. Then nothing is left.
+        collectionMock.find.side_effect = [
+            [{"_id": UUID_1}, {"_id": UUID_2}],
+            [{"_id": UUID_1, "link": "link 1"}],
+            [{"_id": UUID_3}],
+            [],
+        ]
+        collectionMock.update_many.side_effect = [Mock(modified_count=1), Mock(modified_count=0)]
+
+        mongoPatch = getPatches({"__getitem__.return_value.__getitem__.return_value": collectionMock})
+
+        mongoMock = mongoPatch.start()
+        mongoService = MongoService(loggerMock, scheduler, claimArticles=True)
+
+        # Actual
+        actual = mongoService.getNonWebScrapArticleAsStream().pipe(
+            ops.to_list()
+        ).run()
+
+        # Assert
+        self.assertEqual([ArticleInfo(UUID_1, "link 1")], actual)
+        self.assertEqual(2, collectionMock.update_many.call_count)
+        claimFilter, claimUpdate = collectionMock.update_many.call_args_list[0][0]
+        self.assertEqual({"$in": [UUID_1, UUID_2]}, claimFilter["_id"])
+        self.assertIn("$or", claimFilter)
+        lease = claimUpdate["$set"]["lease"]
+        self.assertGreater(lease["expires"], datetime.now(timezone.utc))
+        readFilter = collectionMock.find.call_args_list[1][0][0]
+        self.assertEqual(lease["token"], readFilter["lease.token"])
+        self.assertEqual({"_id": 1, "link": 1, "retry": 1, "validators": 1,
+                          "stored_web_scrap": STORED_WEB_SCRAP},
+                         collectionMock.find.call_args_list[1][0][1])
+        loggerMock.error.assert_not_called()
+
+        mongoPatch.stop()
+
+    def test_getNonWebScrapArticles_reads_watermark_window(self):
+        loggerMock, collectionMock, documentMock = getMockObjects()
+        scheduler = CurrentThreadScheduler()
+        collectionMock.find.return_value = [{"_id": UUID_1, "link": "link 1"}]
+
+        mongoPatch = getPatches({"__getitem__.return_value.__getitem__.return_value": collectionMock})
+
+        mongoMock = mongoPatch.start()
+        mongoService = MongoService(loggerMock, scheduler)
+
+        # Actual
+        actual = mongoService.getNonWebScrapArticleAsStream(window=(5, 9)).pipe(
+            ops.to_list()
+        ).run()
+
+        # Assert
+        self.assertEqual([ArticleInfo(UUID_1, "link 1")], actual)
+        query = collectionMock.find.call_args[1]["filter"]
+        now = query["$and"][0]["retry.next"]["$not"]["$gt"]
+        self.assertEqual([nonWebScrapQuery(now), watermarkQuery(5, 9)], query["$and"])
+        self.assertEqual({"$gt": 5, "$lte": 9}, watermarkQuery(5, 9)["inserted_at"])
+        self.assertEqual({"$lte": 9}, watermarkQuery(None, 9)["inserted_at"])
+
+        mongoPatch.stop()
+
+    def test_watermark_is_saved_and_loaded(self):
+        loggerMock, collectionMock, documentMock = getMockObjects()
+        scheduler = CurrentThreadScheduler()
+        collectionMock.find_one.side_effect = [{"_id": UUID_1, "inserted_at": 9}, {"value": 7}, None]
+
+        mongoPatch = getPatches({"__getitem__.return_value.__getitem__.return_value": collectionMock})
+
+        mongoMock = mongoPatch.start()
+        mongoService = MongoService(loggerMock, scheduler)
+
+        # Actual
+        latest = mongoService.latestWatermark()
+        loaded = mongoService.loadWatermark()
+        missing = mongoService.loadWatermark()
+        mongoService.saveWatermark(9)
+
+        # Assert
+        self.assertEqual(9, latest)
+        self.assertEqual(7, loaded)
+        self.assertIsNone(missing)
+        stateFilter, stateUpdate = collectionMock.update_one.call_args[0]
+        self.assertEqual({"value": 9}, stateUpdate["$max"])
+        self.assertTrue(collectionMock.update_one.call_args[1]["upsert"])
+
+        mongoPatch.stop()
+
+    def test_getWebScrap_reads_compressed_and_plain(self):
+        loggerMock, collectionMock, documentMock = getMockObjects()
+        scheduler = CurrentThreadScheduler()
+        collectionMock.find_one.side_effect = [{"_id": UUID_1, "web_scrap": encodeWebScrap("<html>é</html>")},
+                                               {"_id": UUID_2, "web_scrap": "<html>plain</html>"},
+                                               None]
+
+        mongoPatch = getPatches({"__getitem__.return_value.__getitem__.return_value": collectionMock})
+
+        mongoMock = mongoPatch.start()
+        mongoService = MongoService(loggerMock, scheduler)
+
+        # Actual
+        compressed = mongoService.getWebScrap(UUID_1)
+        plain = mongoService.getWebScrap(str(UUID_2))
+        missing = mongoService.getWebScrap(UUID_3)
+
+        # Assert
+        self.assertEqual("<html>é</html>", compressed)
+        self.assertEqual("<html>plain</html>", plain)
+        self.assertIsNone(missing)
+        self.assertEqual(({"_id": UUID_2}, {"web_scrap": 1}), collectionMock.find_one.call_args_list[1][0])
+
+        mongoPatch.stop()
+
+    def test_getNonWebScrapArticles_reads_validators_of_stored_pages(self):
+        loggerMock, collectionMock, documentMock = getMockObjects()
+        scheduler = CurrentThreadScheduler()
+        validators = {"etag": '"v1"', "last_modified": None, "hash": "0123"}
+        collectionMock.find.return_value = [
+            {"_id": UUID_1, "link": "link 1", "validators": validators, "stored_web_scrap": True},
+            # Validators of pages that are no longer stored are not used
+            {"_id": UUID_2, "link": "link 2", "validators": validators, "stored_web_scrap": False},
+            {"_id": UUID_3, "link": "link 3", "stored_web_scrap": True}]
+
+        mongoPatch = getPatches({"__getitem__.return_value.__getitem__.return_value": collectionMock})
+
+        mongoMock = mongoPatch.start()
+        mongoService = MongoService(loggerMock, scheduler)
+
+        # Actual
+        actual = list(mongoService.getNonWebScrapArticles())
+        mongoService.insertValidators(UUID_1, Validators('"v2"', None, "4567"))
+        mongoService.close()
+
+        # Assert
+        self.assertEqual(Validators('"v1"', None, "0123"), actual[0].validators)
+        self.assertEqual([None, None], [article.validators for article in actual[1:]])
+        requests = collectionMock.bulk_write.call_args[0][0]
+        self.assertEqual({"$set": {"validators": {"etag": '"v2"', "last_modified": None, "hash": "4567"}}},
+                         requests[0]._doc)
+
+        mongoPatch.stop()
+
+    def test_compressStoredWebScraps_bulk_updates_strings(self):
+        loggerMock, collectionMock, documentMock = getMockObjects()
+        scheduler = CurrentThreadScheduler()
+        collectionMock.find.return_value = iter([{"_id": id, "web_scrap": "<html>{}</html>".format(id)}
+                                                 for id in (UUID_1, UUID_2, UUID_3)])
+        collectionMock.bulk_write.side_effect = lambda updates, ordered: Mock(modified_count=len(updates))
+
+        mongoPatch = getPatches({"__getitem__.return_value.__getitem__.return_value": collectionMock})
+
+        mongoMock = mongoPatch.start()
+        mongoService = MongoService(loggerMock, scheduler)
+
+        # Actual
+        actual = mongoService.compressStoredWebScraps(batchSize=2)
+
+        # Assert
+        self.assertEqual(3, actual)
+        self.assertEqual({"web_scrap": {"$type": "string"}}, collectionMock.find.call_args[0][0])
+        batches = [call[0][0] for call in collectionMock.bulk_write.call_args_list]
+        self.assertEqual([2, 1], [len(batch) for batch in batches])
+        update = batches[1][0]
+        # Web scraps written since they were read are not overwritten
+        self.assertEqual({"_id": UUID_3, "web_scrap": {"$type": "string"}}, update._filter)
+        self.assertEqual("<html>{}</html>".format(UUID_3), decodeWebScrap(update._doc["$set"]["web_scrap"]))
+
+        mongoPatch.stop()
+
+    def test_insertFetchFailure_marks_articles_not_retried(self):
+        loggerMock, collectionMock, documentMock = getMockObjects()
+        scheduler = CurrentThreadScheduler()
+        nextAttempt = datetime.now(timezone.utc)
+
+        mongoPatch = getPatches({"__getitem__.return_value.__getitem__.return_value": collectionMock})
+
+        mongoMock = mongoPatch.start()
+        mongoService = MongoService(loggerMock, scheduler)
+
+        # Actual
+        mongoService.insertFetchFailure(UUID_1, 2, "ConnectTimeout", None, nextAttempt)
+        mongoService.insertFetchFailure(UUID_2, 1, "WebScrapException", 404, None)
+        mongoService.clearFetchFailure(UUID_3)
+        mongoService.close()
+
+        # Assert
+        requests = {request._filter["_id"]: request._doc["$set"]
+                    for request in collectionMock.bulk_write.call_args[0][0]}
+        self.assertEqual({"retry": {"attempts": 2, "error": "ConnectTimeout", "status": None, "next": nextAttempt}},
+                         requests[UUID_1])
+        self.assertEqual("failed", requests[UUID_2]["fetch_status"])
+        self.assertIsNone(requests[UUID_2]["retry"]["next"])
+        self.assertEqual({"retry": None}, requests[UUID_3])
+
+        mongoPatch.stop()
+
+    def test_copyFetchResults_copies_written_articles(self):
+        loggerMock, collectionMock, documentMock = getMockObjects()
+        scheduler = CurrentThreadScheduler()
+        startedAt = datetime(2024, 5, 1, 12, 0, 0)
+        collectionMock.find.return_value = [
+            {"_id": UUID_1, "web_scrap": "page", "clean_full_text": "text",
+             "fetched_at": datetime(2024, 5, 1, 12, 0, 1)},
+            {"_id": UUID_2, "web_scrap": "old page", "fetched_at": datetime(2024, 5, 1, 11, 0, 0)},
+        ]
+        copies = [(UUID_1, startedAt, [UUID_3]), (UUID_2, startedAt, ["legacy-id"])]
+
+        mongoPatch = getPatches({"__getitem__.return_value.__getitem__.return_value": collectionMock})
+
+        mongoMock = mongoPatch.start()
+        mongoService = MongoService(loggerMock, scheduler)
+
+        # Actual
+        written, waiting = mongoService.copyFetchResults(copies)
+
+        # Assert
+        self.assertEqual(1, written)
+        self.assertEqual([copies[1]], waiting)
+        update, = collectionMock.bulk_write.call_args[0][0]
+        self.assertEqual({"_id": {"$in": [UUID_3]}}, update._filter)
+        self.assertEqual("page", update._doc["$set"]["web_scrap"])
+        self.assertEqual("text", update._doc["$set"]["clean_full_text"])
+        self.assertIsNone(update._doc["$set"]["retry"])
+
+        mongoPatch.stop()
+
+    def test_copyFetchResults_copies_stored_articles(self):
+        loggerMock, collectionMock, documentMock = getMockObjects()
+        scheduler = CurrentThreadScheduler()
+        collectionMock.find.return_value = [{"_id": UUID_1, "web_scrap": "page",
+                                             "fetched_at": datetime(2024, 5, 1, 11, 0, 0)}]
+
+        mongoPatch = getPatches({"__getitem__.return_value.__getitem__.return_value": collectionMock})
+
+        mongoMock = mongoPatch.start()
+        mongoService = MongoService(loggerMock, scheduler)
+
+        # Actual
+        written, waiting = mongoService.copyFetchResults([(UUID_1, None, [UUID_2]), (UUID_3, None, [UUID_2])])
+
+        # Assert
+        self.assertEqual(1, written)
+        self.assertEqual([(UUID_3, None, [UUID_2])], waiting)
+        update, = collectionMock.bulk_write.call_args[0][0]
+        self.assertEqual("page", update._doc["$set"]["web_scrap"])
+
+        mongoPatch.stop()
+
+    def test_nonWebScrapQuery_skips_articles_not_due(self):
+        now = datetime.now(timezone.utc)
+
+        # Actual
+        actual = nonWebScrapQuery(now)
+
+        # Assert
+        self.assertEqual({"$not": {"$gt": now}}, actual["retry.next"])
+        self.assertEqual({"$nin": ["skipped", "failed", "no_text"]}, actual["fetch_status"])
+
+    def test_nonWebScrapQuery_includes_articles_without_text_when_reprocessing(self):
+        now = datetime.now(timezone.utc)
+
+        # Actual
+        actual = nonWebScrapQuery(now, includeNoText=True)
+        claimed = claimableQuery(now, includeNoText=True)
+
+        # Assert
+        self.assertEqual({"$nin": ["skipped", "failed"]}, actual["fetch_status"])
+        self.assertEqual(actual, claimed["$and"][0])
+        self.assertEqual(actual["fetch_status"], nonWebScrapFind(includeStoredHtml=True)["filter"]["fetch_status"])
+
+    def test_claimableQuery_excludes_active_leases(self):
+        now = datetime.now(timezone.utc)
+
+        # Actual
+        actual = claimableQuery(now)
+
+        # Assert
+        self.assertEqual(nonWebScrapQuery(now), actual["$and"][0])
+        self.assertEqual([{"lease.expires": None}, {"lease.expires": {"$lt": now}}], actual["$and"][1]["$or"])
+
+    def test_articleInfo_compact_id(self):
+        # Actual
+        fromUuid = ArticleInfo(UUID_1, "link 1")
+        fromString = ArticleInfo(str(UUID_1), "link 1")
+        fromBinary = ArticleInfo(Binary.from_uuid(UUID_1), "link 1")
+
+        # Assert
+        self.assertEqual(UUID_1.bytes, fromUuid.idBytes)
+        self.assertEqual(UUID_1, fromUuid.articleId)
+        self.assertEqual(fromUuid, fromString)
+        self.assertEqual(fromUuid, fromBinary)
+        self.assertFalse(hasattr(fromUuid, "__dict__"))
+        self.assertIsNone(ArticleInfo("legacy-id", "link 1").idBytes)
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
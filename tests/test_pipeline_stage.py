@@ -0,0 +1,115 @@
+import threading
+import unittest
+
+from src.pipeline_stage import PipelineStage, ConcurrencyLimit
+
+
+class PipelineStageTests(unittest.TestCase):
+    def test_submit_returns_result(self):
+        stage = PipelineStage("test", 2, 2)
+
+        # Actual
+        future = stage.submit(lambda a, b: a + b, 1, 2)
+
+        # Assert
+        self.assertEqual(3, future.result(timeout=5))
+        stage.shutdown()
+        self.assertEqual(1, stage.completed)
+        self.assertEqual((0, 0), stage.depth())
+
+    def test_submit_blocks_when_full(self):
+        stage = PipelineStage("test", 1, 1)
+        release = threading.Event()
+        stage.submit(release.wait)
+        stage.submit(release.wait)
+        submitted = threading.Event()
+
+        # Actual
+        thread = threading.Thread(target=lambda: (stage.submit(lambda: None), submitted.set()))
+        thread.start()
+        blockedWhileFull = not submitted.wait(0.2)
+        depthWhileFull = stage.depth()
+        release.set()
+
+        # Assert
+        self.assertTrue(blockedWhileFull)
+        self.assertEqual((1, 1), depthWhileFull)
+        self.assertTrue(submitted.wait(5))
+        thread.join()
+        stage.shutdown()
+        self.assertEqual(3, stage.completed)
+        self.assertEqual(1, stage.maxQueued)
+
+    def test_observe(self):
+        stage = PipelineStage("test", 1, 1)
+        calls = []
+
+        # Actual
+        observable = stage.observe(lambda: calls.append(1) or "done")
+        callsBeforeSubscribe = len(calls)
+        result = observable.run()
+
+        # Assert
+        self.assertEqual(0, callsBeforeSubscribe)
+        self.assertEqual("done", result)
+        stage.shutdown()
+
+
+    def test_observe_reports_accepted_task(self):
+        stage = PipelineStage("test", 1, 0)
+        release = threading.Event()
+        submitted = []
+
+        # Actual
+        stage.observe(release.wait, onSubmitted=lambda: submitted.append(1)).subscribe()
+        release.set()
+        stage.shutdown()
+
+        # Assert
+        self.assertEqual(1, len(submitted))
+        self.assertEqual(1, stage.completed)
+
+
+class ConcurrencyLimitTests(unittest.TestCase):
+    def test_counts_articles_in_use(self):
+        limit = ConcurrencyLimit(2)
+
+        # Actual
+        limit.acquire()
+        limit.started()
+        limit.acquire()
+        limit.started()
+        waiting = threading.Thread(target=limit.acquire, daemon=True)
+        waiting.start()
+        waiting.join(0.05)
+        blocked = waiting.is_alive()
+        inUseWhileFull = limit.inUse
+        limit.release()
+        waiting.join(1)
+
+        # Assert
+        self.assertTrue(blocked)
+        self.assertFalse(waiting.is_alive())
+        self.assertEqual(2, inUseWhileFull)
+        self.assertEqual(1, limit.inUse)
+
+    def test_raised_limit_starts_waiting_articles(self):
+        limit = ConcurrencyLimit(1)
+        limit.acquire()
+        waiting = threading.Thread(target=limit.acquire, daemon=True)
+        waiting.start()
+
+        # Actual
+        waiting.join(0.05)
+        blockedBefore = waiting.is_alive()
+        limit.setLimit(2)
+        waiting.join(1)
+
+        # Assert
+        self.assertTrue(blockedBefore)
+        self.assertFalse(waiting.is_alive())
+        self.assertEqual(2, limit.limit)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import os
+import pstats
+import sys
+import tempfile
+import threading
+import unittest
+from logging import Logger
+from unittest.mock import Mock
+
+from src.profiling import createProfileDir, runProfiled, writeReport, StackSampler, CPROFILE, SAMPLE, REPORT_FILE
+
+
+def busyWork(count):
+    return sum(i * i for i in range(count))
+
+
+def workInThread():
+    thread = threading.Thread(target=busyWork, args=[200000])
+    thread.start()
+    thread.join()
+    return busyWork(1000)
+
+
+class ProfilingTests(unittest.TestCase):
+    def test_create_profile_dir(self):
+        with tempfile.TemporaryDirectory() as directory:
+            # Actual
+            disabled = createProfileDir("", directory)
+            path = createProfileDir(SAMPLE, directory)
+
+            # Assert
+            self.assertIsNone(disabled)
+            self.assertTrue(os.path.isdir(path))
+            self.assertRaises(ValueError, createProfileDir, "unknown", directory)
+
+    def test_cprofile_profiles_threads_and_writes_report(self):
+        loggerMock = Mock(spec_set=Logger)
+        with tempfile.TemporaryDirectory() as directory:
+            # Actual
+            result = runProfiled(CPROFILE, directory, "worker", workInThread)
+            report = writeReport(directory, loggerMock, top=5)
+            profiles = [name for name in os.listdir(directory) if name.endswith(".prof")]
+            stats = pstats.Stats(os.path.join(directory, profiles[0]))
+            with open(report) as file:
+                reportText = file.read()
+
+        # Assert
+        self.assertEqual(busyWork(1000), result)
+        self.assertEqual(1, len(profiles))
+        calls = {function[2]: value[1] for function, value in stats.stats.items()}
+        # Called once by the started thread and once by the profiled function
+        self.assertEqual(2, calls["busyWork"])
+        self.assertIn("Top 5 functions by tottime", reportText)
+        self.assertEqual(os.path.join(directory, REPORT_FILE), report)
+
+    def test_sample_mode_writes_merged_report(self):
+        loggerMock = Mock(spec_set=Logger)
+        with tempfile.TemporaryDirectory() as directory:
+            # Actual
+            runProfiled(SAMPLE, directory, "first", busyWork, 3000000)
+            runProfiled(SAMPLE, directory, "second", busyWork, 10)
+            report = writeReport(directory, loggerMock)
+            with open(report) as file:
+                reportText = file.read()
+
+        # Assert
+        self.assertIn("of 2 processes", reportText)
+        self.assertIn("Top 30 functions by cpu samples", reportText)
+        loggerMock.info.assert_called()
+
+    def test_sampler_counts_functions_and_idle_threads(self):
+        sampler = StackSampler()
+        waiting = threading.Event()
+        started = threading.Event()
+
+        def blocked():
+            started.set()
+            waiting.wait()
+
+        thread = threading.Thread(target=blocked)
+        thread.start()
+        started.wait()
+        frames = sys._current_frames()
+        sampledFrames = {thread.ident: frames[thread.ident], threading.get_ident(): frames[threading.get_ident()]}
+
+        # Actual
+        sampler.sample(sampledFrames, onCpu={threading.get_ident()})
+        waiting.set()
+        thread.join()
+
+        # Assert
+        self.assertEqual(2, sampler.samples)
+        self.assertEqual(1, sampler.idle)
+        self.assertEqual(1, sum(sampler.cpuCounts.values()))
+        self.assertTrue(any("test_sampler_counts_functions_and_idle_threads" in name
+                            for name in sampler.cumulativeCounts))
+        self.assertEqual(1, len(sampler.stacks))
+
+    def test_report_without_profiles(self):
+        loggerMock = Mock(spec_set=Logger)
+        with tempfile.TemporaryDirectory() as directory:
+            # Actual
+            report = writeReport(directory, loggerMock)
+
+        # Assert
+        self.assertIsNone(report)
+        loggerMock.warning.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,31 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+
+from src.retry_policy import retryDelay, failureOutcome, nextAttempt, RETRY, PERMANENT, EXHAUSTED
+
+
+class RetryPolicyTests(unittest.TestCase):
+    def test_retry_delay_doubles_up_to_maximum(self):
+        # Actual
+        delays = [retryDelay(attempts, baseDelay=60, maxDelay=300) for attempts in range(1, 6)]
+
+        # Assert
+        self.assertEqual([60, 120, 240, 300, 300], delays)
+
+    def test_failure_outcome(self):
+        # Assert
+        self.assertEqual(RETRY, failureOutcome(1, 503, retries=3))
+        self.assertEqual(RETRY, failureOutcome(3, None, retries=3))
+        self.assertEqual(EXHAUSTED, failureOutcome(4, None, retries=3))
+        self.assertEqual(PERMANENT, failureOutcome(1, 404, retries=3))
+        self.assertEqual(PERMANENT, failureOutcome(1, 410, retries=3))
+
+    def test_next_attempt(self):
+        now = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+        # Assert
+        self.assertEqual(now + timedelta(seconds=retryDelay(2)), nextAttempt(2, now))
+
+
+if __name__ == '__main__':
+    unittest.main()
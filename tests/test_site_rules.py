@@ -0,0 +1,115 @@
+import json
+import os
+import tempfile
+import unittest
+from logging import Logger
+from unittest.mock import *
+
+from src.extractors import LxmlExtractor, Extractor
+from src.site_rules import SiteRules, toXPath
+
+RULES = {
+    "example.com": {"content": "//div[@id='story']", "remove": "css:div.promo"},
+    "broken.com": {"content": "//div[@id="},
+}
+PAGE = ("<html><body><div id='story'><p>Story text that is extracted by the rule of the site.</p>"
+        "<div class='promo'>Read more stories</div></div>"
+        "<div id='other'><p>Generic text, long enough to win the generic container scoring of the page, "
+        "with several commas, clauses, and words, so that it is chosen by the generic extractor.</p></div>"
+        "</body></html>")
+
+
+class SiteRulesTests(unittest.TestCase):
+    def test_toXPath(self):
+        self.assertEqual("//div[@id='story']", toXPath("//div[@id='story']"))
+        self.assertEqual("descendant-or-self::div[@class and contains(concat(' ', normalize-space(@class), ' '), "
+                         "' promo ')]", toXPath("css:div.promo"))
+
+    def test_find_matches_parent_domains(self):
+        loggerMock = Mock(spec_set=Logger)
+        siteRules = SiteRules(loggerMock, RULES, rulesFile="")
+
+        # Actual
+        host, rule = siteRules.find("https://www.example.com/story")
+        subHost, subRule = siteRules.find("https://news.example.com/story")
+        otherHost, otherRule = siteRules.find("https://other.com/story")
+
+        # Assert
+        self.assertEqual(("example.com", "example.com"), (host, rule.host))
+        self.assertEqual(("news.example.com", "example.com"), (subHost, subRule.host))
+        self.assertEqual(("other.com", None), (otherHost, otherRule))
+        self.assertIs(rule, subRule)
+
+    def test_invalid_rule_ignored(self):
+        loggerMock = Mock(spec_set=Logger)
+        siteRules = SiteRules(loggerMock, RULES, rulesFile="")
+
+        # Actual
+        host, rule = siteRules.find("https://broken.com/story")
+
+        # Assert
+        self.assertIsNone(rule)
+        loggerMock.error.assert_called_once()
+
+    def test_rules_file_loaded(self):
+        loggerMock = Mock(spec_set=Logger)
+        with tempfile.TemporaryDirectory() as directory:
+            rulesFile = os.path.join(directory, "rules.json")
+            with open(rulesFile, "w", encoding="utf-8") as file:
+                json.dump({"file.com": {"content": "//main"}}, file)
+
+            # Actual
+            siteRules = SiteRules(loggerMock, {}, rulesFile=rulesFile)
+
+        # Assert
+        self.assertEqual("file.com", siteRules.find("https://file.com/a")[1].host)
+        loggerMock.error.assert_not_called()
+
+    def test_extract_with_rule_counts_hit(self):
+        loggerMock = Mock(spec_set=Logger)
+        fallbackMock = Mock(spec_set=Extractor)
+        siteRules = SiteRules(loggerMock, RULES, rulesFile="")
+        extractor = LxmlExtractor(fallbackMock, siteRules)
+
+        # Actual
+        actual = extractor.extract(PAGE, "https://example.com/story")
+
+        # Assert
+        self.assertEqual("Story text that is extracted by the rule of the site.", actual)
+        self.assertEqual({"example.com": 1}, siteRules.hits)
+        self.assertEqual({}, siteRules.misses)
+
+    def test_extract_without_rule_counts_miss(self):
+        loggerMock = Mock(spec_set=Logger)
+        fallbackMock = Mock(spec_set=Extractor)
+        siteRules = SiteRules(loggerMock, RULES, rulesFile="")
+        extractor = LxmlExtractor(fallbackMock, siteRules)
+
+        # Actual
+        actual = extractor.extract(PAGE, "https://other.com/story")
+        extractor.extract(PAGE.replace("story", "moved"), "https://example.com/story")
+        extractor.extract(PAGE)
+
+        # Assert
+        self.assertTrue(actual.startswith("Generic text"))
+        self.assertEqual({}, siteRules.hits)
+        self.assertEqual({"other.com": 1, "example.com": 1}, siteRules.misses)
+
+    def test_logStats_orders_by_misses(self):
+        loggerMock = Mock(spec_set=Logger)
+        siteRules = SiteRules(loggerMock, RULES, rulesFile="")
+        siteRules.recordHit("example.com")
+        siteRules.recordMiss("other.com")
+        siteRules.recordMiss("other.com")
+
+        # Actual
+        siteRules.logStats(loggerMock)
+
+        # Assert
+        self.assertEqual([call("Site rules for %s: %s hits, %s misses", "other.com", 0, 2),
+                          call("Site rules for %s: %s hits, %s misses", "example.com", 1, 0)],
+                         loggerMock.info.call_args_list)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+
+from bson import BSON
+from bson.binary import Binary, USER_DEFINED_SUBTYPE
+
+from src.stored_html import encodeWebScrap, decodeWebScrap, ZLIB_FORMAT
+
+PAGE = "<html><body>{}</body></html>".format("<p>Café crème à la carte</p>" * 50)
+
+
+class StoredHtmlTests(unittest.TestCase):
+    def test_round_trip_compressed(self):
+        # Actual
+        stored = encodeWebScrap(PAGE)
+
+        # Assert
+        self.assertIsInstance(stored, Binary)
+        self.assertEqual(USER_DEFINED_SUBTYPE, stored.subtype)
+        self.assertEqual(ZLIB_FORMAT, stored[0])
+        self.assertLess(len(stored), len(PAGE.encode()) / 5)
+        self.assertEqual(PAGE, decodeWebScrap(stored))
+        # Read back from BSON as the driver returns it
+        self.assertEqual(PAGE, decodeWebScrap(BSON.encode({"web_scrap": stored}).decode()["web_scrap"]))
+
+    def test_plain_values(self):
+        # Actual
+        stored = encodeWebScrap(PAGE, compression="none")
+
+        # Assert
+        self.assertEqual(PAGE, stored)
+        self.assertIsInstance(stored, str)
+        self.assertEqual(PAGE, decodeWebScrap(stored))
+        self.assertIsNone(encodeWebScrap(None))
+        self.assertIsNone(decodeWebScrap(None))
+
+    def test_unknown_compression_and_marker(self):
+        # Assert
+        self.assertRaises(ValueError, encodeWebScrap, PAGE, "lzma")
+        self.assertRaises(ValueError, decodeWebScrap, Binary(b"\x7fdata", USER_DEFINED_SUBTYPE))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,168 @@
+import queue
+import threading
+import unittest
+from uuid import UUID
+
+from src.http_cache import Validators
+from src.mongo_service import ArticleInfo
+from src.scrap_result import ScrapResult
+from src.stored_html import encodeWebScrap, decodeWebScrap
+from src.task_channel import BatchSender, endChannel, receiveBatches, encodeTask, decodeTask, encodeResult, \
+    decodeResult
+
+UUID_1 = UUID("5d8a48c7-8799-49ba-8a61-b96c6f0d08e8")
+
+
+class TaskChannelTests(unittest.TestCase):
+    def test_items_received_in_order(self):
+        processQueue = queue.Queue()
+        sender = BatchSender(processQueue, 4)
+
+        # Actual
+        for i in range(10):
+            sender.put(i)
+        sender.close()
+        endChannel(processQueue)
+        actual = list(receiveBatches(processQueue))
+
+        # Assert
+        self.assertEqual(list(range(10)), actual)
+        self.assertEqual(10, sender.itemCount)
+
+    def test_batches_limited_to_max_batch(self):
+        blockSend = threading.Event()
+        sent = []
+
+        class BlockingQueue:
+            def put(self, batch):
+                blockSend.wait()
+                sent.append(batch)
+
+        sender = BatchSender(BlockingQueue(), 3)
+
+        # Actual
+        # The first item is sent alone while the others wait behind it
+        for i in range(8):
+            sender.put(i)
+        blockSend.set()
+        sender.close()
+
+        # Assert
+        self.assertEqual(list(range(8)), [item for batch in sent for item in batch])
+        self.assertTrue(all(len(batch) <= 3 for batch in sent))
+        self.assertLess(len(sent), 8)
+
+    def test_end_channel_stops_receiver(self):
+        processQueue = queue.Queue()
+        processQueue.put([1, 2])
+        endChannel(processQueue)
+        processQueue.put([3])
+
+        # Actual
+        actual = list(receiveBatches(processQueue))
+
+        # Assert
+        self.assertEqual([1, 2], actual)
+
+    def test_task_round_trip(self):
+        article = ArticleInfo(UUID_1, "https://example.com/é")
+
+        # Actual
+        data = encodeTask(article, 42, 1700000000.5)
+        actual, taskId, submittedAt = decodeTask(data)
+
+        # Assert
+        self.assertEqual(article, actual)
+        self.assertEqual(UUID_1, actual.articleId)
+        self.assertIsNone(actual.storedHtml)
+        self.assertEqual(42, taskId)
+        self.assertEqual(1700000000.5, submittedAt)
+        self.assertEqual(38 + len("https://example.com/é".encode()), len(data))
+
+    def test_task_round_trip_stored_html(self):
+        article = ArticleInfo(UUID_1, "https://example.com", "<html>é</html>")
+
+        # Actual
+        actual, taskId, submittedAt = decodeTask(encodeTask(article, 1))
+
+        # Assert
+        self.assertEqual("<html>é</html>", actual.storedHtml)
+        self.assertEqual(article, actual)
+
+    def test_task_round_trip_compressed_stored_html(self):
+        storedHtml = encodeWebScrap("<html>é</html>")
+        article = ArticleInfo(UUID_1, "https://example.com", storedHtml)
+
+        # Actual
+        actual, taskId, submittedAt = decodeTask(encodeTask(article, 1))
+
+        # Assert
+        self.assertEqual(bytes(storedHtml), actual.storedHtml)
+        self.assertEqual("<html>é</html>", decodeWebScrap(actual.storedHtml))
+
+    def test_task_round_trip_validators(self):
+        validators = Validators('W/"abc"', "Wed, 21 Oct 2015 07:28:00 GMT", "0123456789abcdef")
+        etagOnly = Validators('"v1"', None, None)
+
+        # Actual
+        actual = decodeTask(encodeTask(ArticleInfo(UUID_1, "https://example.com", validators=validators), 1))[0]
+        actualEtagOnly = decodeTask(encodeTask(ArticleInfo(UUID_1, "https://example.com", validators=etagOnly), 2))[0]
+        pickled = decodeTask(encodeTask(ArticleInfo("legacy-id", "https://example.com", validators=validators), 3))[0]
+
+        # Assert
+        self.assertEqual(validators, actual.validators)
+        self.assertIsNone(actual.storedHtml)
+        self.assertEqual(etagOnly, actualEtagOnly.validators)
+        self.assertEqual(validators, pickled.validators)
+
+    def test_task_round_trip_attempts(self):
+        # Actual
+        actual = decodeTask(encodeTask(ArticleInfo(UUID_1, "https://example.com", attempts=2), 1))[0]
+        capped = decodeTask(encodeTask(ArticleInfo(UUID_1, "https://example.com", attempts=1000), 2))[0]
+        pickled = decodeTask(encodeTask(ArticleInfo("legacy-id", "https://example.com", attempts=3), 3))[0]
+
+        # Assert
+        self.assertEqual(2, actual.attempts)
+        self.assertEqual(255, capped.attempts)
+        self.assertEqual(3, pickled.attempts)
+
+    def test_task_round_trip_duplicates(self):
+        duplicateIds = [UUID("2c398d08-22e0-4f69-955b-69fb39666a9c"), UUID("8c819db1-3dfa-4343-b6e7-9b73495fcdec")]
+
+        # Actual
+        actual = decodeTask(encodeTask(ArticleInfo(UUID_1, "https://example.com", duplicateIds=duplicateIds), 1))[0]
+        single = decodeTask(encodeTask(ArticleInfo(UUID_1, "https://example.com"), 2))[0]
+        pickled = decodeTask(encodeTask(ArticleInfo(UUID_1, "https://example.com", duplicateIds=["legacy-id"]), 3))[0]
+
+        # Assert
+        self.assertEqual(tuple(duplicateIds), actual.duplicateIds)
+        self.assertEqual("https://example.com", actual.articleUrl)
+        self.assertEqual((), single.duplicateIds)
+        self.assertEqual(("legacy-id",), pickled.duplicateIds)
+        self.assertEqual(UUID_1, pickled.articleId)
+
+    def test_task_round_trip_non_uuid_id(self):
+        article = ArticleInfo("legacy-id", "https://example.com")
+
+        # Actual
+        actual, taskId, submittedAt = decodeTask(encodeTask(article, 7, 12.5))
+
+        # Assert
+        self.assertEqual("legacy-id", actual.articleId)
+        self.assertEqual(7, taskId)
+        self.assertEqual(12.5, submittedAt)
+
+    def test_result_round_trip(self):
+        # Actual
+        success = decodeResult(encodeResult(1, ScrapResult(200, None, 0.5)))
+        failure = decodeResult(encodeResult(2, ScrapResult(None, "ConnectTimeout", 10)))
+        missing = decodeResult(encodeResult(3, None))
+
+        # Assert
+        self.assertEqual((1, 200, None, 0.5), (success[0], success[1].status, success[1].error, success[1].elapsed))
+        self.assertEqual((2, None, "ConnectTimeout"), (failure[0], failure[1].status, failure[1].error))
+        self.assertEqual((3, None), missing)
+
+
+if __name__ == '__main__':
+    unittest.main()
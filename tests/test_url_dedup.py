@@ -0,0 +1,128 @@
+import unittest
+from uuid import UUID
+
+from src.http_cache import Validators
+from src.mongo_service import ArticleInfo
+from src.scrap_result import ScrapResult
+from src.url_dedup import canonicalUrl, isTrackingParameter, UrlRegistry
+
+UUID_1 = UUID("5d8a48c7-8799-49ba-8a61-b96c6f0d08e8")
+UUID_2 = UUID("2c398d08-22e0-4f69-955b-69fb39666a9c")
+UUID_3 = UUID("8c819db1-3dfa-4343-b6e7-9b73495fcdec")
+
+
+class CanonicalUrlTests(unittest.TestCase):
+    def test_tracking_parameters_and_fragment_removed(self):
+        # Actual
+        actual = canonicalUrl("https://example.com/story?id=7&utm_source=feed&UTM_Medium=rss&fbclid=x#comments")
+
+        # Assert
+        self.assertEqual("https://example.com/story?id=7", actual)
+
+    def test_host_normalized(self):
+        # Assert
+        self.assertEqual("https://example.com/", canonicalUrl("HTTPS://Example.COM.:443"))
+        self.assertEqual("http://example.com:8080/a", canonicalUrl("http://example.com:8080/a"))
+        self.assertEqual("http://[::1]:8080/a", canonicalUrl("http://[::1]:8080/a"))
+        self.assertEqual("http://user@example.com/a", canonicalUrl("http://user@Example.com:80/a"))
+
+    def test_other_parameters_kept_in_order(self):
+        # Assert
+        self.assertEqual("https://example.com/a?b=2&a=1&utmost=3",
+                         canonicalUrl("https://example.com/a?b=2&utm_campaign=x&a=1&utmost=3"))
+
+    def test_unparsable_url_kept(self):
+        # Assert
+        self.assertEqual("http://example.com:port/a", canonicalUrl(" http://example.com:port/a "))
+
+    def test_tracking_parameter_prefixes(self):
+        # Assert
+        self.assertTrue(isTrackingParameter("utm_term", ("utm_*",)))
+        self.assertTrue(isTrackingParameter("GCLID", ("gclid",)))
+        self.assertFalse(isTrackingParameter("gclid_x", ("gclid",)))
+
+
+class UrlRegistryTests(unittest.TestCase):
+    def test_duplicates_of_queued_article_sent_with_it(self):
+        registry = UrlRegistry()
+        article = ArticleInfo(UUID_1, "https://example.com/story?utm_source=a")
+        duplicate = ArticleInfo(UUID_2, "https://EXAMPLE.com/story#top")
+        results = []
+
+        # Actual
+        firstGroup, firstFetched = registry.join(article)
+        group, fetched = registry.join(duplicate)
+        registry.waitFor(group).subscribe(on_next=results.append)
+        registry.start(article)
+        registry.complete(article, ScrapResult(200))
+
+        # Assert
+        self.assertTrue(firstFetched)
+        self.assertFalse(fetched)
+        self.assertEqual((UUID_2,), article.duplicateIds)
+        self.assertEqual([200], [result.status for result in results])
+        self.assertEqual([], registry.takeCopies())
+
+    def test_duplicates_of_started_article_copied(self):
+        registry = UrlRegistry()
+        article = ArticleInfo(UUID_1, "https://example.com/story")
+        results = []
+
+        # Actual
+        registry.join(article)
+        registry.start(article)
+        inFlight, fetched = registry.join(ArticleInfo(UUID_2, "https://example.com/story?utm_medium=rss"))
+        registry.waitFor(inFlight).subscribe(on_next=results.append)
+        registry.complete(article, ScrapResult(200))
+        done, fetched = registry.join(ArticleInfo(UUID_3, "https://example.com/story"))
+        registry.waitFor(done).subscribe(on_next=results.append)
+        copies = registry.takeCopies()
+
+        # Assert
+        self.assertEqual((), article.duplicateIds)
+        self.assertEqual(2, len(results))
+        self.assertEqual([UUID_1, UUID_1], [copy[0] for copy in copies])
+        self.assertEqual([[UUID_2], [UUID_3]], [copy[2] for copy in copies])
+        self.assertIsNotNone(copies[0][1])
+
+    def test_articles_never_submitted_not_copied(self):
+        registry = UrlRegistry()
+        article = ArticleInfo(UUID_1, "https://example.com/story")
+
+        # Actual
+        registry.join(article)
+        registry.complete(article, ScrapResult(error="CircuitOpen"))
+        registry.join(ArticleInfo(UUID_2, "https://example.com/story"))
+
+        # Assert
+        self.assertEqual([], registry.takeCopies())
+
+    def test_stored_pages_and_previous_runs_not_tracked(self):
+        registry = UrlRegistry()
+        validators = Validators('"v1"', None, "hash")
+
+        # Actual
+        registry.join(ArticleInfo(UUID_1, "https://example.com/a", validators=validators))
+        storedFetched = registry.join(ArticleInfo(UUID_2, "https://example.com/a", validators=validators))[1]
+        registry.join(ArticleInfo(UUID_1, "https://example.com/b"))
+        registry.reset()
+        resetFetched = registry.join(ArticleInfo(UUID_3, "https://example.com/b"))[1]
+
+        # Assert
+        self.assertTrue(storedFetched)
+        self.assertTrue(resetFetched)
+
+    def test_copies_not_written_returned_until_timeout(self):
+        registry = UrlRegistry()
+        copies = [(UUID_1, None, [UUID_2], float("-inf")), (UUID_1, None, [UUID_3], float("inf"))]
+
+        # Actual
+        left = registry.returnCopies(copies)
+
+        # Assert
+        self.assertEqual(1, left)
+        self.assertEqual([copies[1]], registry.takeCopies())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,11 +1,29 @@
+import tempfile
+import threading
 import unittest
+from concurrent.futures import Future
+from datetime import datetime, timedelta, timezone
+from uuid import uuid4
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 from unittest.mock import *
 
 from logging import Logger
-from reactivex.scheduler import CurrentThreadScheduler
+from reactivex.scheduler import CurrentThreadScheduler, ThreadPoolScheduler
+from reactivex.subject import Subject
 
-from src.web_scrap import WebScrap, get_raw_page, webScrap, remove_ads, html_escape, logIfFailed
+from src.web_scrap import WebScrap, get_raw_page, webScrap, remove_ads, html_escape, logIfFailed, AsyncFetchEngine, \
+    ScrapResult, RawPage, saveWebScrap, reprocessWebScrap
+from src.metrics import getMetrics, EXTRACTIONS
+from src.http_cache import Validators, ResponseCache, contentHash
+from src.config import RETRY_BASE_DELAY, MAX_SET_ASIDE_ARTICLES
 from src.mongo_service import *
+from src.exceptions import SkippedContentException, WatermarkFieldException
+from src.scrap_result import SKIPPED, TRUNCATED, NO_TEXT
+from src.stored_html import encodeWebScrap
+from src.pipeline_stage import PipelineStage
+from benchmarks.mongo_standin import matches
+from pymongo.collection import Collection
+import requests
 from unittest import mock
 
 from src.web_scrap_processor import WebScrapProcessor
@@ -13,6 +31,14 @@ from src.web_scrap_processor import WebScrapProcessor
 UUID_1 = UUID("5d8a48c7-8799-49ba-8a61-b96c6f0d08e8")
 UUID_2 = UUID("2c398d08-22e0-4f69-955b-69fb39666a9c")
 UUID_3 = UUID("8c819db1-3dfa-4343-b6e7-9b73495fcdec")
+UUID_4 = UUID("0f4a1e7e-3a55-4bd6-a3a0-9f9a1f6c2d11")
+
+
+def completedFuture(result):
+    future = Future()
+    future.set_result(result)
+    return future
+
 
 def getMockObjects():
     loggerMock = Mock(spec_set=Logger)
@@ -21,23 +47,68 @@ def getMockObjects():
 
     return loggerMock, mongoServiceMock, webScrapProcessorMock
 
+TEST_PAGE = b"<html><body><article><p>Article body text for the async fetch test.</p></article></body></html>"
+LARGE_PAGE = b"<html><body><article><p>" + b"Large article body text. " * 4000 + b"</p></article></body></html>"
+
+
+TEST_PAGE_ETAG = '"v1"'
+
+
+class _TestPageHandler(BaseHTTPRequestHandler):
+    # Paths of requests answered with 304 Not Modified
+    notModified = []
+
+    def do_GET(self):
+        if self.path in ("/missing", "/unavailable"):
+            self.send_response(404 if self.path == "/missing" else 503)
+            self.end_headers()
+            return
+        if self.headers.get("If-None-Match") == TEST_PAGE_ETAG:
+            _TestPageHandler.notModified.append(self.path)
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = LARGE_PAGE if self.path == "/large" else TEST_PAGE
+        self.send_response(200)
+        self.send_header("Content-Type", "application/pdf" if self.path == "/document.pdf" else
+                         "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", TEST_PAGE_ETAG)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def startTestServer():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _TestPageHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, "http://127.0.0.1:{}".format(server.server_address[1])
+
+
 class WebScrapingTests(unittest.TestCase):
     def _mock_response(
             self,
             status=200,
             text="TEST"):
-        mock_resp = mock.Mock()
+        # Responses are used as context managers
+        mock_resp = mock.MagicMock()
         # set status code and content
         mock_resp.status_code = status
         mock_resp.text = text
+        mock_resp.content = text.encode()
+        mock_resp.headers = {"Content-Type": "text/html; charset=utf-8"}
+        mock_resp.encoding = "utf-8"
+        mock_resp.iter_content.return_value = [text.encode()]
         return mock_resp
 
-    @mock.patch('src.web_scrap.requests.get')
-    def test_processed_web_scrap_success(self, mock_get):
+    @mock.patch('src.web_scrap.getSession')
+    def test_processed_web_scrap_success(self, mock_session):
         # assembly
         loggerMock, mongoServiceMock, webScrapProcessorMock = getMockObjects()
         mock_resp = self._mock_response(text="TEST")
-        mock_get.return_value = mock_resp
+        mock_session.return_value.get.return_value = mock_resp
 
         article = ArticleInfo(UUID_1, "http://test.com")
 
@@ -51,6 +122,404 @@ class WebScrapingTests(unittest.TestCase):
         mongoServiceMock.insertWebScrapArticle.assert_called_once()
         loggerMock.error.assert_not_called()
 
+    @mock.patch('src.web_scrap.getSession')
+    def test_reprocess_stored_web_scrap(self, mock_session):
+        # assembly
+        loggerMock, mongoServiceMock, webScrapProcessorMock = getMockObjects()
+        article = ArticleInfo(UUID_1, "http://test.com", TEST_PAGE.decode())
+
+        scheduler = CurrentThreadScheduler()
+
+        # Actual
+        webScrap(article, loggerMock, mongoServiceMock, scheduler).run()
+
+        # Assert
+        mock_session.assert_not_called()
+        mongoServiceMock.insertWebScrapArticle.assert_not_called()
+        mongoServiceMock.insertCleanFullText.assert_called_once()
+        self.assertIn("Article body text", mongoServiceMock.insertCleanFullText.call_args[0][1])
+        loggerMock.error.assert_not_called()
+
+    def test_reprocess_page_without_text_marked(self):
+        # assembly
+        loggerMock, mongoServiceMock, webScrapProcessorMock = getMockObjects()
+        article = ArticleInfo(UUID_1, "http://test.com/empty", encodeWebScrap("<html><body></body></html>"))
+        before = getMetrics().snapshot()["counters"].get(EXTRACTIONS, {}).get(NO_TEXT, 0)
+
+        # Actual
+        reprocessWebScrap(article, mongoServiceMock)
+
+        # Assert
+        mongoServiceMock.insertCleanFullText.assert_not_called()
+        mongoServiceMock.markNoText.assert_called_once_with(UUID_1)
+        self.assertEqual(before + 1, getMetrics().snapshot()["counters"][EXTRACTIONS][NO_TEXT])
+
+    def test_reprocess_pipeline_reads_stored_web_scrap(self):
+        # assembly
+        loggerMock, mongoServiceMock, webScrapProcessorMock = getMockObjects()
+        article = ArticleInfo(UUID_1, "http://test.com", TEST_PAGE.decode())
+
+        scheduler = CurrentThreadScheduler()
+
+        mongoServiceMock.getNonWebScrapArticleAsStream.return_value = rx.of(article)
+        webScrapProcessorMock.submitArticle.return_value = completedFuture(ScrapResult())
+
+        web_scraper = WebScrap(loggerMock, mongoServiceMock, scheduler, webScrapProcessorMock, reprocess=True)
+
+        # Actual
+        web_scraper.buildWebScrapPipeline().subscribe(scheduler=scheduler)
+
+        # Assert
+        mongoServiceMock.getNonWebScrapArticleAsStream.assert_called_once_with(includeStoredHtml=True, window=None)
+        webScrapProcessorMock.submitArticle.assert_called_once_with(article)
+        self.assertEqual({}, web_scraper.domainScheduler._hosts)
+        loggerMock.error.assert_not_called()
+
+    def test_daemon_polls_articles_after_watermark(self):
+        # assembly
+        loggerMock, mongoServiceMock, webScrapProcessorMock = getMockObjects()
+        article = ArticleInfo(UUID_1, "http://test.com", TEST_PAGE.decode())
+        stopEvent = threading.Event()
+
+        def latestWatermark():
+            # The startup check is followed by polls, the second poll finds no new articles and stops the daemon
+            if mongoServiceMock.latestWatermark.call_count == 3:
+                stopEvent.set()
+            return 7
+
+        mongoServiceMock.loadWatermark.return_value = 5
+        mongoServiceMock.latestWatermark.side_effect = latestWatermark
+        mongoServiceMock.getNonWebScrapArticleAsStream.return_value = rx.of(article)
+        webScrapProcessorMock.submitArticle.return_value = completedFuture(ScrapResult())
+
+        web_scraper = WebScrap(loggerMock, mongoServiceMock, CurrentThreadScheduler(), webScrapProcessorMock)
+
+        # Actual
+        web_scraper.runDaemon(stopEvent, pollInterval=0, fullSweepInterval=3600)
+
+        # Assert
+        mongoServiceMock.getNonWebScrapArticleAsStream.assert_called_once_with(includeStoredHtml=False,
+                                                                               window=(5, 7))
+        webScrapProcessorMock.submitArticle.assert_called_once_with(article)
+        mongoServiceMock.saveWatermark.assert_called_once_with(7)
+        self.assertEqual(1, web_scraper.articleCount)
+        loggerMock.error.assert_not_called()
+
+    def test_daemon_sweeps_without_saved_watermark(self):
+        # assembly
+        loggerMock, mongoServiceMock, webScrapProcessorMock = getMockObjects()
+        stopEvent = threading.Event()
+        mongoServiceMock.loadWatermark.return_value = None
+        mongoServiceMock.latestWatermark.return_value = None
+        mongoServiceMock.hasArticles.return_value = False
+        mongoServiceMock.getNonWebScrapArticleAsStream.side_effect = lambda **kwargs: rx.empty().pipe(
+            ops.finally_action(stopEvent.set))
+
+        web_scraper = WebScrap(loggerMock, mongoServiceMock, CurrentThreadScheduler(), webScrapProcessorMock)
+
+        # Actual
+        web_scraper.runDaemon(stopEvent, pollInterval=0)
+
+        # Assert
+        mongoServiceMock.getNonWebScrapArticleAsStream.assert_called_once_with(includeStoredHtml=False, window=None)
+        mongoServiceMock.saveWatermark.assert_not_called()
+        loggerMock.warning.assert_called_once()
+
+    def test_daemon_stops_when_no_article_has_watermark_field(self):
+        # assembly
+        loggerMock, mongoServiceMock, webScrapProcessorMock = getMockObjects()
+        mongoServiceMock.latestWatermark.return_value = None
+        mongoServiceMock.hasArticles.return_value = True
+
+        web_scraper = WebScrap(loggerMock, mongoServiceMock, CurrentThreadScheduler(), webScrapProcessorMock)
+
+        # Actual
+        with self.assertRaises(WatermarkFieldException):
+            web_scraper.runDaemon(threading.Event(), pollInterval=0)
+
+        # Assert
+        mongoServiceMock.getNonWebScrapArticleAsStream.assert_not_called()
+        mongoServiceMock.saveWatermark.assert_not_called()
+
+    def test_daemon_stops_on_uuid_watermark(self):
+        # assembly
+        loggerMock, mongoServiceMock, webScrapProcessorMock = getMockObjects()
+        mongoServiceMock.latestWatermark.return_value = UUID_1
+
+        web_scraper = WebScrap(loggerMock, mongoServiceMock, CurrentThreadScheduler(), webScrapProcessorMock)
+
+        # Actual
+        with self.assertRaises(WatermarkFieldException):
+            web_scraper.runDaemon(threading.Event(), pollInterval=0)
+
+        # Assert
+        mongoServiceMock.getNonWebScrapArticleAsStream.assert_not_called()
+
+    def test_async_engine_web_scrap_success(self):
+        # assembly
+        loggerMock, mongoServiceMock, webScrapProcessorMock = getMockObjects()
+        server, url = startTestServer()
+        article = ArticleInfo(UUID_1, url + "/article")
+        completed = threading.Event()
+
+        # Actual
+        engine = AsyncFetchEngine(loggerMock, mongoServiceMock, concurrency=10)
+        engine.submit(article, lambda result: completed.set())
+        self.assertTrue(completed.wait(10))
+        engine.close()
+        server.shutdown()
+
+        # Assert
+        mongoServiceMock.insertWebScrapArticle.assert_called_once_with(UUID_1, TEST_PAGE.decode())
+        mongoServiceMock.insertCleanFullText.assert_called_once()
+        self.assertIn("Article body text", mongoServiceMock.insertCleanFullText.call_args[0][1])
+        loggerMock.error.assert_not_called()
+
+    def test_async_engine_web_scrap_fail(self):
+        # assembly
+        loggerMock, mongoServiceMock, webScrapProcessorMock = getMockObjects()
+        server, url = startTestServer()
+        article = ArticleInfo(UUID_1, url + "/missing")
+        completed = threading.Event()
+
+        # Actual
+        engine = AsyncFetchEngine(loggerMock, mongoServiceMock, concurrency=10)
+        engine.submit(article, lambda result: completed.set())
+        self.assertTrue(completed.wait(10))
+        engine.close()
+        server.shutdown()
+
+        # Assert
+        # Pages that are gone are not retried
+        mongoServiceMock.insertFetchFailure.assert_called_once_with(UUID_1, 1, "WebScrapException", 404, None)
+        mongoServiceMock.insertWebScrapArticle.assert_not_called()
+        mongoServiceMock.insertCleanFullText.assert_not_called()
+        loggerMock.error.assert_called_once()
+
+    def test_web_scrap_failure_backs_off(self):
+        # assembly
+        loggerMock, mongoServiceMock, webScrapProcessorMock = getMockObjects()
+        server, url = startTestServer()
+        article = ArticleInfo(UUID_1, url + "/unavailable", attempts=1)
+        recovered = ArticleInfo(UUID_2, url + "/article", attempts=2)
+        scheduler = CurrentThreadScheduler()
+
+        # Actual
+        before = datetime.now(timezone.utc)
+        webScrap(article, loggerMock, mongoServiceMock, scheduler).run()
+        webScrap(recovered, loggerMock, mongoServiceMock, scheduler).run()
+        server.shutdown()
+
+        # Assert
+        articleId, attempts, error, status, nextAttempt = mongoServiceMock.insertFetchFailure.call_args[0]
+        self.assertEqual((UUID_1, 2, "WebScrapException", 503), (articleId, attempts, error, status))
+        # The second failure waits twice the base delay
+        self.assertGreaterEqual(nextAttempt, before + timedelta(seconds=2 * RETRY_BASE_DELAY))
+        mongoServiceMock.clearFetchFailure.assert_called_once_with(UUID_2)
+        mongoServiceMock.insertWebScrapArticle.assert_called_once_with(UUID_2, TEST_PAGE.decode())
+
+    def test_async_engine_skips_content_type(self):
+        # assembly
+        loggerMock, mongoServiceMock, webScrapProcessorMock = getMockObjects()
+        server, url = startTestServer()
+        article = ArticleInfo(UUID_1, url + "/document.pdf")
+        completed = threading.Event()
+
+        # Actual
+        engine = AsyncFetchEngine(loggerMock, mongoServiceMock, concurrency=10)
+        engine.submit(article, lambda result: completed.set())
+        self.assertTrue(completed.wait(10))
+        engine.close()
+        server.shutdown()
+
+        # Assert
+        mongoServiceMock.insertWebScrapArticle.assert_not_called()
+        mongoServiceMock.insertFetchFailure.assert_not_called()
+        mongoServiceMock.insertFetchStatus.assert_called_once_with(UUID_1, SKIPPED, "application/pdf")
+        loggerMock.error.assert_not_called()
+
+    def test_async_engine_not_modified_page_not_saved(self):
+        # assembly
+        loggerMock, mongoServiceMock, webScrapProcessorMock = getMockObjects()
+        server, url = startTestServer()
+        article = ArticleInfo(UUID_1, url + "/stored", validators=Validators(TEST_PAGE_ETAG, None, "stored hash"))
+        mongoServiceMock.getWebScrap.return_value = TEST_PAGE.decode()
+        completed = threading.Event()
+
+        # Actual
+        engine = AsyncFetchEngine(loggerMock, mongoServiceMock, concurrency=10)
+        engine.submit(article, lambda result: completed.set())
+        self.assertTrue(completed.wait(10))
+        engine.close()
+        server.shutdown()
+
+        # Assert
+        self.assertIn("/stored", _TestPageHandler.notModified)
+        mongoServiceMock.insertWebScrapArticle.assert_not_called()
+        mongoServiceMock.insertValidators.assert_not_called()
+        # The clean text the article lacks is extracted from its stored page
+        mongoServiceMock.getWebScrap.assert_called_once_with(UUID_1)
+        self.assertIn("Article body text", mongoServiceMock.insertCleanFullText.call_args[0][1])
+        loggerMock.error.assert_not_called()
+
+    def test_not_modified_page_saves_clean_text_once(self):
+        # assembly
+        loggerMock, _, _ = getMockObjects()
+        server, url = startTestServer()
+        collectionMock = Mock(spec_set=Collection)
+        document = {"_id": UUID_1, "link": url + "/revalidated", "web_scrap": encodeWebScrap(TEST_PAGE.decode()),
+                    "validators": {"etag": TEST_PAGE_ETAG}, "clean_full_text": None}
+        collectionMock.find_one.return_value = document
+        article = ArticleInfo(UUID_1, document["link"], validators=Validators(TEST_PAGE_ETAG, None, "stored hash"))
+
+        with patch("src.mongo_service.MongoClient") as clientMock:
+            clientMock.return_value.__getitem__.return_value.__getitem__.return_value = collectionMock
+            mongoService = MongoService(loggerMock, CurrentThreadScheduler())
+
+        # Actual
+        webScrap(article, loggerMock, mongoService, CurrentThreadScheduler()).run()
+        mongoService.close()
+        server.shutdown()
+
+        # Assert
+        self.assertIn("/revalidated", _TestPageHandler.notModified)
+        update, = collectionMock.bulk_write.call_args[0][0]
+        # Nothing but the missing clean text is written, not even the fetch time
+        self.assertEqual({"clean_full_text"}, set(update._doc["$set"]))
+        document.update(update._doc["$set"])
+        self.assertIn("Article body text", document["clean_full_text"])
+        self.assertFalse(matches(document, nonWebScrapQuery()))
+
+    def test_unchanged_page_without_text_not_revalidated_again(self):
+        # assembly
+        loggerMock, mongoServiceMock, webScrapProcessorMock = getMockObjects()
+        article = ArticleInfo(UUID_1, "http://test.com/empty", validators=Validators(TEST_PAGE_ETAG, None, "hash"))
+        mongoServiceMock.getWebScrap.return_value = "<html><body></body></html>"
+
+        # Actual
+        saveWebScrap(article, RawPage(b"", None, article.validators, notModified=True), mongoServiceMock,
+                     ScrapResult(304))
+
+        # Assert
+        mongoServiceMock.insertCleanFullText.assert_not_called()
+        mongoServiceMock.markNoText.assert_called_once_with(UUID_1)
+        self.assertFalse(matches({"_id": UUID_1, "web_scrap": "<html></html>", "fetch_status": NO_TEXT},
+                                 nonWebScrapQuery()))
+
+    def test_fetched_page_without_text_marked(self):
+        # assembly
+        loggerMock, mongoServiceMock, webScrapProcessorMock = getMockObjects()
+        article = ArticleInfo(UUID_1, "http://test.com/empty")
+
+        # Actual
+        saveWebScrap(article, RawPage(b"<html><body></body></html>", "utf-8"), mongoServiceMock, ScrapResult(200))
+
+        # Assert
+        mongoServiceMock.insertWebScrapArticle.assert_called_once()
+        mongoServiceMock.insertCleanFullText.assert_not_called()
+        mongoServiceMock.markNoText.assert_called_once_with(UUID_1)
+        stored = {"_id": UUID_1, "web_scrap": "<html></html>", "fetch_status": NO_TEXT}
+        self.assertFalse(matches(stored, nonWebScrapQuery()))
+        # Reprocess mode extracts it again
+        self.assertTrue(matches(stored, nonWebScrapFind(includeStoredHtml=True)["filter"]))
+
+    def test_web_scrap_skips_unchanged_content_hash(self):
+        # assembly
+        loggerMock, mongoServiceMock, webScrapProcessorMock = getMockObjects()
+        server, url = startTestServer()
+        # Pages stored before their server sent validators are compared by their content hash
+        unchanged = ArticleInfo(UUID_1, url + "/article", validators=Validators(None, None, contentHash(TEST_PAGE)))
+        changed = ArticleInfo(UUID_2, url + "/article", validators=Validators(None, None, "previous hash"))
+        scheduler = CurrentThreadScheduler()
+
+        # Actual
+        webScrap(unchanged, loggerMock, mongoServiceMock, scheduler).run()
+        webScrap(changed, loggerMock, mongoServiceMock, scheduler).run()
+        server.shutdown()
+
+        # Assert
+        mongoServiceMock.insertWebScrapArticle.assert_called_once_with(UUID_2, TEST_PAGE.decode())
+        mongoServiceMock.insertValidators.assert_called_once_with(
+            UUID_2, Validators(TEST_PAGE_ETAG, None, contentHash(TEST_PAGE)))
+        # The unchanged article lacked clean text, which is extracted from the page without saving it again
+        self.assertEqual([UUID_1, UUID_2], [call[0][0] for call in mongoServiceMock.insertCleanFullText.call_args_list])
+
+    @mock.patch('src.web_scrap.getSession')
+    def test_fetch_reported_before_extraction(self, mock_session):
+        # assembly
+        loggerMock, mongoServiceMock, webScrapProcessorMock = getMockObjects()
+        mock_session.return_value.get.return_value = self._mock_response(text="TEST")
+        extractStage = PipelineStage("extract", 1, 1)
+        extracting = threading.Event()
+        release = threading.Event()
+        mongoServiceMock.insertWebScrapArticle.side_effect = lambda *args: (extracting.set(), release.wait(5))
+        fetched = []
+        results = []
+
+        # Actual
+        webScrap(ArticleInfo(UUID_1, "http://test.com"), loggerMock, mongoServiceMock, CurrentThreadScheduler(),
+                 extractStage, fetched.append).subscribe(on_next=results.append)
+        self.assertTrue(extracting.wait(5))
+        fetchedWhileExtracting = list(fetched)
+        release.set()
+        extractStage.shutdown()
+
+        # Assert
+        self.assertEqual(1, len(fetchedWhileExtracting))
+        self.assertEqual(200, fetchedWhileExtracting[0].status)
+        self.assertEqual(1, len(fetched))
+
+    def test_get_raw_page_revalidates_cached_response(self):
+        loggerMock, _, _ = getMockObjects()
+        server, url = startTestServer()
+
+        # Actual
+        with tempfile.TemporaryDirectory() as directory, \
+                mock.patch('src.web_scrap.getResponseCache', return_value=ResponseCache(directory)), \
+                requests.Session() as session:
+            downloaded = get_raw_page(url + "/cached", loggerMock, session)
+            revalidated = get_raw_page(url + "/cached", loggerMock, session)
+        server.shutdown()
+
+        # Assert
+        self.assertEqual(TEST_PAGE.decode(), downloaded)
+        self.assertEqual(TEST_PAGE.decode(), revalidated)
+        self.assertEqual(["/cached"], [path for path in _TestPageHandler.notModified if path == "/cached"])
+
+    def test_get_raw_page_skips_content_type(self):
+        loggerMock, _, _ = getMockObjects()
+        server, url = startTestServer()
+        result = ScrapResult()
+
+        # Actual
+        with requests.Session() as session:
+            self.assertRaises(SkippedContentException, get_raw_page, url + "/document.pdf", loggerMock, session,
+                              result)
+        server.shutdown()
+
+        # Assert
+        self.assertEqual(SKIPPED, result.fetchStatus)
+        self.assertEqual("application/pdf", result.contentType)
+
+    @mock.patch('src.web_scrap.MAX_DOWNLOAD_BYTES', 1000)
+    def test_get_raw_page_truncates_large_page(self):
+        loggerMock, _, _ = getMockObjects()
+        server, url = startTestServer()
+        result = ScrapResult()
+
+        # Actual
+        with requests.Session() as session:
+            page = get_raw_page(url + "/large", loggerMock, session, result)
+            fullPage = get_raw_page(url + "/article", loggerMock, session)
+        server.shutdown()
+
+        # Assert
+        self.assertEqual(LARGE_PAGE[:1000].decode(), page)
+        self.assertEqual(TEST_PAGE.decode(), fullPage)
+        self.assertEqual(TRUNCATED, result.fetchStatus)
+        self.assertEqual("text/html", result.contentType)
+        loggerMock.error.assert_not_called()
+
     def test_web_scrap_success(self):
         # assembly
         loggerMock, mongoServiceMock, webScrapProcessorMock = getMockObjects()
@@ -60,6 +529,7 @@ class WebScrapingTests(unittest.TestCase):
         scheduler = CurrentThreadScheduler()
 
         mongoServiceMock.getNonWebScrapArticleAsStream.return_value = rx.of(article)
+        webScrapProcessorMock.submitArticle.return_value = completedFuture(ScrapResult(200))
 
         web_scraper = WebScrap(
             loggerMock,
@@ -76,6 +546,132 @@ class WebScrapingTests(unittest.TestCase):
         webScrapProcessorMock.submitArticle.assert_called_once()
         loggerMock.error.assert_not_called()
 
+    def test_duplicate_links_fetched_once(self):
+        # assembly
+        loggerMock, mongoServiceMock, webScrapProcessorMock = getMockObjects()
+        articles = [ArticleInfo(UUID_1, "http://test.com/a?utm_source=feed"),
+                    ArticleInfo(UUID_2, "http://TEST.com/a#top"),
+                    ArticleInfo(UUID_3, "http://test.com/b")]
+
+        scheduler = CurrentThreadScheduler()
+        futures = []
+
+        def submitArticle(article):
+            futures.append(Future())
+            return futures[-1]
+
+        # The last article is read once the others completed
+        lateArticle = ArticleInfo(UUID_4, "http://test.com/b?utm_medium=rss")
+        late = Subject()
+        mongoServiceMock.getNonWebScrapArticleAsStream.return_value = rx.concat(rx.from_iterable(articles), late)
+        mongoServiceMock.copyFetchResults.return_value = (1, [])
+        webScrapProcessorMock.submitArticle.side_effect = submitArticle
+        results = []
+
+        web_scraper = WebScrap(loggerMock, mongoServiceMock, scheduler, webScrapProcessorMock)
+
+        # Actual
+        web_scraper.buildWebScrapPipeline().subscribe(on_next=results.append, scheduler=scheduler)
+        for future in futures:
+            future.set_result(ScrapResult(200))
+        late.on_next(lateArticle)
+        late.on_completed()
+        web_scraper.copyDuplicates(final=True)
+
+        # Assert
+        self.assertEqual([articles[0], articles[2]],
+                         [call[0][0] for call in webScrapProcessorMock.submitArticle.call_args_list])
+        self.assertEqual((UUID_2,), articles[0].duplicateIds)
+        self.assertEqual(4, len(results))
+        copies = mongoServiceMock.copyFetchResults.call_args[0][0]
+        self.assertEqual([(UUID_3, [UUID_4])], [(copy[0], copy[2]) for copy in copies])
+        loggerMock.error.assert_not_called()
+
+    def test_articles_of_saturated_host_set_aside(self):
+        # assembly
+        loggerMock, mongoServiceMock, webScrapProcessorMock = getMockObjects()
+        articles = [ArticleInfo(UUID_1, "http://slow.com/1"), ArticleInfo(UUID_2, "http://slow.com/2"),
+                    ArticleInfo(UUID_3, "http://fast.com/1")]
+        mongoServiceMock.getNonWebScrapArticleAsStream.return_value = rx.from_iterable(articles)
+        futures = []
+
+        def submitArticle(article):
+            futures.append(Future())
+            return futures[-1]
+
+        webScrapProcessorMock.submitArticle.side_effect = submitArticle
+        scheduler = CurrentThreadScheduler()
+        web_scraper = WebScrap(loggerMock, mongoServiceMock, scheduler, webScrapProcessorMock)
+        web_scraper.domainScheduler.maxPending = 1
+        results = []
+
+        # Actual
+        web_scraper.buildWebScrapPipeline().subscribe(on_next=results.append, scheduler=scheduler)
+        setAsideWhileSaturated = MAX_SET_ASIDE_ARTICLES - web_scraper.setAsideSemaphore._value
+        pendingWhileSaturated = dict(web_scraper.domainScheduler._pending)
+        for future in futures:
+            future.set_result(ScrapResult(200))
+
+        # Assert
+        self.assertEqual(articles, [call[0][0] for call in webScrapProcessorMock.submitArticle.call_args_list])
+        self.assertEqual(1, setAsideWhileSaturated)
+        self.assertEqual({"slow.com": 1, "fast.com": 1}, pendingWhileSaturated)
+        self.assertEqual(3, len(results))
+        self.assertEqual({}, web_scraper.domainScheduler._pending)
+        self.assertEqual(MAX_SET_ASIDE_ARTICLES, web_scraper.setAsideSemaphore._value)
+
+    def test_large_backlog_of_saturated_host_processed(self):
+        # assembly
+        loggerMock, mongoServiceMock, webScrapProcessorMock = getMockObjects()
+        articles = [ArticleInfo(uuid4(), "http://slow.com/{}".format(i)) for i in range(3000)]
+        mongoServiceMock.getNonWebScrapArticleAsStream.return_value = rx.from_iterable(articles)
+        webScrapProcessorMock.submitArticle.side_effect = lambda article: completedFuture(ScrapResult(200))
+        web_scraper = WebScrap(loggerMock, mongoServiceMock, ThreadPoolScheduler(4), webScrapProcessorMock,
+                               dedupUrls=False)
+        web_scraper.domainScheduler.maxPending = 2
+        web_scraper.setAsideSemaphore = threading.BoundedSemaphore(10)
+
+        # Actual
+        actual = web_scraper.runPass()
+
+        # Assert
+        self.assertEqual(3000, actual)
+        self.assertEqual(3000, webScrapProcessorMock.submitArticle.call_count)
+        self.assertEqual({}, web_scraper.domainScheduler._pending)
+        loggerMock.error.assert_not_called()
+
+    def test_save_web_scrap_writes_duplicates(self):
+        # assembly
+        loggerMock, mongoServiceMock, webScrapProcessorMock = getMockObjects()
+        article = ArticleInfo(UUID_1, "http://test.com", duplicateIds=[UUID_2, UUID_3])
+
+        # Actual
+        saveWebScrap(article, RawPage(TEST_PAGE, "utf-8"), mongoServiceMock, ScrapResult(200))
+
+        # Assert
+        names = [call[0] for call in mongoServiceMock.method_calls]
+        self.assertEqual("setDuplicates", names[0])
+        self.assertEqual("clearDuplicates", names[-1])
+        self.assertIn("insertWebScrapArticle", names)
+        mongoServiceMock.setDuplicates.assert_called_once_with(UUID_1, (UUID_2, UUID_3))
+        mongoServiceMock.insertFetchTime.assert_called_once_with(UUID_1)
+
+    def test_save_unchanged_page_copies_stored_page_to_duplicates(self):
+        # assembly
+        loggerMock, mongoServiceMock, webScrapProcessorMock = getMockObjects()
+        validators = Validators(None, None, contentHash(TEST_PAGE))
+        article = ArticleInfo(UUID_1, "http://test.com", validators=validators, duplicateIds=[UUID_2])
+
+        # Actual
+        saveWebScrap(article, RawPage(TEST_PAGE, "utf-8", validators), mongoServiceMock, ScrapResult(200))
+
+        # Assert
+        names = [call[0] for call in mongoServiceMock.method_calls]
+        self.assertEqual(["copyFetchResults", "setDuplicates", "insertCleanFullText", "clearDuplicates"], names)
+        mongoServiceMock.copyFetchResults.assert_called_once_with([(UUID_1, None, (UUID_2,))])
+        mongoServiceMock.insertFetchTime.assert_not_called()
+        mongoServiceMock.insertWebScrapArticle.assert_not_called()
+
     def test_extractor_error_db_read_handled(self):
         # assembly
         loggerMock, mongoServiceMock, webScrapProcessorMock = getMockObjects()